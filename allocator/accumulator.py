@@ -0,0 +1,230 @@
+"""
+Redis-native accumulator for the all-time aggregate sums (AGGREGATE_BACKEND='redis').
+
+Per-category sums, counts and sums of squares live in one Redis hash as
+integers (basis points and basis points squared), so there is no float
+drift. A submission is applied when its transaction commits with one
+pipelined MULTI of HINCRBY calls: no Celery hop, no row locks. Tier 2 of the
+aggregate snapshot reads the whole hash with one HGETALL.
+
+CategoryAggregate stays the durable copy: checkpoint() writes the hash into it
+periodically, and seed() adds it back into an empty hash (first use, Redis
+flushed). Every write is additive, so increments that land before the seed
+are kept. The hash also records the submission id its baseline covers (the
+rebuild's AggregateWatermark): a late add() for a submission at or below it
+is already in the rows the hash is seeded from, and is skipped. When the
+cache is not Redis (LocMemCache in development and tests) an in-process dict
+with the same semantics is used instead.
+"""
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .buffer import get_redis
+import threading
+
+ACCUMULATOR_KEY = 'aggregate_accumulator'
+SEED_LOCK_KEY = 'aggregate_accumulator_seed_lock'
+SEEDED_FIELD = 'seeded'
+MARK_FIELD = 'mark'
+
+# Check the mark and apply the increments in one atomic step
+ADD_SCRIPT = """
+local mark = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if tonumber(ARGV[2]) <= mark then
+    return 0
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+_local_hash = {}
+_local_lock = threading.Lock()
+
+
+def _increments(allocations):
+    """HINCRBY arguments for {category_id: basis_points}"""
+    for category_id, basis_points in allocations.items():
+        yield f'{category_id}:sum', basis_points
+        yield f'{category_id}:count', 1
+        yield f'{category_id}:squares', basis_points * basis_points
+
+
+def _apply(increments, seeded_through=None):
+    """
+    Apply (field, amount) increments atomically (one MULTI on Redis).
+    
+    seeded_through marks the hash as seeded, with a baseline covering every
+    submission up to that id.
+    """
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            for field, amount in increments:
+                _local_hash[field] = _local_hash.get(field, 0) + amount
+            if seeded_through is not None:
+                _local_hash[SEEDED_FIELD] = 1
+                _local_hash[MARK_FIELD] = seeded_through
+        return
+    key = cache.make_key(ACCUMULATOR_KEY)
+    pipe = client.pipeline(transaction=True)
+    for field, amount in increments:
+        pipe.hincrby(key, field, amount)
+    if seeded_through is not None:
+        pipe.hset(key, mapping={SEEDED_FIELD: 1, MARK_FIELD: seeded_through})
+    pipe.execute()
+
+
+def add(allocations, submission_id):
+    """
+    Add one submission, given as {category_id: basis_points}.
+    
+    Skipped when submission_id is at or below the hash's mark: the rows the
+    hash is (re)seeded from already count it.
+    """
+    increments = list(_increments(allocations))
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            if submission_id <= _local_hash.get(MARK_FIELD, 0):
+                return False
+            for field, amount in increments:
+                _local_hash[field] = _local_hash.get(field, 0) + amount
+        return True
+    args = [MARK_FIELD, submission_id]
+    for field, amount in increments:
+        args += [field, amount]
+    return bool(client.register_script(ADD_SCRIPT)(keys=[cache.make_key(ACCUMULATOR_KEY)], args=args))
+
+
+def _fields():
+    """Every field of the hash as {name: int} (one HGETALL)"""
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            return dict(_local_hash)
+    return {
+        (name.decode() if isinstance(name, bytes) else name): int(value)
+        for name, value in client.hgetall(cache.make_key(ACCUMULATOR_KEY)).items()
+    }
+
+
+def totals():
+    """
+    {category_id: (percentage_sum, count, sum_squares)} from one HGETALL,
+    or None while the hash has not been seeded from CategoryAggregate.
+    """
+    fields = _fields()
+    fields.pop(MARK_FIELD, None)
+    if not fields.pop(SEEDED_FIELD, None):
+        return None
+    columns = {}
+    for name, value in fields.items():
+        category_id, column = name.split(':')
+        columns.setdefault(int(category_id), {})[column] = value
+    return {
+        category_id: (
+            Decimal(values.get('sum', 0)).scaleb(-2),
+            values.get('count', 0),
+            Decimal(values.get('squares', 0)).scaleb(-4),
+        )
+        for category_id, values in columns.items()
+    }
+
+
+def seed():
+    """
+    Add the CategoryAggregate sums into an unseeded hash, once.
+
+    Runs under the AggregateWatermark lock, so it never reads a baseline a
+    rebuild or checkpoint is about to replace. Every submission up to the
+    watermark is in that baseline, so the hash's mark is raised to it.
+    """
+    from .models import AggregateWatermark, CategoryAggregate
+
+    if not cache.add(SEED_LOCK_KEY, True, timeout=60):
+        return False
+    try:
+        with transaction.atomic():
+            watermark = AggregateWatermark.lock()
+            if _fields().get(SEEDED_FIELD):
+                return False
+            increments = []
+            for category_id, total, count, squares in CategoryAggregate.objects.values_list(
+                'category_id', 'total_percentage', 'submission_count', 'sum_squares'
+            ):
+                increments += [
+                    (f'{category_id}:sum', int(total.scaleb(2))),
+                    (f'{category_id}:count', count),
+                    (f'{category_id}:squares', int(squares.scaleb(4))),
+                ]
+            _apply(increments, seeded_through=watermark.submission_id)
+        return True
+    finally:
+        cache.delete(SEED_LOCK_KEY)
+
+
+def reset(submission_id=0):
+    """
+    Drop the hash; the next reader or checkpoint re-seeds it from CategoryAggregate.
+    
+    submission_id is the new mark (a rebuild's final watermark): adds for
+    submissions the rebuilt rows already count are skipped from now on,
+    including those that arrive before the re-seed.
+    """
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            _local_hash.clear()
+            _local_hash[MARK_FIELD] = submission_id
+        return
+    key = cache.make_key(ACCUMULATOR_KEY)
+    pipe = client.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.hset(key, MARK_FIELD, submission_id)
+    pipe.execute()
+
+
+def checkpoint():
+    """
+    Write the hash into CategoryAggregate (absolute values, not deltas).
+
+    Returns:
+        Number of categories written, or None if the hash still needed seeding
+    """
+    from .models import AggregateWatermark, CategoryAggregate
+    from .registry import get_category_map
+
+    current = totals()
+    if current is None:
+        seed()
+        return None
+
+    categories = get_category_map()
+    now = timezone.now()
+    with transaction.atomic():
+        AggregateWatermark.lock()
+        current = totals()  # Re-read under the lock: a rebuild may have reset it
+        if current is None:
+            return None
+        existing = {
+            aggregate.category_id: aggregate
+            for aggregate in CategoryAggregate.objects.select_for_update().order_by('pk')
+        }
+        to_update, to_create = [], []
+        for category_id, (total, count, squares) in current.items():
+            if category_id not in categories:
+                continue
+            aggregate = existing.get(category_id) or CategoryAggregate(category_id=category_id)
+            aggregate.total_percentage = total
+            aggregate.submission_count = count
+            aggregate.sum_squares = squares
+            aggregate.last_updated = now
+            (to_update if category_id in existing else to_create).append(aggregate)
+        CategoryAggregate.objects.bulk_update(to_update, [
+            'total_percentage', 'submission_count', 'sum_squares', 'last_updated',
+        ])
+        CategoryAggregate.objects.bulk_create(to_create, ignore_conflicts=True)
+    return len(to_update) + len(to_create)
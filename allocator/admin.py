@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BudgetCategory, UserAllocation, AllocationSubmission
+from .models import BudgetCategory, UserAllocation, AllocationSubmission, CategoryAggregate
 
 
 @admin.register(BudgetCategory)
@@ -26,3 +26,10 @@ class AllocationSubmissionAdmin(admin.ModelAdmin):
     search_fields = ['session_key', 'ip_address']
     date_hierarchy = 'submitted_at'
     readonly_fields = ['submitted_at']
+
+
+@admin.register(CategoryAggregate)
+class CategoryAggregateAdmin(admin.ModelAdmin):
+    list_display = ['category', 'average_percentage', 'submission_count', 'last_updated']
+    readonly_fields = ['category', 'total_percentage', 'submission_count', 'sum_squares', 'last_updated']
+    ordering = ['category__display_order']
@@ -0,0 +1,364 @@
+"""
+Aggregate payload builders shared by views, Celery tasks and management commands.
+
+The payload is a list of {'category', 'avg_percentage', 'color'} dicts in
+category display order, as stored under the 'aggregate_allocations_v2' key.
+
+Reads go through get_aggregate_snapshot(), which protects the expensive tiers
+from cache stampedes:
+- single-flight: only the request holding the recompute lock hits the database
+- stale-while-revalidate: everyone else is served the last known value
+- probabilistic early expiration (XFetch) for the short-lived Tier 3 entry
+
+Every stored payload gets a new version, which keys the rendered page cache,
+the pre-serialized API body and the live update stream. The version expires
+with the payload it describes (Tier 3 entries) and is bumped when the payload
+is invalidated, so a cached page never outlives its data. Cached pages are also
+held in a process-local L1 that re-checks the version at most once every
+AGGREGATE_L1_MAX_STALENESS seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from . import broadcast, registry
+import json
+import math
+import random
+import time
+
+DATA_KEY = 'aggregate_allocations_v2'
+META_KEY = 'aggregate_allocations_meta'
+STALE_KEY = 'aggregate_allocations_stale'
+TOTAL_KEY = 'aggregate_total_submissions'
+RECOMPUTE_LOCK_KEY = 'aggregate_recompute_lock'
+VERSION_KEY = 'aggregate_version'
+PAGE_KEY = 'aggregate_page'
+API_KEY = 'aggregate_api_body'
+RECOMPUTE_LOCK_TIMEOUT = 60
+TIER3_TIMEOUT = 300  # Live-calculated data is cached for 5 minutes
+
+
+class AggregateUnavailable(Exception):
+    """Another request is still computing a cold aggregate and there is nothing to serve yet"""
+
+
+def get_total_submissions():
+    """
+    Total submissions from the cache mirror, seeded from the sharded counter.
+    
+    SubmissionCounter is the only source: the mirror is incremented when each
+    submission commits (increment_total_submissions) and is never derived
+    from a COUNT(*) over the submissions table.
+    """
+    from allocator.models import SubmissionCounter
+    
+    total = cache.get(TOTAL_KEY)
+    if total is None:
+        # add(), not set(): never overwrite a seed that already counts newer submissions
+        cache.add(TOTAL_KEY, SubmissionCounter.total(), timeout=None)
+        total = cache.get(TOTAL_KEY)
+    return total
+
+
+def increment_total_submissions(count=1):
+    """
+    Count newly committed submissions in the cache mirror.
+    
+    Called from record_submission's on_commit, after SubmissionCounter was
+    incremented in the same transaction, so a missing key is seeded from a
+    counter that already includes them (never counted twice).
+    """
+    try:
+        cache.incr(TOTAL_KEY, count)
+    except ValueError:
+        get_total_submissions()
+
+
+def _payload(totals, include_missing=True):
+    """Build the payload from {category_id: (percentage_sum, count)}"""
+    aggregate_data = []
+    for category in registry.get_categories():
+        if not include_missing and category.id not in totals:
+            continue
+        total, count = totals.get(category.id, (0, 0))
+        avg_percentage = total / count if count else 0
+        aggregate_data.append({
+            'category': category.name,
+            'avg_percentage': round(float(avg_percentage), 2),
+            'color': category.color,
+        })
+    return aggregate_data
+
+
+def build_summary_data():
+    """TIER 2: payload from the CategoryAggregate summary table, or None if it is empty"""
+    from allocator.models import CategoryAggregate
+    
+    if settings.AGGREGATE_BACKEND == 'redis':
+        from allocator import accumulator
+        
+        # One HGETALL; falls through to the table until the hash is seeded
+        current = accumulator.totals()
+        if current is None and accumulator.seed():
+            current = accumulator.totals()
+        if current is not None:
+            totals = {category_id: (total, count) for category_id, (total, count, _) in current.items()}
+            return _payload(totals, include_missing=False) if totals else None
+    
+    totals = {
+        category_id: (total, count)
+        for category_id, total, count in CategoryAggregate.objects.values_list(
+            'category_id', 'total_percentage', 'submission_count'
+        )
+    }
+    if not totals:
+        return None
+    return _payload(totals, include_missing=False)
+
+
+def build_live_data():
+    """TIER 3: payload computed from raw submissions (slower - for initial setup)"""
+    from allocator.models import CategoryAggregate
+    
+    return _payload(CategoryAggregate.compute_live_totals())
+
+
+def store_aggregate_data(aggregate_data, total_submissions, timeout=None, compute_time=0.0):
+    """
+    Cache a freshly computed payload together with its stale-serving copy.
+    
+    Args:
+        timeout: Expiry of the primary entry in seconds (None = never)
+        compute_time: Seconds the recomputation took (drives early expiration)
+    """
+    expires_at = time.time() + timeout if timeout else None
+    cache.set_many({
+        DATA_KEY: aggregate_data,
+        META_KEY: {'expires_at': expires_at, 'compute_time': compute_time},
+    }, timeout=timeout)
+    # Last known value, never expires: served while someone else recomputes
+    cache.set(STALE_KEY, {'data': aggregate_data, 'total': total_submissions}, timeout=None)
+    version = bump_version(timeout=timeout)
+    
+    # Serialize the API body once per version: cached for pollers, pushed to streams
+    body = serialize_api_body(version, aggregate_data, total_submissions)
+    store_page(version, body, 'application/json', time.time(), key=API_KEY)
+    broadcast.publish(version, body)
+
+
+def bump_version(timeout=None):
+    """
+    Advance the aggregate version; cached pages and ETags of older versions go stale.
+    
+    timeout is the lifetime of the payload the new version describes: the
+    version expires with it, so pages rendered from that payload do too.
+    """
+    clear_local_cache()
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # Unique starting point after a cache flush so old ETags never match
+        version = time.time_ns()
+        cache.set(VERSION_KEY, version, timeout=timeout)
+        return version
+    cache.touch(VERSION_KEY, timeout)
+    return version
+
+
+def invalidate_aggregate_data():
+    """
+    Drop the cached payload so the next reader recomputes it.
+    
+    Used when an update could not be queued. The version is bumped too:
+    otherwise cached pages of the old payload would keep being served.
+    """
+    cache.delete_many(['aggregate_allocations', DATA_KEY])
+    bump_version()
+
+
+# Process-local L1 in front of the shared cache: decoded pages by key, all
+# belonging to one aggregate version. The version is re-read from the shared
+# cache at most once every AGGREGATE_L1_MAX_STALENESS seconds, so most hits
+# need no network round trip and no unpickling.
+_l1 = {'version': None, 'checked_at': 0.0, 'pages': {}}
+
+
+def clear_local_cache():
+    """Drop this process's L1 copies (writes in this process call it automatically)"""
+    _l1.update(version=None, checked_at=0.0, pages={})
+
+
+def _l1_lookup(key):
+    """Return (fresh, page): fresh means validated within the staleness window"""
+    page = _l1['pages'].get(key)
+    if page is None:
+        return False, None
+    fresh = time.monotonic() - _l1['checked_at'] < settings.AGGREGATE_L1_MAX_STALENESS
+    return fresh, page
+
+
+def _l1_validate(version):
+    """Record that the shared cache still holds version; stale L1 pages are dropped"""
+    if version != _l1['version']:
+        _l1.update(version=version, pages={})
+    _l1['checked_at'] = time.monotonic()
+
+
+def _l1_fill(key, values):
+    """Resolve a get_many result into (version, page) and remember a valid page"""
+    version = values.get(VERSION_KEY)
+    page = values.get(key)
+    if version is None:
+        return None, None
+    _l1_validate(version)
+    if page is None or page['version'] != version:
+        return version, None
+    _l1['pages'][key] = page
+    return version, page
+
+
+def get_cached_page(key=PAGE_KEY):
+    """
+    Return (version, page), usually without any cache round trip.
+    
+    page is a dict with 'content' (rendered bytes), 'content_type' and
+    'last_modified', or None when no page has been rendered for this version.
+    key selects the representation (PAGE_KEY for HTML, API_KEY for JSON).
+    Pages come from the process-local L1 while its version is fresh, then
+    after one version check, and otherwise from the shared cache.
+    """
+    fresh, page = _l1_lookup(key)
+    if fresh:
+        return page['version'], page
+    if page is not None:
+        version = cache.get(VERSION_KEY)
+        if version == page['version']:
+            _l1_validate(version)
+            return version, page
+    return _l1_fill(key, cache.get_many([VERSION_KEY, key]))
+
+
+async def aget_cached_page(key=PAGE_KEY):
+    """Async counterpart of get_cached_page()"""
+    fresh, page = _l1_lookup(key)
+    if fresh:
+        return page['version'], page
+    if page is not None:
+        version = await cache.aget(VERSION_KEY)
+        if version == page['version']:
+            _l1_validate(version)
+            return version, page
+    return _l1_fill(key, await cache.aget_many([VERSION_KEY, key]))
+
+
+def _page(version, content, content_type, last_modified, key):
+    page = {
+        'version': version,
+        'content': content,
+        'content_type': content_type,
+        'last_modified': last_modified,
+    }
+    if version == _l1['version']:
+        _l1['pages'][key] = page
+    return page
+
+
+def store_page(version, content, content_type, last_modified, key=PAGE_KEY):
+    """Cache the fully rendered aggregate page (or API body) for one version"""
+    cache.set(key, _page(version, content, content_type, last_modified, key), timeout=None)
+
+
+async def astore_page(version, content, content_type, last_modified, key=PAGE_KEY):
+    """Async counterpart of store_page()"""
+    await cache.aset(key, _page(version, content, content_type, last_modified, key), timeout=None)
+
+
+def serialize_api_body(version, aggregate_data, total_submissions):
+    """Compact JSON body for /api/aggregate/, serialized once per version"""
+    return json.dumps({
+        'version': version,
+        'total_submissions': total_submissions,
+        'categories': aggregate_data,
+    }, separators=(',', ':')).encode()
+
+
+def _expires_early(meta):
+    """XFetch: recompute before expiry with probability rising as expiry nears"""
+    if not meta or not meta.get('expires_at'):
+        return False
+    gap = -meta['compute_time'] * settings.AGGREGATE_XFETCH_BETA * math.log(1.0 - random.random())
+    return time.time() + gap >= meta['expires_at']
+
+
+def _recompute():
+    """Recompute through Tier 2 / Tier 3 and store the result"""
+    start = time.monotonic()
+    timeout = None
+    # TIER 2: Try summary table (fast - pre-calculated)
+    aggregate_data = build_summary_data()
+    if aggregate_data is None:
+        # TIER 3: Fallback to live calculation (slower - for initial setup)
+        aggregate_data = build_live_data()
+        timeout = TIER3_TIMEOUT
+    compute_time = time.monotonic() - start
+    
+    total_submissions = get_total_submissions()
+    
+    store_aggregate_data(aggregate_data, total_submissions, timeout=timeout, compute_time=compute_time)
+    return aggregate_data, total_submissions
+
+
+def _recompute_locked():
+    try:
+        return _recompute()
+    finally:
+        cache.delete(RECOMPUTE_LOCK_KEY)
+
+
+def get_aggregate_snapshot():
+    """
+    Return (aggregate_data, total_submissions) for aggregate_view.
+    
+    TIER 1 is one cache round trip. On a miss exactly one caller recomputes;
+    concurrent callers get the stale copy, or wait briefly for the
+    recomputation when there is nothing to serve yet.
+    
+    Raises:
+        AggregateUnavailable: the cold cache is still being computed after
+            AGGREGATE_LOCK_WAIT seconds (the database is never hit unlocked)
+    """
+    # TIER 1: Redis cache (fastest - instant for millions of users)
+    values = cache.get_many([DATA_KEY, META_KEY, TOTAL_KEY])
+    aggregate_data = values.get(DATA_KEY)
+    total_submissions = values.get(TOTAL_KEY)
+    
+    if aggregate_data is not None and total_submissions is not None:
+        if _expires_early(values.get(META_KEY)) and cache.add(
+            RECOMPUTE_LOCK_KEY, True, timeout=RECOMPUTE_LOCK_TIMEOUT
+        ):
+            return _recompute_locked()
+        return aggregate_data, total_submissions
+    
+    if cache.add(RECOMPUTE_LOCK_KEY, True, timeout=RECOMPUTE_LOCK_TIMEOUT):
+        return _recompute_locked()
+    
+    # Someone else is recomputing: serve the last known value
+    stale = cache.get(STALE_KEY)
+    if stale is not None:
+        return (
+            aggregate_data if aggregate_data is not None else stale['data'],
+            total_submissions if total_submissions is not None else stale['total'],
+        )
+    
+    # Cold cache: wait for the lock holder rather than piling onto the database
+    deadline = time.monotonic() + settings.AGGREGATE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        values = cache.get_many([DATA_KEY, TOTAL_KEY])
+        if DATA_KEY in values and TOTAL_KEY in values:
+            return values[DATA_KEY], values[TOTAL_KEY]
+    
+    # Lock holder is gone (its lock expired): take over. Otherwise it is still
+    # computing, and piling onto the database would only slow it down
+    if cache.add(RECOMPUTE_LOCK_KEY, True, timeout=RECOMPUTE_LOCK_TIMEOUT):
+        return _recompute_locked()
+    raise AggregateUnavailable()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AllocatorConfig(AppConfig):
     name = 'allocator'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
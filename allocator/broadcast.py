@@ -0,0 +1,123 @@
+"""
+Live aggregate updates for the Server-Sent Events stream.
+
+store_aggregate_data() publishes every new aggregate version as a ready-made
+SSE frame. Each ASGI process holds ONE upstream subscription (a Redis pub/sub
+channel, or an in-process hook when the cache is not Redis) and fans every
+frame out to all connected stream clients. Each client has a single-slot
+queue, so a slow client skips straight to the newest version instead of
+buffering old ones.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from .buffer import get_redis
+import asyncio
+import logging
+
+CHANNEL = 'aggregate_updates'
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(version, body):
+    """Encode one aggregate version as an SSE frame (body is the API JSON bytes)"""
+    return b'id: %d\nevent: aggregate\ndata: %s\n\n' % (version, body)
+
+
+def publish(version, body):
+    """Publish a new aggregate version to every stream subscriber"""
+    frame = format_event(version, body)
+    client = get_redis()
+    if client is None:
+        hub.publish_local(frame)
+        return
+    try:
+        client.publish(cache.make_key(CHANNEL), frame)
+    except Exception:
+        # Streams are best effort; clients still see the data on their next poll
+        logger.warning('Could not publish aggregate update', exc_info=True)
+
+
+class Hub:
+    """Per-process fan-out from one upstream subscription to many clients"""
+
+    def __init__(self):
+        self._loop = None
+        self._subscribers = set()
+        self._listener = None
+
+    def subscribe(self):
+        """Register a client on the running event loop; returns its queue"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # First subscriber, or the previous loop is gone (tests, dev server)
+            self._loop = loop
+            self._subscribers = set()
+            self._listener = None
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        if self._listener is None or self._listener.done():
+            url = _redis_url()
+            if url is not None:
+                self._listener = loop.create_task(self._listen(url))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def dispatch(self, frame):
+        """Deliver a frame to every subscriber (runs on the event loop)"""
+        for queue in self._subscribers:
+            if queue.full():
+                # Drop the version the client has not read yet: only the latest matters
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    def publish_local(self, frame):
+        """In-process publish (locmem/dev): thread-safe hand-off to the event loop"""
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return
+        try:
+            if asyncio.get_running_loop() is loop:
+                self.dispatch(frame)
+                return
+        except RuntimeError:
+            pass
+        loop.call_soon_threadsafe(self.dispatch, frame)
+
+    async def _listen(self, url):
+        """Hold the process's Redis subscription, reconnecting on errors"""
+        import redis.asyncio as aioredis
+        
+        channel = cache.make_key(CHANNEL)
+        while True:
+            try:
+                client = aioredis.from_url(url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(channel)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.dispatch(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning('Aggregate update subscription lost, reconnecting', exc_info=True)
+                await asyncio.sleep(1)
+
+
+def _redis_url():
+    """URL of the Redis cache server, or None when the cache is not Redis"""
+    if get_redis() is None:
+        return None
+    location = settings.CACHES['default']['LOCATION']
+    if isinstance(location, (list, tuple)):
+        location = location[0]
+    return location
+
+
+hub = Hub()
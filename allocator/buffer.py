@@ -0,0 +1,87 @@
+"""
+Submission buffer for micro-batched aggregate ingestion.
+
+Submissions are appended to a Redis list and drained N at a time by the
+flush task, so aggregate work grows with the number of batches rather than
+the number of submissions. When the cache backend is not Redis (LocMemCache
+in development and tests) an in-process deque is used instead.
+"""
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+import json
+import threading
+
+BUFFER_KEY = 'aggregate_submission_buffer'
+DJANGO_REDIS_BACKEND = 'django_redis.cache.RedisCache'
+BUILTIN_REDIS_BACKEND = 'django.core.cache.backends.redis.RedisCache'
+
+_local_buffer = deque()
+_local_lock = threading.Lock()
+
+
+def uses_redis():
+    """True when the default cache backend is Redis (django-redis or Django's own)"""
+    return settings.CACHES['default']['BACKEND'] in (DJANGO_REDIS_BACKEND, BUILTIN_REDIS_BACKEND)
+
+
+def get_redis():
+    """
+    Return a raw Redis client, or None when the cache is not Redis.
+
+    Only a non-Redis cache (LocMemCache in development and tests) gets the
+    in-process fallback; errors from a configured Redis cache propagate.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend == DJANGO_REDIS_BACKEND:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    if backend == BUILTIN_REDIS_BACKEND:
+        return cache._cache.get_client(write=True)
+    return None
+
+
+def push(allocations_data):
+    """Append one submission payload; returns the new buffer length"""
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            _local_buffer.append(allocations_data)
+            return len(_local_buffer)
+    return client.rpush(cache.make_key(BUFFER_KEY), json.dumps(allocations_data))
+
+
+def requeue(payloads):
+    """Put drained payloads back at the head of the buffer (e.g. after a failed flush)"""
+    if not payloads:
+        return
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            _local_buffer.extendleft(reversed(payloads))
+        return
+    client.lpush(cache.make_key(BUFFER_KEY), *[json.dumps(p) for p in reversed(payloads)])
+
+
+def drain(max_items):
+    """Atomically pop up to max_items payloads from the head of the buffer"""
+    client = get_redis()
+    if client is None:
+        with _local_lock:
+            count = min(max_items, len(_local_buffer))
+            return [_local_buffer.popleft() for _ in range(count)]
+
+    key = cache.make_key(BUFFER_KEY)
+    pipe = client.pipeline(transaction=True)
+    pipe.lrange(key, 0, max_items - 1)
+    pipe.ltrim(key, max_items, -1)
+    items, _ = pipe.execute()
+    return [json.loads(item) for item in items]
+
+
+def length():
+    """Number of submissions waiting to be flushed"""
+    client = get_redis()
+    if client is None:
+        return len(_local_buffer)
+    return client.llen(cache.make_key(BUFFER_KEY))
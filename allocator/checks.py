@@ -0,0 +1,70 @@
+"""
+System checks for the aggregate pipeline settings.
+
+Run with ``python manage.py check`` (add ``--database default`` for the checks
+that look at pending outbox rows).
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.utils import timezone
+
+INGEST_MODES = ('immediate', 'outbox', 'batch')
+RELAY_TASK = 'allocator.relay_aggregate_outbox'
+
+
+@register()
+def check_ingest_mode(app_configs, **kwargs):
+    """The ingest mode is known, and outbox mode has a relay scheduled"""
+    mode = settings.AGGREGATE_INGEST_MODE
+    if mode not in INGEST_MODES:
+        return [Error(
+            f'Unknown AGGREGATE_INGEST_MODE {mode!r}.',
+            hint=f'Use one of: {", ".join(INGEST_MODES)}.',
+            id='allocator.E001',
+        )]
+    scheduled = {entry.get('task') for entry in getattr(settings, 'CELERY_BEAT_SCHEDULE', {}).values()}
+    if mode == 'outbox' and RELAY_TASK not in scheduled:
+        return [Warning(
+            "AGGREGATE_INGEST_MODE is 'outbox' but relay_aggregate_outbox is not in CELERY_BEAT_SCHEDULE.",
+            hint='Submissions will pile up in the outbox and never reach the aggregates.',
+            id='allocator.W001',
+        )]
+    return []
+
+
+@register()
+def check_redis_cache(app_configs, **kwargs):
+    """Redis-backed aggregate settings have a Redis cache to run on"""
+    from .buffer import uses_redis
+
+    if uses_redis():
+        return []
+    needs = []
+    if settings.AGGREGATE_BACKEND == 'redis':
+        needs.append("AGGREGATE_BACKEND='redis'")
+    if settings.AGGREGATE_INGEST_MODE == 'batch':
+        needs.append("AGGREGATE_INGEST_MODE='batch'")
+    return [Error(
+        f'{setting} requires a Redis cache, but CACHES["default"] is '
+        f'{settings.CACHES["default"]["BACKEND"]}.',
+        hint='Without Redis every process keeps its own buffer/accumulator and they never agree.',
+        id='allocator.E002',
+    ) for setting in needs]
+
+
+@register(Tags.database)
+def check_outbox_relay_running(app_configs, databases=None, **kwargs):
+    """Outbox mode: the oldest pending event is recent, so a relay (celery beat) is running"""
+    from .models import AggregateOutboxEvent
+
+    if settings.AGGREGATE_INGEST_MODE != 'outbox' or not databases:
+        return []
+    stale = timezone.now() - timedelta(seconds=max(60, settings.AGGREGATE_FLUSH_INTERVAL * 10))
+    if AggregateOutboxEvent.objects.filter(created_at__lt=stale).exists():
+        return [Warning(
+            'Aggregate outbox events are waiting longer than expected: no relay seems to be running.',
+            hint="Start the celery-beat service, or set AGGREGATE_INGEST_MODE='immediate'.",
+            id='allocator.W002',
+        )]
+    return []
@@ -1,25 +1,76 @@
 from django import forms
+from django.core.exceptions import ValidationError
 from decimal import Decimal
-from .models import BudgetCategory
+from .registry import get_categories
+import re
+import threading
 
+# Optional sign, digits, optional fraction: "10", "10.5", "-0.25", ".5"
+_NUMBER_RE = re.compile(r'\s*([+-]?)(\d*)(?:\.(\d*))?\s*')
 
-class TaxAllocationForm(forms.Form):
-    """Dynamic form for allocating tax percentages across budget categories"""
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Dynamically create fields for each budget category
-        categories = BudgetCategory.objects.all().order_by('display_order', 'name')
-        
+
+def format_basis_points(basis_points):
+    """Render integer basis points as a percentage string, e.g. 5000 -> '50.00'"""
+    sign = '-' if basis_points < 0 else ''
+    whole, fraction = divmod(abs(basis_points), 100)
+    return f'{sign}{whole}.{fraction:02d}'
+
+
+class BasisPointsField(forms.Field):
+    """Percentage input parsed straight into integer basis points (0-10000)"""
+    widget = forms.NumberInput
+    default_error_messages = {
+        'invalid': 'Enter a number.',
+        'max_decimal_places': 'Ensure that there are no more than 2 decimal places.',
+        'min_value': 'Ensure this value is greater than or equal to 0.00.',
+        'max_value': 'Ensure this value is less than or equal to 100.00.',
+    }
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        match = _NUMBER_RE.fullmatch(str(value))
+        if match is None:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+        sign, whole, fraction = match.groups()
+        fraction = fraction or ''
+        if not whole and not fraction:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+        if len(fraction) > 2:
+            raise ValidationError(self.error_messages['max_decimal_places'], code='max_decimal_places')
+        basis_points = int(whole or '0') * 100 + int(fraction.ljust(2, '0'))
+        return -basis_points if sign == '-' else basis_points
+
+    def validate(self, value):
+        super().validate(value)
+        if value is None:
+            return
+        if value < 0:
+            raise ValidationError(self.error_messages['min_value'], code='min_value')
+        if value > 10000:
+            raise ValidationError(self.error_messages['max_value'], code='max_value')
+
+
+# Field definitions built once per category-registry version and shared
+# (read-only) by every form instance: (categories, fields, field_name -> category_id)
+_field_template = ((), {}, {})
+_field_template_lock = threading.Lock()
+
+
+def _get_field_template():
+    global _field_template
+    categories = get_categories()
+    if _field_template[0] is categories:
+        return _field_template
+
+    with _field_template_lock:
+        fields = {}
+        category_ids = {}
         for category in categories:
             field_name = f'category_{category.id}'
-            self.fields[field_name] = forms.DecimalField(
+            fields[field_name] = BasisPointsField(
                 label=category.name,
-                max_digits=5,
-                decimal_places=2,
-                min_value=Decimal('0.00'),
-                max_value=Decimal('100.00'),
-                initial=Decimal('0.00'),
+                initial='0.00',
                 widget=forms.NumberInput(attrs={
                     'class': 'form-control allocation-input',
                     'step': '0.01',
@@ -30,30 +81,51 @@ class TaxAllocationForm(forms.Form):
                     'data-category-color': category.color,
                 })
             )
-    
+            category_ids[field_name] = category.id
+        _field_template = (categories, fields, category_ids)
+    return _field_template
+
+
+class TaxAllocationForm(forms.Form):
+    """Dynamic form for allocating tax percentages across budget categories"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # One field per budget category, shared from the precompiled template
+        # instead of building new field and widget objects per request
+        _, fields, self._category_ids = _get_field_template()
+        self.fields.update(fields)
+
     def clean(self):
-        """Validate that all percentages sum to exactly 100%"""
+        """Validate that all percentages sum to exactly 100% (10000 basis points)"""
         cleaned_data = super().clean()
-        
-        # Sum all category allocations
-        total = Decimal('0.00')
-        for field_name, value in cleaned_data.items():
-            if field_name.startswith('category_') and value is not None:
+
+        # Sum all category allocations (integers, no Decimal arithmetic)
+        total = 0
+        for field_name in self._category_ids:
+            value = cleaned_data.get(field_name)
+            if value is not None:
                 total += value
-        
+
         # Check if total equals 100%
-        if total != Decimal('100.00'):
+        if total != 10000:
             raise forms.ValidationError(
-                f'Total allocation must equal 100%. Current total: {total}%'
+                f'Total allocation must equal 100%. Current total: {format_basis_points(total)}%'
             )
-        
+
         return cleaned_data
-    
+
+    def get_basis_points(self):
+        """Return a dict mapping category IDs to integer basis points"""
+        return {
+            category_id: self.cleaned_data[field_name]
+            for field_name, category_id in self._category_ids.items()
+            if field_name in self.cleaned_data
+        }
+
     def get_allocations(self):
         """Return a dict mapping category IDs to percentages"""
-        allocations = {}
-        for field_name, value in self.cleaned_data.items():
-            if field_name.startswith('category_'):
-                category_id = int(field_name.replace('category_', ''))
-                allocations[category_id] = value
-        return allocations
+        return {
+            category_id: Decimal(basis_points).scaleb(-2)
+            for category_id, basis_points in self.get_basis_points().items()
+        }
@@ -0,0 +1,107 @@
+"""
+Fixed-resolution percentage histograms for distribution statistics.
+
+Every category keeps 401 integer bins covering 0-100% in 0.25% steps
+(bin i counts allocations of i * 0.25%, rounded to the nearest bin). In
+memory a histogram is an int64 array; in the database each non-empty bin is
+one row (CategoryAggregateBin / CategoryAggregateBucketBin) incremented in
+place, so histograms merge by addition (across time buckets, batches or
+shards) and percentiles cost O(bins) instead of an ORDER BY over every row.
+"""
+from decimal import Decimal
+from django.db.models import F
+import numpy as np
+
+BIN_WIDTH_BP = 25  # 0.25% in basis points
+BINS = 10000 // BIN_WIDTH_BP + 1
+
+
+def empty():
+    """A zeroed histogram"""
+    return np.zeros(BINS, dtype=np.int64)
+
+
+def bin_index(percentage):
+    """Bin for one percentage (Decimal, float or str)"""
+    return basis_points_bin(int((Decimal(str(percentage)) * 100).to_integral_value()))
+
+
+def basis_points_bin(basis_points):
+    """Bin for one integer basis-point value"""
+    return min(max((basis_points + BIN_WIDTH_BP // 2) // BIN_WIDTH_BP, 0), BINS - 1)
+
+
+def bin_indexes(basis_points):
+    """Vectorized bin_index() for an integer array of basis points"""
+    return np.clip((np.asarray(basis_points, dtype=np.int64) + BIN_WIDTH_BP // 2) // BIN_WIDTH_BP, 0, BINS - 1)
+
+
+def from_bins(bins):
+    """Histogram array from (bin, count) pairs"""
+    counts = empty()
+    for index, count in bins:
+        counts[index] += count
+    return counts
+
+
+def percentile(counts, q):
+    """
+    Nearest-rank percentile (q in 0-100) as a Decimal percentage,
+    or None for an empty histogram.
+    """
+    cumulative = np.cumsum(counts)
+    n = int(cumulative[-1])
+    if n == 0:
+        return None
+    rank = max(int(np.ceil(q / 100 * n)), 1)
+    index = int(np.searchsorted(cumulative, rank))
+    return Decimal(index * BIN_WIDTH_BP).scaleb(-2)
+
+
+def add_to_bins(model, owner_field, deltas):
+    """
+    Add histogram deltas to bin rows with set-based UPDATEs.
+    
+    Args:
+        model: Bin model (CategoryAggregateBin or CategoryAggregateBucketBin)
+        owner_field: Its owner foreign key column ('aggregate_id' or 'bucket_id')
+        deltas: Dict mapping owner id -> histogram array
+    
+    Missing bin rows are inserted first (racing workers are harmless thanks to
+    ignore_conflicts), then each bin gets ``SET count = count + n`` with one
+    UPDATE per distinct n, so no histogram is ever read back and rewritten.
+    """
+    increments = {
+        (owner_id, int(index)): int(counts[index])
+        for owner_id, counts in deltas.items()
+        for index in np.flatnonzero(counts)
+    }
+    if not increments:
+        return 0
+    model.objects.bulk_create(
+        [model(**{owner_field: owner_id, 'bin': index}) for owner_id, index in increments],
+        ignore_conflicts=True,
+    )
+    ids = {
+        (owner_id, index): pk
+        for pk, owner_id, index in model.objects.filter(
+            **{f'{owner_field}__in': list(deltas)}, bin__in={index for _, index in increments}
+        ).values_list('pk', owner_field, 'bin')
+    }
+    by_amount = {}
+    for key, amount in increments.items():
+        by_amount.setdefault(amount, []).append(ids[key])
+    for amount, pks in by_amount.items():
+        model.objects.filter(pk__in=pks).update(count=F('count') + amount)
+    return len(increments)
+
+
+def set_bins(model, owner_field, counts):
+    """
+    Replace the bins of the given owners with {owner id: histogram array}.
+    
+    Zeroing the existing rows locks them until the transaction ends, so an
+    increment racing with a rebuild or backfill lands after it, not under it.
+    """
+    model.objects.filter(**{f'{owner_field}__in': list(counts)}).update(count=0)
+    return add_to_bins(model, owner_field, counts)
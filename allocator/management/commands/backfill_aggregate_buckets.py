@@ -0,0 +1,119 @@
+"""
+Management command to populate CategoryAggregateBucket from raw submissions.
+Usage: python manage.py backfill_aggregate_buckets [--until YYYY-MM-DD] [--chunk-size 2000]
+
+Buckets before --until (default: today, UTC) are recomputed and replaced in one
+transaction. Later buckets are left to the incremental maintenance done by the
+aggregate tasks, so live updates are never overwritten.
+"""
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from allocator import histograms
+from allocator.models import (
+    AllocationSubmission,
+    CategoryAggregateBucket,
+    CategoryAggregateBucketBin,
+    UserAllocation,
+    unpack_allocations,
+)
+from allocator.registry import get_category_map
+
+
+class Command(BaseCommand):
+    help = 'Backfill hourly/daily CategoryAggregateBucket rollups from raw submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--until',
+            help='Backfill buckets before this UTC date, YYYY-MM-DD (default: today)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Packed submissions fetched per round trip (default: 2000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['until']:
+            try:
+                until = datetime.strptime(options['until'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--until must be a date in YYYY-MM-DD format')
+        else:
+            until = datetime.now(dt_timezone.utc).date()
+        cutoff = datetime.combine(until, dt_time.min, tzinfo=dt_timezone.utc)
+        
+        self.stdout.write(f'🔄 Backfilling buckets before {cutoff:%Y-%m-%d} (UTC)...')
+        hours = {}
+        
+        def add(buckets, bucket_start, category_id, total, sum_squares, count, histogram=None, bin_index=None):
+            key = (bucket_start, category_id)
+            if key not in buckets:
+                buckets[key] = [Decimal('0'), Decimal('0'), 0, histograms.empty()]
+            bucket = buckets[key]
+            bucket[0] += total
+            bucket[1] += sum_squares
+            bucket[2] += count
+            if histogram is not None:
+                bucket[3] += histogram
+            else:
+                bucket[3][bin_index] += count
+        
+        # Row-stored submissions: grouped by hour and value in the database
+        rows = UserAllocation.objects.filter(created_at__lt=cutoff).annotate(
+            hour=TruncHour('created_at', tzinfo=dt_timezone.utc)
+        ).order_by().values('hour', 'category_id', 'percentage').annotate(count=Count('id'))
+        for row in rows:
+            percentage, count = row['percentage'], row['count']
+            add(hours, row['hour'], row['category_id'], percentage * count,
+                percentage * percentage * count, count, bin_index=histograms.bin_index(percentage))
+        
+        # Packed submissions: streamed and folded in Python
+        vectors = AllocationSubmission.objects.filter(
+            submitted_at__lt=cutoff, allocation_vector__isnull=False
+        ).values_list('submitted_at', 'allocation_vector')
+        categories = get_category_map()
+        for submitted_at, vector in vectors.iterator(chunk_size=options['chunk_size']):
+            hour = CategoryAggregateBucket.truncate(submitted_at, CategoryAggregateBucket.HOUR)
+            for category_id, percentage in unpack_allocations(vector):
+                if category_id in categories:  # Skip categories deleted since
+                    add(hours, hour, category_id, percentage, percentage * percentage, 1,
+                        bin_index=histograms.bin_index(percentage))
+        
+        # Daily buckets are merged from the hourly ones
+        days = {}
+        for (hour, category_id), (total, sum_squares, count, histogram) in hours.items():
+            day = CategoryAggregateBucket.truncate(hour, CategoryAggregateBucket.DAY)
+            add(days, day, category_id, total, sum_squares, count, histogram=histogram)
+        
+        buckets, bucket_histograms = [], []
+        for granularity, values in ((CategoryAggregateBucket.HOUR, hours), (CategoryAggregateBucket.DAY, days)):
+            for (bucket_start, category_id), (total, sum_squares, count, histogram) in values.items():
+                buckets.append(CategoryAggregateBucket(
+                    granularity=granularity,
+                    bucket_start=bucket_start,
+                    category_id=category_id,
+                    total_percentage=total,
+                    sum_squares=sum_squares,
+                    submission_count=count,
+                ))
+                bucket_histograms.append(histogram)
+        
+        with transaction.atomic():
+            CategoryAggregateBucket.objects.filter(bucket_start__lt=cutoff).delete()
+            CategoryAggregateBucket.objects.bulk_create(buckets, batch_size=1000)
+            # Fresh buckets have no bins yet: insert the non-empty ones directly
+            CategoryAggregateBucketBin.objects.bulk_create([
+                CategoryAggregateBucketBin(bucket_id=bucket.id, bin=int(index), count=int(histogram[index]))
+                for bucket, histogram in zip(buckets, bucket_histograms)
+                for index in histogram.nonzero()[0]
+            ], batch_size=1000)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✅ Wrote {len(hours):,} hourly and {len(days):,} daily buckets'
+        ))
@@ -0,0 +1,63 @@
+"""
+Management command to benchmark TaxAllocationForm construction and validation.
+Usage: python manage.py benchmark_form [--iterations 5000]
+
+Uses the real categories if present; otherwise creates 10 temporary ones
+inside a transaction that is rolled back afterwards.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from allocator.forms import TaxAllocationForm
+from allocator.models import BudgetCategory
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark TaxAllocationForm construction and validation cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5000,
+            help='Number of forms to build/validate per measurement (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        
+        with transaction.atomic():
+            if not BudgetCategory.objects.exists():
+                for i in range(10):
+                    BudgetCategory.objects.create(name=f'Benchmark {i}', display_order=i)
+            
+            self._run(iterations)
+            transaction.set_rollback(True)
+
+    def _run(self, iterations):
+        categories = list(BudgetCategory.objects.order_by('display_order', 'name'))
+        share = 100 / len(categories)
+        post_data = {f'category_{c.id}': f'{share:.2f}' for c in categories}
+        # Make the total exactly 100.00
+        remainder = 100 - round(share, 2) * (len(categories) - 1)
+        post_data[f'category_{categories[-1].id}'] = f'{remainder:.2f}'
+        
+        TaxAllocationForm()  # Warm caches
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            TaxAllocationForm()
+        build = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            form = TaxAllocationForm(data=post_data)
+            form.is_valid()
+            form.get_allocations()
+        validate = time.perf_counter() - start
+        
+        self.stdout.write(self.style.HTTP_INFO(
+            f'⏱  TaxAllocationForm ({len(categories)} categories, {iterations:,} iterations)'
+        ))
+        self.stdout.write(f'  {"Construct (GET)":<30} {build / iterations * 1e6:8.1f} µs/form')
+        self.stdout.write(f'  {"Construct + validate (POST)":<30} {validate / iterations * 1e6:8.1f} µs/form')
@@ -6,11 +6,14 @@ from django.core.management.base import BaseCommand
 from django.db.models import Count, Avg, Sum
 from django.utils import timezone
 from datetime import timedelta
+from allocator import histograms
+from allocator.registry import get_categories, get_category_map
 from allocator.models import (
-    BudgetCategory,
     UserAllocation,
     AllocationSubmission,
-    CategoryAggregate
+    CategoryAggregate,
+    CategoryAggregateBucket,
+    SubmissionCounter
 )
 
 
@@ -59,7 +62,7 @@ class Command(BaseCommand):
 
     def print_overall_stats(self):
         """Overall database statistics"""
-        total_submissions = AllocationSubmission.objects.count()
+        total_submissions = SubmissionCounter.total()
         total_allocations = UserAllocation.objects.count()
         unique_users = UserAllocation.objects.values('user_id').distinct().count()
         unique_sessions = UserAllocation.objects.values('session_key').distinct().count()
@@ -99,28 +102,58 @@ class Command(BaseCommand):
             for day_data in daily_counts[:10]:  # Show last 10 days
                 self.stdout.write(f'    {day_data["day"]}: {day_data["count"]} submissions')
         
+        # Category averages for the window, merged from daily rollup buckets
+        window = CategoryAggregateBucket.window_totals(
+            CategoryAggregateBucket.truncate(cutoff, CategoryAggregateBucket.DAY)
+        )
+        if window:
+            self.stdout.write(f'\n  {"Category":<30} {"Avg %":>10} {"Std dev":>10} {"n":>10}')
+            for category in get_categories():
+                if category.id not in window:
+                    continue
+                total, sum_squares, count = window[category.id]
+                mean, stddev = CategoryAggregateBucket.summarize(total, sum_squares, count)
+                self.stdout.write(
+                    f'  {category.name:<30} {float(mean):>9.2f}% '
+                    f'{float(stddev):>10.2f} {count:>10,}'
+                )
+        
         self.stdout.write('')
 
     def print_category_aggregates(self):
         """Category-level aggregate statistics"""
         self.stdout.write(self.style.HTTP_INFO('💰 CATEGORY AGGREGATES'))
         
-        aggregates = CategoryAggregate.objects.select_related('category').order_by(
-            '-avg_percentage'
+        # Averages are computed at read time from total/count
+        categories = get_category_map()
+        aggregates = sorted(
+            (agg for agg in CategoryAggregate.objects.all() if agg.category_id in categories),
+            key=lambda agg: agg.average_percentage,
+            reverse=True
         )
         
-        if not aggregates.exists():
+        if not aggregates:
             self.stdout.write(self.style.WARNING('  No aggregate data available'))
             self.stdout.write('')
             return
         
-        self.stdout.write(f'  {"Category":<30} {"Avg %":>10} {"Submissions":>15}')
-        self.stdout.write('  ' + '-'*58)
+        self.stdout.write(
+            f'  {"Category":<30} {"Avg %":>10} {"P25":>8} {"Median":>8} {"P75":>8} {"Submissions":>15}'
+        )
+        self.stdout.write('  ' + '-'*85)
+        
+        def fmt(value):
+            return f'{float(value):>7.2f}%' if value is not None else f'{"-":>8}'
         
+        # Percentiles come from the 0.25% histograms: O(bins), no row scan
+        category_histograms = CategoryAggregate.histograms()
         for agg in aggregates:
+            counts = category_histograms.get(agg.category_id, histograms.empty())
             self.stdout.write(
-                f'  {agg.category.name:<30} '
-                f'{float(agg.avg_percentage):>9.2f}% '
+                f'  {categories[agg.category_id].name:<30} '
+                f'{float(agg.average_percentage):>9.2f}% '
+                f'{fmt(histograms.percentile(counts, 25))} {fmt(histograms.percentile(counts, 50))} '
+                f'{fmt(histograms.percentile(counts, 75))} '
                 f'{agg.submission_count:>14,}'
             )
         
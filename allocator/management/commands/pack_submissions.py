@@ -0,0 +1,61 @@
+"""
+Management command to migrate row-stored submissions to packed storage.
+Usage: python manage.py pack_submissions [--batch-size 1000]
+
+Each submission ends up stored exactly one way: its UserAllocation rows are
+deleted in the same transaction that writes the packed vector.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from allocator.models import AllocationSubmission, UserAllocation, pack_allocations
+
+
+class Command(BaseCommand):
+    help = 'Pack UserAllocation rows into AllocationSubmission.allocation_vector'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Submissions converted per transaction (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        last_id = 0
+        packed_total = 0
+        while True:
+            submissions = list(AllocationSubmission.objects.filter(
+                id__gt=last_id, allocation_vector__isnull=True
+            ).order_by('id')[:batch_size])
+            if not submissions:
+                break
+            last_id = submissions[-1].id
+            
+            with transaction.atomic():
+                rows = UserAllocation.objects.filter(
+                    session_key__in=[s.session_key for s in submissions]
+                ).values_list('session_key', 'category_id', 'percentage')
+                
+                by_session = {}
+                for session_key, category_id, percentage in rows:
+                    by_session.setdefault(session_key, {})[category_id] = percentage
+                
+                to_update = []
+                for submission in submissions:
+                    allocations = by_session.get(submission.session_key)
+                    if allocations:
+                        submission.allocation_vector = pack_allocations(allocations)
+                        to_update.append(submission)
+                
+                AllocationSubmission.objects.bulk_update(to_update, ['allocation_vector'])
+                UserAllocation.objects.filter(
+                    session_key__in=[s.session_key for s in to_update]
+                ).delete()
+            
+            packed_total += len(to_update)
+            self.stdout.write(f'  ✓ Packed {packed_total:,} submissions (up to id {last_id})')
+        
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Packed {packed_total:,} submissions'))
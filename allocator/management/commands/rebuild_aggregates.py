@@ -3,10 +3,11 @@ Management command to rebuild aggregate statistics.
 Use this for initial setup or data migration.
 """
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.db.models import Sum, Count, Avg
-from allocator.models import CategoryAggregate, BudgetCategory, UserAllocation
+from allocator.rebuild import rebuild_aggregates
+from allocator.aggregates import build_summary_data, get_total_submissions, store_aggregate_data
+from allocator.registry import get_categories
 from django.core.cache import cache
+import time
 
 
 class Command(BaseCommand):
@@ -18,6 +19,12 @@ class Command(BaseCommand):
             action='store_true',
             help='Run rebuild as background Celery task'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=20000,
+            help='Allocations streamed and reduced per chunk (default: 20000)'
+        )
 
     def handle(self, *args, **options):
         use_async = options['async']
@@ -26,7 +33,7 @@ class Command(BaseCommand):
             self.stdout.write('🚀 Queuing background task to rebuild aggregates...')
             try:
                 from allocator.tasks import rebuild_aggregates_from_scratch
-                result = rebuild_aggregates_from_scratch.delay()
+                result = rebuild_aggregates_from_scratch.delay(options['chunk_size'])
                 self.stdout.write(self.style.SUCCESS(
                     f'✅ Task queued: {result.id}\n'
                     f'Check Celery worker logs for progress.'
@@ -38,70 +45,44 @@ class Command(BaseCommand):
                 ))
         else:
             self.stdout.write('🔄 Rebuilding aggregates synchronously...')
-            self._rebuild_sync()
+            self._rebuild_sync(options['chunk_size'])
 
-    def _rebuild_sync(self):
+    def _rebuild_sync(self, chunk_size):
         """Synchronous rebuild of aggregate data"""
-        categories = BudgetCategory.objects.all()
+        categories = get_categories()
+        
+        self.stdout.write(f'Found {len(categories)} categories')
         
-        self.stdout.write(f'Found {categories.count()} categories')
+        # One streamed, vectorized pass over raw data up to a high-water mark,
+        # unlocked catch-up passes over later submissions, then a short transaction
+        # adds the last (at most one chunk) and swaps the results in
+        start = time.monotonic()
+        summaries = rebuild_aggregates(chunk_size)
+        self.stdout.write(f'Scanned raw data in {time.monotonic() - start:.2f}s')
         
-        with transaction.atomic():
-            # Clear existing aggregates
-            deleted_count = CategoryAggregate.objects.all().delete()[0]
-            if deleted_count > 0:
-                self.stdout.write(f'Cleared {deleted_count} existing aggregate records')
-            
-            # Rebuild from raw data
-            for category in categories:
-                stats = UserAllocation.objects.filter(
-                    category=category
-                ).aggregate(
-                    total=Sum('percentage'),
-                    count=Count('id'),
-                    avg=Avg('percentage')
-                )
-                
-                total_percentage = stats['total'] or 0
-                submission_count = stats['count'] or 0
-                avg_percentage = stats['avg'] or 0
-                
-                CategoryAggregate.objects.create(
-                    category=category,
-                    total_percentage=total_percentage,
-                    submission_count=submission_count,
-                    avg_percentage=avg_percentage
-                )
-                
-                self.stdout.write(
-                    f'  ✓ {category.name}: {avg_percentage:.2f}% '
-                    f'(n={submission_count})'
-                )
+        for category in categories:
+            summary = summaries.get(category.id)
+            submission_count = summary.count if summary else 0
+            avg_percentage = summary.total / summary.count if submission_count else 0
+            self.stdout.write(
+                f'  ✓ {category.name}: {avg_percentage:.2f}% '
+                f'(n={submission_count})'
+            )
         
-        # Clear and rebuild Redis cache
+        # Refresh Redis cache: the payload is overwritten in place, so readers
+        # never miss it and fall through to live calculation
         self.stdout.write('\n🔄 Refreshing Redis cache...')
         cache.delete('aggregate_allocations')  # Old cache
-        cache.delete('aggregate_allocations_v2')
         cache.delete('aggregate_total_submissions')
         
-        # Manually rebuild cache
-        aggregates = CategoryAggregate.objects.select_related('category').all()
-        aggregate_data = []
-        for agg in aggregates:
-            aggregate_data.append({
-                'category': agg.category.name,
-                'avg_percentage': float(agg.avg_percentage),
-                'color': agg.category.color,
-            })
+        aggregate_data = build_summary_data() or []
         
-        cache.set('aggregate_allocations_v2', aggregate_data, timeout=None)
+        total_submissions = get_total_submissions()
         
-        from allocator.models import AllocationSubmission
-        total_submissions = AllocationSubmission.objects.count()
-        cache.set('aggregate_total_submissions', total_submissions, timeout=None)
+        store_aggregate_data(aggregate_data, total_submissions)
         
         self.stdout.write(self.style.SUCCESS(
-            f'\n✅ Successfully rebuilt aggregates for {categories.count()} categories'
+            f'\n✅ Successfully rebuilt aggregates for {len(categories)} categories'
         ))
         self.stdout.write(self.style.SUCCESS(
             f'✅ Redis cache refreshed'
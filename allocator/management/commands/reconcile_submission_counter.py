@@ -0,0 +1,61 @@
+"""
+Management command to check the sharded submission counter against the true count.
+Usage: python manage.py reconcile_submission_counter [--fix]
+
+Without --fix the command only reports, and exits non-zero (for cron or
+monitoring) when the counter disagrees with COUNT(*) or the cache mirror
+disagrees with the counter. With --fix the shard rows are locked while the
+submissions are counted, so increments from in-flight submissions are neither
+lost nor doubled, and the mirror is reset to the corrected total.
+"""
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from allocator.aggregates import TOTAL_KEY
+from allocator.models import AllocationSubmission, SubmissionCounter
+
+
+class Command(BaseCommand):
+    help = 'Compare SubmissionCounter (and its cache mirror) with COUNT(*) of submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Correct the counter and reset the cache mirror'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['fix']:
+                # Writers block on their shard until the correction commits. Every
+                # shard is created first: one increment() creates mid-run would be unlocked
+                SubmissionCounter.lock_all()
+            true_count = AllocationSubmission.objects.count()
+            counter_total = SubmissionCounter.total()
+            drift = true_count - counter_total
+            
+            if drift and options['fix']:
+                SubmissionCounter.objects.filter(shard=0).update(count=F('count') + drift)
+        
+        mirror = cache.get(TOTAL_KEY)
+        self.stdout.write(f'  Submissions (COUNT):   {true_count:,}')
+        self.stdout.write(f'  Sharded counter:       {counter_total:,}')
+        self.stdout.write(f'  Cache mirror:          {mirror if mirror is None else format(mirror, ",")}')
+        
+        if options['fix']:
+            cache.set(TOTAL_KEY, true_count, timeout=None)
+            if drift:
+                self.stdout.write(self.style.SUCCESS(f'\n✅ Counter corrected by {drift:+,}; cache mirror reset'))
+            else:
+                self.stdout.write(self.style.SUCCESS('\n✅ Counter is accurate; cache mirror reset'))
+            return
+        
+        if drift:
+            raise CommandError(f'Sharded counter is off by {drift:+,} (run with --fix to correct)')
+        if mirror is not None and mirror != counter_total:
+            raise CommandError(
+                f'Cache mirror is off by {mirror - counter_total:+,} from the counter (run with --fix to reset)'
+            )
+        self.stdout.write(self.style.SUCCESS('\n✅ Counter and cache mirror are accurate'))
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0003_categoryaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocationsubmission',
+            name='allocation_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+def seed_counter(apps, schema_editor):
+    """Start the counter at the existing number of submissions"""
+    AllocationSubmission = apps.get_model('allocator', 'AllocationSubmission')
+    SubmissionCounter = apps.get_model('allocator', 'SubmissionCounter')
+    SubmissionCounter.objects.create(shard=0, count=AllocationSubmission.objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0004_allocationsubmission_allocation_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionCounter',
+            fields=[
+                ('shard', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Submission Counter Shard',
+                'verbose_name_plural': 'Submission Counter Shards',
+            },
+        ),
+        migrations.RunPython(seed_counter, migrations.RunPython.noop),
+    ]
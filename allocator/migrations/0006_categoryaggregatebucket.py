@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-17 02:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0005_submissioncounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryAggregateBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('total_percentage', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('sum_squares', models.DecimalField(decimal_places=4, default=0, help_text='Sum of squared percentages (for variance / standard deviation)', max_digits=20)),
+                ('submission_count', models.BigIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='allocator.budgetcategory')),
+            ],
+            options={
+                'verbose_name': 'Category Aggregate Bucket',
+                'verbose_name_plural': 'Category Aggregate Buckets',
+                'ordering': ['granularity', 'bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket_start', 'category'), name='unique_category_aggregate_bucket')],
+            },
+        ),
+    ]
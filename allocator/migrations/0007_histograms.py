@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0006_categoryaggregatebucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryaggregate',
+            name='histogram',
+            field=models.BinaryField(blank=True, help_text='0.25% bin counts (see allocator.histograms)', null=True),
+        ),
+        migrations.AddField(
+            model_name='categoryaggregatebucket',
+            name='histogram',
+            field=models.BinaryField(blank=True, help_text='0.25% bin counts (see allocator.histograms)', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0007_histograms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryaggregate',
+            name='sum_squares',
+            field=models.DecimalField(decimal_places=4, default=0, help_text='Sum of squared percentages (for variance / standard deviation)', max_digits=24),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+def seed_watermark(apps, schema_editor):
+    """Create the singleton row; nothing has been rebuilt through a submission yet"""
+    AggregateWatermark = apps.get_model('allocator', 'AggregateWatermark')
+    AggregateWatermark.objects.create(pk=1, submission_id=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0008_categoryaggregate_sum_squares'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Aggregate Watermark',
+                'verbose_name_plural': 'Aggregate Watermarks',
+            },
+        ),
+        migrations.RunPython(seed_watermark, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 02:47
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_applied_through(apps, schema_editor):
+    """Existing submissions were applied before the ledger existed"""
+    AggregateWatermark = apps.get_model('allocator', 'AggregateWatermark')
+    AllocationSubmission = apps.get_model('allocator', 'AllocationSubmission')
+    last = AllocationSubmission.objects.aggregate(last=Max('id'))['last'] or 0
+    AggregateWatermark.objects.update_or_create(pk=1, defaults={'applied_through': last})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0009_aggregatewatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedSubmission',
+            fields=[
+                ('submission_id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Applied Submission',
+                'verbose_name_plural': 'Applied Submissions',
+            },
+        ),
+        migrations.AddField(
+            model_name='aggregatewatermark',
+            name='applied_through',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(seed_applied_through, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-17 02:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0010_appliedsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateOutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField(help_text='allocations_data list (see tasks.update_category_aggregates)')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Aggregate Outbox Event',
+                'verbose_name_plural': 'Aggregate Outbox Events',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 02:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0011_aggregateoutboxevent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='categoryaggregate',
+            name='avg_percentage',
+        ),
+    ]
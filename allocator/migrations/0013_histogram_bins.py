@@ -0,0 +1,74 @@
+# Generated by Django 6.0 on 2026-10-17 03:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+import numpy as np
+
+
+def split_histograms(apps, schema_editor):
+    """Copy each stored histogram blob (little-endian uint64 bins) into bin rows"""
+    for owner_model, bin_model, owner_field in (
+        ('CategoryAggregate', 'CategoryAggregateBin', 'aggregate_id'),
+        ('CategoryAggregateBucket', 'CategoryAggregateBucketBin', 'bucket_id'),
+    ):
+        Owner = apps.get_model('allocator', owner_model)
+        Bin = apps.get_model('allocator', bin_model)
+        rows = Owner.objects.exclude(histogram__isnull=True).values_list('pk', 'histogram')
+        batch = []
+        for pk, blob in rows.iterator(chunk_size=1000):
+            counts = np.frombuffer(bytes(blob), dtype='<u8')
+            batch.extend(
+                Bin(**{owner_field: pk, 'bin': int(index), 'count': int(counts[index])})
+                for index in counts.nonzero()[0]
+            )
+            if len(batch) >= 5000:
+                Bin.objects.bulk_create(batch)
+                batch = []
+        Bin.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0012_remove_categoryaggregate_avg_percentage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryAggregateBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bin', models.PositiveSmallIntegerField(help_text='Bin index (see allocator.histograms)')),
+                ('count', models.BigIntegerField(default=0)),
+                ('aggregate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bins', to='allocator.categoryaggregate')),
+            ],
+            options={
+                'verbose_name': 'Category Aggregate Bin',
+                'verbose_name_plural': 'Category Aggregate Bins',
+                'constraints': [models.UniqueConstraint(fields=('aggregate', 'bin'), name='unique_category_aggregate_bin')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryAggregateBucketBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bin', models.PositiveSmallIntegerField(help_text='Bin index (see allocator.histograms)')),
+                ('count', models.BigIntegerField(default=0)),
+                ('bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bins', to='allocator.categoryaggregatebucket')),
+            ],
+            options={
+                'verbose_name': 'Category Aggregate Bucket Bin',
+                'verbose_name_plural': 'Category Aggregate Bucket Bins',
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'bin'), name='unique_category_aggregate_bucket_bin')],
+            },
+        ),
+        migrations.RunPython(split_histograms, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='categoryaggregate',
+            name='histogram',
+        ),
+        migrations.RemoveField(
+            model_name='categoryaggregatebucket',
+            name='histogram',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-17 03:07
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('allocator', '0013_histogram_bins'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appliedsubmission',
+            name='applied_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='appliedsubmission',
+            name='claim_token',
+            field=models.UUIDField(editable=False, help_text='Token of the claim() call that inserted the row', null=True),
+        ),
+    ]
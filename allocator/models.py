@@ -1,6 +1,73 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+import random
+import struct
+
+# Packed allocation vector item: category_id (uint32), basis points 0-10000 (uint16)
+PACKED_ALLOCATION = struct.Struct('<IH')
+
+
+def basis_points(percentage):
+    """Percentage (Decimal, float or int) as integer basis points (0-10000)"""
+    return int((Decimal(str(percentage)) * 100).to_integral_value())
+
+
+def pack_basis_points(allocations):
+    """Pack a {category_id: basis_points} dict"""
+    return b''.join(
+        PACKED_ALLOCATION.pack(category_id, points) for category_id, points in allocations.items()
+    )
+
+
+def pack_allocations(allocations):
+    """Pack a {category_id: percentage} dict into fixed-point basis points"""
+    return pack_basis_points({
+        category_id: basis_points(percentage) for category_id, percentage in allocations.items()
+    })
+
+
+def unpack_allocations(vector):
+    """Decode a packed vector into a list of (category_id, Decimal percentage)"""
+    return [
+        (category_id, Decimal(basis_points).scaleb(-2))
+        for category_id, basis_points in PACKED_ALLOCATION.iter_unpack(bytes(vector))
+    ]
+
+
+class PackedAllocation:
+    """Read-only stand-in for a UserAllocation row decoded from a packed vector"""
+    __slots__ = ('session_key', 'category', 'category_id', 'percentage')
+    
+    def __init__(self, session_key, category, percentage):
+        self.session_key = session_key
+        self.category = category
+        self.category_id = category.id
+        self.percentage = percentage
+
+
+def decode_allocations(session_key, vector, categories=None):
+    """
+    Decode a packed vector into PackedAllocation objects in category display order.
+    
+    categories is the registry's id -> CategoryRecord map; async callers pass
+    the one from aget_category_map() so no sync registry check runs on the loop.
+    """
+    from allocator.registry import get_category_map
+    
+    if categories is None:
+        categories = get_category_map()
+    allocations = [
+        PackedAllocation(session_key, categories[category_id], percentage)
+        for category_id, percentage in unpack_allocations(vector)
+        if category_id in categories
+    ]
+    allocations.sort(key=lambda alloc: (alloc.category.display_order, alloc.category.name))
+    return allocations
 
 
 class BudgetCategory(models.Model):
@@ -56,6 +123,9 @@ class AllocationSubmission(models.Model):
     user_id = models.CharField(max_length=255, db_index=True, null=True, blank=True)  # Cookie-based user tracking
     submitted_at = models.DateTimeField(default=timezone.now, db_index=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
+    # Compact storage: the whole allocation vector packed as basis points
+    # (see pack_allocations). NULL for submissions stored as UserAllocation rows.
+    allocation_vector = models.BinaryField(null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['-submitted_at']
@@ -67,6 +137,68 @@ class AllocationSubmission(models.Model):
     def __str__(self):
         return f"Submission {self.session_key[:8]} at {self.submitted_at}"
 
+    @property
+    def is_packed(self):
+        return self.allocation_vector is not None
+
+    def get_allocations(self):
+        """
+        Return this submission's allocations ordered like the category list.
+        
+        Works for both storage modes: packed submissions are decoded in
+        memory, row-stored ones fall back to querying UserAllocation.
+        """
+        if getattr(self, '_allocations', None) is None:
+            type(self).prefetch_allocations([self])
+        return self._allocations
+
+    @classmethod
+    def prefetch_allocations(cls, submissions):
+        """
+        Load allocations for many submissions with a fixed number of queries.
+        
+        Row-stored submissions share one UserAllocation query grouped by
+        session_key in Python; packed submissions are decoded in memory.
+        """
+        rows = cls._allocation_rows(submissions)
+        cls._attach_allocations(submissions, list(rows) if rows is not None else [])
+    
+    @classmethod
+    async def aprefetch_allocations(cls, submissions):
+        """Async counterpart of prefetch_allocations() using the async ORM"""
+        from allocator.registry import aget_category_map
+        
+        # Packed vectors are decoded against the registry
+        categories = await aget_category_map() if any(s.is_packed for s in submissions) else None
+        rows = cls._allocation_rows(submissions)
+        cls._attach_allocations(
+            submissions, [alloc async for alloc in rows] if rows is not None else [], categories
+        )
+    
+    @staticmethod
+    def _allocation_rows(submissions):
+        """One UserAllocation queryset for all row-stored submissions (None if there are none)"""
+        row_keys = [s.session_key for s in submissions if not s.is_packed]
+        if not row_keys:
+            return None
+        return UserAllocation.objects.filter(
+            session_key__in=row_keys
+        ).select_related('category').order_by('category__display_order', 'category__name')
+    
+    @staticmethod
+    def _attach_allocations(submissions, rows, categories=None):
+        by_session = {}
+        for alloc in rows:
+            by_session.setdefault(alloc.session_key, []).append(alloc)
+        
+        for submission in submissions:
+            if submission.is_packed:
+                submission._allocations = decode_allocations(
+                    submission.session_key, submission.allocation_vector, categories
+                )
+            else:
+                submission._allocations = by_session.get(submission.session_key, [])
+
 
 class CategoryAggregate(models.Model):
     """Pre-calculated aggregate statistics for each category (for millions of users)"""
@@ -81,11 +213,11 @@ class CategoryAggregate(models.Model):
         default=0,
         help_text="Number of submissions for this category"
     )
-    avg_percentage = models.DecimalField(
-        max_digits=8,
-        decimal_places=2,
+    sum_squares = models.DecimalField(
+        max_digits=24,
+        decimal_places=4,
         default=0,
-        help_text="Calculated average: total_percentage / submission_count"
+        help_text="Sum of squared percentages (for variance / standard deviation)"
     )
     last_updated = models.DateTimeField(auto_now=True, db_index=True)
     
@@ -95,19 +227,540 @@ class CategoryAggregate(models.Model):
         ordering = ['category__display_order']
     
     def __str__(self):
-        return f"{self.category.name}: {self.avg_percentage}% (n={self.submission_count})"
+        return f"{self.category.name}: {self.average_percentage:.2f}% (n={self.submission_count})"
     
-    def update_average(self):
-        """Recalculate average from total and count"""
+    @property
+    def average_percentage(self):
+        """Average computed at read time from the running total and count"""
         if self.submission_count > 0:
-            self.avg_percentage = self.total_percentage / self.submission_count
-        else:
-            self.avg_percentage = 0
+            return self.total_percentage / self.submission_count
+        return Decimal('0')
+
+    # Former stored column, kept as a read-only alias so it can never go stale
+    avg_percentage = average_percentage
+    
+    @property
+    def stddev(self):
+        """Standard deviation from the running sums"""
+        return CategoryAggregateBucket.summarize(
+            self.total_percentage, self.sum_squares, self.submission_count
+        )[1]
+    
+    def percentile(self, q):
+        """Percentile (0-100) of this category's allocations from the histogram"""
+        from allocator import histograms
+        return histograms.percentile(histograms.from_bins(self.bins.values_list('bin', 'count')), q)
     
     def add_submission(self, percentage):
         """Incrementally update aggregate with new submission"""
-        from decimal import Decimal
         self.total_percentage += Decimal(str(percentage))
         self.submission_count += 1
-        self.update_average()
         self.save()
+
+    @classmethod
+    def compute_live_totals(cls):
+        """
+        Compute {category_id: (percentage_sum, count)} from raw submissions.
+        
+        Covers both storage modes: one grouped query over UserAllocation rows
+        plus a streamed pass over packed allocation vectors.
+        """
+        from django.db.models import Sum, Count
+        
+        totals = {
+            row['category_id']: (row['total'] or Decimal('0'), row['count'])
+            for row in UserAllocation.objects.order_by().values('category_id').annotate(
+                total=Sum('percentage'), count=Count('id')
+            )
+        }
+        
+        vectors = AllocationSubmission.objects.filter(
+            allocation_vector__isnull=False
+        ).values_list('allocation_vector', flat=True)
+        for vector in vectors.iterator(chunk_size=2000):
+            for category_id, percentage in unpack_allocations(vector):
+                total, count = totals.get(category_id, (Decimal('0'), 0))
+                totals[category_id] = (total + percentage, count + 1)
+        
+        return totals
+
+    @classmethod
+    def lock_rows(cls, category_ids):
+        """
+        Lock the summary rows of category_ids (created if missing) in primary
+        key order, until the enclosing transaction ends.
+        
+        The all-time increments take these row locks anyway; taking them up
+        front orders an update against a rebuild's swap, which locks them too.
+        """
+        cls.objects.bulk_create([cls(category_id=category_id) for category_id in category_ids], ignore_conflicts=True)
+        list(cls.objects.select_for_update().filter(category_id__in=list(category_ids)).order_by('pk').values_list('pk'))
+    
+    @classmethod
+    def histograms(cls):
+        """{category_id: histogram array} for every category, in one query"""
+        from allocator import histograms
+        
+        merged = {}
+        for category_id, index, count in CategoryAggregateBin.objects.values_list('aggregate_id', 'bin', 'count'):
+            merged.setdefault(category_id, histograms.empty())[index] += count
+        return merged
+    
+    @classmethod
+    def apply_histograms(cls, deltas):
+        """Add {category_id: histogram array} to the bin rows (summary rows must exist)"""
+        from allocator import histograms
+        return histograms.add_to_bins(CategoryAggregateBin, 'aggregate_id', deltas)
+    
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Add per-category totals and counts with a single set-based UPDATE.
+
+        Args:
+            deltas: Dict mapping category_id -> (percentage_sum, submission_count)
+                    or (percentage_sum, submission_count, sum_squares)
+
+        The statement is ``SET total = total + x, count = count + n`` for every
+        category at once, so concurrent workers never read-modify-write a row
+        and no update is lost. Rows missing from the summary table are created
+        on demand and then updated the same way.
+        """
+        if not deltas:
+            return 0
+        deltas = {
+            category_id: delta if len(delta) == 3 else (*delta, 0)
+            for category_id, delta in deltas.items()
+        }
+
+        total_delta = Case(
+            *[When(category_id=category_id, then=Value(Decimal(str(total))))
+              for category_id, (total, count, squares) in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=15, decimal_places=2),
+        )
+        squares_delta = Case(
+            *[When(category_id=category_id, then=Value(Decimal(str(squares))))
+              for category_id, (total, count, squares) in deltas.items()],
+            default=Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=24, decimal_places=4),
+        )
+        counts = {count for total, count, squares in deltas.values()}
+        if len(counts) == 1:
+            count_delta = Value(counts.pop())
+        else:
+            count_delta = Case(
+                *[When(category_id=category_id, then=Value(count))
+                  for category_id, (total, count, squares) in deltas.items()],
+                default=Value(0),
+                output_field=models.BigIntegerField(),
+            )
+
+        def increment():
+            return cls.objects.filter(category_id__in=list(deltas)).update(
+                total_percentage=F('total_percentage') + total_delta,
+                submission_count=F('submission_count') + count_delta,
+                sum_squares=F('sum_squares') + squares_delta,
+                last_updated=timezone.now(),
+            )
+
+        with transaction.atomic():
+            updated = increment()
+            if updated < len(deltas):
+                # Some categories have no summary row yet: undo the partial
+                # update so no delta is applied twice, create the rows (racing
+                # workers are harmless thanks to ignore_conflicts) and retry.
+                transaction.set_rollback(True)
+
+        if updated < len(deltas):
+            cls.objects.bulk_create(
+                [cls(category_id=category_id) for category_id in deltas],
+                ignore_conflicts=True,
+            )
+            updated = increment()
+
+        return updated
+
+
+class CategoryAggregateBucket(models.Model):
+    """
+    Hourly and daily rollups per category: sum, sum of squares and count.
+    
+    Buckets are mergeable (just add the three columns), so any time window is
+    answered from a few hundred rows: averages, variance and trends without
+    scanning UserAllocation by created_at. Bucket starts are UTC.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+    GRANULARITIES = (HOUR, DAY)
+    
+    category = models.ForeignKey(BudgetCategory, on_delete=models.CASCADE, related_name='buckets')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    total_percentage = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    sum_squares = models.DecimalField(
+        max_digits=20,
+        decimal_places=4,
+        default=0,
+        help_text="Sum of squared percentages (for variance / standard deviation)"
+    )
+    submission_count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Category Aggregate Bucket"
+        verbose_name_plural = "Category Aggregate Buckets"
+        ordering = ['granularity', 'bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket_start', 'category'],
+                name='unique_category_aggregate_bucket',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.category_id} {self.granularity} {self.bucket_start:%Y-%m-%d %H:00} (n={self.submission_count})"
+    
+    @classmethod
+    def truncate(cls, moment, granularity):
+        """Start (UTC) of the bucket containing moment"""
+        moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if granularity == cls.DAY:
+            moment = moment.replace(hour=0)
+        return moment
+    
+    @staticmethod
+    def summarize(total, sum_squares, count):
+        """(mean, standard deviation) from merged bucket columns"""
+        if not count:
+            return Decimal('0'), Decimal('0')
+        mean = Decimal(total) / count
+        variance = max(Decimal(sum_squares) / count - mean * mean, Decimal('0'))
+        return mean, variance.sqrt()
+    
+    @classmethod
+    def window_totals(cls, start, end=None, granularity=DAY):
+        """{category_id: (total, sum_squares, count)} merged over buckets in [start, end)"""
+        buckets = cls.objects.filter(granularity=granularity, bucket_start__gte=start)
+        if end is not None:
+            buckets = buckets.filter(bucket_start__lt=end)
+        return {
+            row['category_id']: (row['total'], row['sum_squares'], row['count'])
+            for row in buckets.order_by().values('category_id').annotate(
+                total=Sum('total_percentage'),
+                sum_squares=Sum('sum_squares'),
+                count=Sum('submission_count'),
+            )
+        }
+    
+    @classmethod
+    def window_histograms(cls, start, end=None, granularity=DAY):
+        """{category_id: histogram array} merged over buckets in [start, end)"""
+        from allocator import histograms
+        
+        bins = CategoryAggregateBucketBin.objects.filter(
+            bucket__granularity=granularity, bucket__bucket_start__gte=start
+        )
+        if end is not None:
+            bins = bins.filter(bucket__bucket_start__lt=end)
+        merged = {}
+        for category_id, index, count in bins.order_by().values_list(
+            'bucket__category_id', 'bin'
+        ).annotate(total=Sum('count')):
+            merged.setdefault(category_id, histograms.empty())[index] += count
+        return merged
+    
+    @classmethod
+    def apply_histograms(cls, deltas):
+        """Add {(granularity, bucket_start, category_id): histogram array} (buckets must exist)"""
+        from allocator import histograms
+        
+        if not deltas:
+            return 0
+        ids = {
+            (granularity, start, category_id): pk
+            for pk, granularity, start, category_id in cls.objects.filter(
+                granularity__in={key[0] for key in deltas},
+                bucket_start__in={key[1] for key in deltas},
+                category_id__in={key[2] for key in deltas},
+            ).values_list('id', 'granularity', 'bucket_start', 'category_id')
+        }
+        return histograms.add_to_bins(
+            CategoryAggregateBucketBin, 'bucket_id', {ids[key]: counts for key, counts in deltas.items()}
+        )
+    
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Add bucket deltas with a fixed number of queries.
+        
+        Args:
+            deltas: Dict mapping (granularity, bucket_start, category_id) ->
+                    (percentage_sum, sum_squares, submission_count)
+        
+        Like CategoryAggregate.apply_deltas, every bucket is incremented by one
+        set-based UPDATE (``SET x = x + CASE id ...``), so concurrent workers
+        never lose an update. Missing buckets are inserted first.
+        """
+        if not deltas:
+            return 0
+        
+        def bucket_ids():
+            rows = cls.objects.filter(
+                granularity__in={key[0] for key in deltas},
+                bucket_start__in={key[1] for key in deltas},
+                category_id__in={key[2] for key in deltas},
+            ).values_list('id', 'granularity', 'bucket_start', 'category_id')
+            return {(granularity, start, category_id): pk for pk, granularity, start, category_id in rows}
+        
+        ids = bucket_ids()
+        missing = [key for key in deltas if key not in ids]
+        if missing:
+            # Racing workers may insert the same buckets: ignore the conflicts
+            cls.objects.bulk_create(
+                [cls(granularity=g, bucket_start=start, category_id=c) for g, start, c in missing],
+                ignore_conflicts=True,
+            )
+            ids = bucket_ids()
+        
+        def increment(position, output_field):
+            return Case(
+                *[When(id=ids[key], then=Value(delta[position])) for key, delta in deltas.items()],
+                default=Value(0),
+                output_field=output_field,
+            )
+        
+        return cls.objects.filter(id__in=[ids[key] for key in deltas]).update(
+            total_percentage=F('total_percentage') + increment(
+                0, models.DecimalField(max_digits=15, decimal_places=2)),
+            sum_squares=F('sum_squares') + increment(
+                1, models.DecimalField(max_digits=20, decimal_places=4)),
+            submission_count=F('submission_count') + increment(2, models.BigIntegerField()),
+        )
+
+
+class CategoryAggregateBin(models.Model):
+    """
+    One 0.25% histogram bin of a category's all-time aggregate.
+    
+    Bins are rows rather than one blob so concurrent workers add to them with
+    a set-based ``SET count = count + n`` (see histograms.add_to_bins) and
+    never read-modify-write a histogram.
+    """
+    aggregate = models.ForeignKey(CategoryAggregate, on_delete=models.CASCADE, related_name='bins')
+    bin = models.PositiveSmallIntegerField(help_text="Bin index (see allocator.histograms)")
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Category Aggregate Bin"
+        verbose_name_plural = "Category Aggregate Bins"
+        constraints = [
+            models.UniqueConstraint(fields=['aggregate', 'bin'], name='unique_category_aggregate_bin'),
+        ]
+    
+    def __str__(self):
+        return f"{self.aggregate_id} bin {self.bin}: {self.count}"
+
+
+class CategoryAggregateBucketBin(models.Model):
+    """One 0.25% histogram bin of an hourly/daily bucket (see CategoryAggregateBin)"""
+    bucket = models.ForeignKey(CategoryAggregateBucket, on_delete=models.CASCADE, related_name='bins')
+    bin = models.PositiveSmallIntegerField(help_text="Bin index (see allocator.histograms)")
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Category Aggregate Bucket Bin"
+        verbose_name_plural = "Category Aggregate Bucket Bins"
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'bin'], name='unique_category_aggregate_bucket_bin'),
+        ]
+    
+    def __str__(self):
+        return f"{self.bucket_id} bin {self.bin}: {self.count}"
+
+
+class SubmissionCounter(models.Model):
+    """
+    Durable count of all submissions, split across shard rows.
+    
+    Each submission increments one random shard, so concurrent writers rarely
+    wait on the same row lock; the total is the SUM over the shard rows
+    (a handful of rows instead of a COUNT(*) over every submission).
+    """
+    shard = models.PositiveSmallIntegerField(primary_key=True)
+    count = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Submission Counter Shard"
+        verbose_name_plural = "Submission Counter Shards"
+    
+    def __str__(self):
+        return f"Shard {self.shard}: {self.count}"
+    
+    @classmethod
+    def increment(cls, amount=1):
+        """Add amount to a random shard (created on first use)"""
+        shard = random.randrange(settings.SUBMISSION_COUNTER_SHARDS)
+        if not cls.objects.filter(shard=shard).update(count=F('count') + amount):
+            cls.objects.bulk_create([cls(shard=shard)], ignore_conflicts=True)
+            cls.objects.filter(shard=shard).update(count=F('count') + amount)
+    
+    @classmethod
+    def total(cls):
+        """Sum of all shards"""
+        return cls.objects.aggregate(total=Sum('count'))['total'] or 0
+    
+    @classmethod
+    def lock_all(cls):
+        """
+        Lock every shard until the enclosing transaction ends.
+        
+        record_submission increments a shard before inserting anything, so once
+        this returns no submission is half-written and new ones wait: the
+        current max ids are a clean high-water mark.
+        """
+        cls.objects.bulk_create(
+            [cls(shard=shard) for shard in range(settings.SUBMISSION_COUNTER_SHARDS)],
+            ignore_conflicts=True,
+        )
+        list(cls.objects.select_for_update())
+
+
+class AggregateWatermark(models.Model):
+    """
+    Singleton holding two AllocationSubmission.id high-water marks.
+    
+    submission_id: the last submission counted into CategoryAggregate by a
+    rebuild; incremental updates at or below it skip the all-time sums.
+    applied_through: payloads for submissions at or below it are treated as
+    already applied; above it, AppliedSubmission records which ones have.
+    
+    Incremental updates only read this row. Rebuilds and the Redis
+    accumulator's seed/checkpoint lock it to order themselves.
+    """
+    submission_id = models.BigIntegerField(default=0)
+    applied_through = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Aggregate Watermark"
+        verbose_name_plural = "Aggregate Watermarks"
+    
+    def __str__(self):
+        return f"Rebuilt through submission {self.submission_id}"
+    
+    @classmethod
+    def lock(cls):
+        """Return the watermark row, locked for the enclosing transaction"""
+        try:
+            return cls.objects.select_for_update().get(pk=1)
+        except cls.DoesNotExist:
+            cls.objects.bulk_create([cls(pk=1)], ignore_conflicts=True)
+            return cls.objects.select_for_update().get(pk=1)
+    
+    @classmethod
+    def current(cls):
+        """Return the watermark row without locking it"""
+        try:
+            return cls.objects.get(pk=1)
+        except cls.DoesNotExist:
+            cls.objects.bulk_create([cls(pk=1)], ignore_conflicts=True)
+            return cls.objects.get(pk=1)
+
+
+class AppliedSubmission(models.Model):
+    """
+    Ledger of submissions whose aggregate update has been applied, so a
+    redelivered or retried payload is a no-op.
+    
+    Only recent claims are kept: compact() moves AggregateWatermark.applied_through
+    over rows older than AGGREGATE_LEDGER_RETENTION and deletes them.
+    """
+    submission_id = models.BigIntegerField(primary_key=True)
+    claim_token = models.UUIDField(null=True, editable=False, help_text="Token of the claim() call that inserted the row")
+    applied_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        verbose_name = "Applied Submission"
+        verbose_name_plural = "Applied Submissions"
+    
+    def __str__(self):
+        return f"Applied submission {self.submission_id}"
+    
+    @classmethod
+    def claim(cls, submission_ids):
+        """
+        Record submission_ids as applied and return the ones that were not already.
+        
+        Lock-free: every id is a unique insert (ON CONFLICT DO NOTHING) tagged
+        with this call's token, so the rows carrying the token are exactly the
+        ids this call won; a racing claim of the same id waits on that row
+        only. The compaction mark is read after the insert, which catches ids
+        whose ledger row compaction has just deleted.
+        """
+        import uuid
+        
+        if not submission_ids:
+            return set()
+        token = uuid.uuid4()
+        cls.objects.bulk_create(
+            [cls(submission_id=submission_id, claim_token=token) for submission_id in submission_ids],
+            ignore_conflicts=True,
+        )
+        claimed = set(cls.objects.filter(
+            submission_id__in=submission_ids, claim_token=token
+        ).values_list('submission_id', flat=True))
+        applied_through = AggregateWatermark.current().applied_through
+        return {submission_id for submission_id in claimed if submission_id > applied_through}
+    
+    @classmethod
+    def compact(cls):
+        """
+        Fold ledger rows older than AGGREGATE_LEDGER_RETENTION into
+        AggregateWatermark.applied_through and delete them. Returns the mark.
+        
+        Bounded by age, not by the first unapplied submission, so one lost
+        update cannot make the ledger grow forever (a payload arriving after
+        its id is below the mark is dropped; rebuild_aggregates repairs it).
+        The cutoff never passes the oldest pending outbox event. The mark is
+        committed before any row is deleted, so a concurrent claim()
+        always sees one or the other. No lock is taken.
+        """
+        from datetime import timedelta
+        from django.db.models import Max, Min
+        
+        cutoff = timezone.now() - timedelta(seconds=settings.AGGREGATE_LEDGER_RETENTION)
+        oldest_pending = AggregateOutboxEvent.objects.aggregate(oldest=Min('created_at'))['oldest']
+        if oldest_pending is not None:
+            cutoff = min(cutoff, oldest_pending)
+        through = cls.objects.filter(applied_at__lt=cutoff).aggregate(last=Max('submission_id'))['last']
+        
+        if through is not None:
+            AggregateWatermark.current()
+            AggregateWatermark.objects.filter(pk=1, applied_through__lt=through).update(
+                applied_through=through, updated_at=timezone.now()
+            )
+        applied_through = AggregateWatermark.current().applied_through
+        cls.objects.filter(submission_id__lte=applied_through).delete()
+        return applied_through
+
+
+class AggregateOutboxEvent(models.Model):
+    """
+    Transactional outbox for the aggregate pipeline.
+    
+    One row per submission, written in the submission's own transaction, so
+    an aggregate update exists exactly when the submission does and the
+    request path never talks to the broker. The relay task drains rows in
+    batches into apply_payloads and deletes them in the same transaction.
+    """
+    payload = models.JSONField(help_text="allocations_data list (see tasks.update_category_aggregates)")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Aggregate Outbox Event"
+        verbose_name_plural = "Aggregate Outbox Events"
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"Outbox event {self.id} at {self.created_at}"
@@ -0,0 +1,64 @@
+"""
+Keyset (cursor) pagination for submission lists.
+
+Pages are addressed by the (submitted_at, id) of the last row shown, so each
+page is an index range scan over (user_id, -submitted_at) no matter how deep
+the user pages, unlike OFFSET which gets slower on later pages.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(submission):
+    """Encode a submission's position as '<epoch microseconds>,<id>'"""
+    micros = (submission.submitted_at - EPOCH) // timedelta(microseconds=1)
+    return f'{micros},{submission.id}'
+
+
+def decode_cursor(value):
+    """Decode a cursor into (submitted_at, id); returns None if malformed"""
+    try:
+        micros, pk = value.split(',')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _page_queryset(queryset, before, page_size):
+    queryset = queryset.order_by('-submitted_at', '-id')
+    position = decode_cursor(before) if before else None
+    if position is not None:
+        submitted_at, pk = position
+        queryset = queryset.filter(
+            Q(submitted_at__lt=submitted_at) | Q(submitted_at=submitted_at, id__lt=pk)
+        )
+    # Fetch one extra row to know whether an older page exists
+    return queryset[:page_size + 1]
+
+
+def _split_page(items, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1])
+    return items, next_cursor
+
+
+def keyset_page(queryset, before=None, page_size=20):
+    """
+    Return (items, next_cursor) for one page of submissions, newest first.
+    
+    Args:
+        queryset: AllocationSubmission queryset (already filtered by user)
+        before: Cursor string from a previous page, or None for the first page
+        page_size: Number of submissions per page
+    """
+    return _split_page(list(_page_queryset(queryset, before, page_size)), page_size)
+
+
+async def akeyset_page(queryset, before=None, page_size=20):
+    """Async counterpart of keyset_page() using the async ORM"""
+    items = [item async for item in _page_queryset(queryset, before, page_size)]
+    return _split_page(items, page_size)
@@ -0,0 +1,245 @@
+"""
+Single-pass, vectorized rebuild of the all-time CategoryAggregate rows.
+
+Raw allocations are streamed with server-side cursors as integer basis points
+(row-stored submissions) or decoded straight from packed vectors, in chunks of
+chunk_size. Each chunk is reduced with np.bincount to per-category sums,
+counts, sums of squares and 0.25% histograms, so memory is bounded by the
+chunk size however many submissions there are.
+
+The rebuild runs online, as snapshot plus delta:
+1. record a high-water mark (max UserAllocation.id and AllocationSubmission.id,
+   taken while no submission is in flight)
+2. reduce everything up to the mark, without holding any lock
+3. catch up, still unlocked: take a new mark and reduce what arrived since
+   the previous one, until the remaining delta fits in one chunk (at most
+   MAX_CATCH_UP_PASSES passes)
+4. in one short transaction, take the final mark, reduce that small delta,
+   swap the sums into CategoryAggregate (update in place, insert new
+   categories, delete stale rows) and move the AggregateWatermark so queued
+   incremental updates for submissions already counted are skipped.
+Submissions and incremental updates keep flowing during steps 2 and 3 and
+only wait on step 4, whose scan is bounded by the chunk size.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from itertools import islice
+from django.db import transaction
+from django.db.models import F, IntegerField, Max
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+from . import histograms
+from .models import (
+    AggregateWatermark,
+    AllocationSubmission,
+    CategoryAggregate,
+    CategoryAggregateBin,
+    SubmissionCounter,
+    UserAllocation,
+)
+import numpy as np
+
+CategorySummary = namedtuple('CategorySummary', ['total', 'count', 'sum_squares', 'histogram'])
+HighWaterMark = namedtuple('HighWaterMark', ['allocation_id', 'submission_id'])
+
+PACKED_DTYPE = np.dtype([('category_id', '<u4'), ('basis_points', '<u2')])
+MAX_CATCH_UP_PASSES = 5
+
+
+def read_high_water_mark():
+    """
+    Current HighWaterMark, with every submission at or below it committed.
+    
+    Must run inside a transaction: the submission counter shards stay locked
+    until it ends, so keep that transaction short.
+    """
+    SubmissionCounter.lock_all()
+    return HighWaterMark(
+        UserAllocation.objects.aggregate(mark=Max('id'))['mark'] or 0,
+        AllocationSubmission.objects.aggregate(mark=Max('id'))['mark'] or 0,
+    )
+
+
+def delta_size(after, through):
+    """Rows (allocation rows plus submissions) between two HighWaterMarks"""
+    return (through.allocation_id - after.allocation_id) + (through.submission_id - after.submission_id)
+
+
+def iter_chunks(chunk_size=20000, after=None, through=None):
+    """
+    Yield (category_ids, basis_points) integer arrays covering every allocation.
+    
+    Args:
+        after, through: Optional HighWaterMarks bounding the scan to
+                        after < id <= through
+    """
+    rows = UserAllocation.objects.all()
+    vectors = AllocationSubmission.objects.filter(allocation_vector__isnull=False)
+    if after is not None:
+        rows = rows.filter(id__gt=after.allocation_id)
+        vectors = vectors.filter(id__gt=after.submission_id)
+    if through is not None:
+        rows = rows.filter(id__lte=through.allocation_id)
+        vectors = vectors.filter(id__lte=through.submission_id)
+    
+    # Rounded before the cast: SQLite keeps the decimal as REAL, where
+    # 0.29 * 100 is 28.999... and a bare cast would truncate it to 28
+    rows = rows.order_by().annotate(
+        basis_points=Cast(Round(F('percentage') * 100), IntegerField())
+    ).values_list('category_id', 'basis_points').iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        pairs = np.array(chunk, dtype=np.int64)
+        yield pairs[:, 0], pairs[:, 1]
+    
+    vectors = vectors.order_by().values_list(
+        'allocation_vector', flat=True
+    ).iterator(chunk_size=chunk_size // 10 or 1)
+    while True:
+        chunk = [bytes(vector) for vector in islice(vectors, chunk_size // 10 or 1)]
+        if not chunk:
+            break
+        packed = np.frombuffer(b''.join(chunk), dtype=PACKED_DTYPE)
+        yield packed['category_id'].astype(np.int64), packed['basis_points'].astype(np.int64)
+
+
+def reduce_chunk(category_ids, basis_points):
+    """
+    Reduce one chunk with bincount.
+    
+    Returns:
+        (unique_ids, totals, counts, squares, histogram_rows), all in basis points
+        except counts; histogram_rows has one row of histograms.BINS per id.
+    """
+    unique_ids, index = np.unique(category_ids, return_inverse=True)
+    size = len(unique_ids)
+    # Per-chunk weighted sums stay far below 2**53, so float64 bincount is exact
+    totals = np.rint(np.bincount(index, weights=basis_points, minlength=size)).astype(np.int64)
+    squares = np.rint(np.bincount(
+        index, weights=basis_points.astype(np.float64) ** 2, minlength=size
+    )).astype(np.int64)
+    counts = np.bincount(index, minlength=size)
+    histogram_rows = np.bincount(
+        index * histograms.BINS + histograms.bin_indexes(basis_points),
+        minlength=size * histograms.BINS,
+    ).reshape(size, histograms.BINS)
+    return unique_ids, totals, counts, squares, histogram_rows
+
+
+def compute_summaries(chunk_size=20000, after=None, through=None):
+    """One pass over raw allocations (optionally bounded, see iter_chunks): {category_id: CategorySummary}"""
+    accumulated = {}
+    for category_ids, basis_points in iter_chunks(chunk_size, after, through):
+        if not len(category_ids):
+            continue
+        for category_id, total, count, squares, histogram in zip(*reduce_chunk(category_ids, basis_points)):
+            entry = accumulated.setdefault(int(category_id), [0, 0, 0, histograms.empty()])
+            entry[0] += int(total)
+            entry[1] += int(count)
+            entry[2] += int(squares)
+            entry[3] += histogram
+    
+    return {
+        category_id: CategorySummary(
+            total=Decimal(total).scaleb(-2),
+            count=count,
+            sum_squares=Decimal(squares).scaleb(-4),
+            histogram=histogram,
+        )
+        for category_id, (total, count, squares, histogram) in accumulated.items()
+    }
+
+
+def merge_summaries(summaries, more):
+    """Add two {category_id: CategorySummary} dicts"""
+    merged = dict(summaries)
+    for category_id, summary in more.items():
+        if category_id in merged:
+            current = merged[category_id]
+            summary = CategorySummary(
+                total=current.total + summary.total,
+                count=current.count + summary.count,
+                sum_squares=current.sum_squares + summary.sum_squares,
+                histogram=current.histogram + summary.histogram,
+            )
+        merged[category_id] = summary
+    return merged
+
+
+def swap_in(summaries, category_ids):
+    """
+    Replace CategoryAggregate with the computed summaries in one short transaction.
+    
+    Args:
+        summaries: {category_id: CategorySummary} from compute_summaries()
+        category_ids: Categories that should have a row (missing ones get zeros)
+    """
+    empty = CategorySummary(Decimal('0'), 0, Decimal('0'), histograms.empty())
+    
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            aggregate.category_id: aggregate
+            for aggregate in CategoryAggregate.objects.select_for_update().order_by('pk')
+        }
+        to_update, to_create = [], []
+        for category_id in category_ids:
+            summary = summaries.get(category_id, empty)
+            aggregate = existing.get(category_id) or CategoryAggregate(category_id=category_id)
+            aggregate.total_percentage = summary.total
+            aggregate.submission_count = summary.count
+            aggregate.sum_squares = summary.sum_squares
+            aggregate.last_updated = now
+            (to_update if category_id in existing else to_create).append(aggregate)
+        
+        CategoryAggregate.objects.bulk_update(to_update, [
+            'total_percentage', 'submission_count', 'sum_squares', 'last_updated',
+        ])
+        CategoryAggregate.objects.bulk_create(to_create)
+        CategoryAggregate.objects.exclude(category_id__in=list(category_ids)).delete()
+        histograms.set_bins(CategoryAggregateBin, 'aggregate_id', {
+            category_id: summaries.get(category_id, empty).histogram for category_id in category_ids
+        })
+
+
+def rebuild_aggregates(chunk_size=20000):
+    """
+    Recompute every category's aggregate from raw data without stalling live updates.
+    
+    Returns:
+        The swapped-in {category_id: CategorySummary}
+    """
+    from .registry import get_categories
+    
+    with transaction.atomic():
+        mark = read_high_water_mark()
+    summaries = compute_summaries(chunk_size, through=mark)
+    
+    for _ in range(MAX_CATCH_UP_PASSES):
+        with transaction.atomic():
+            latest = read_high_water_mark()
+        if delta_size(mark, latest) <= chunk_size:
+            break
+        summaries = merge_summaries(summaries, compute_summaries(chunk_size, after=mark, through=latest))
+        mark = latest
+    
+    with transaction.atomic():
+        # New submissions wait on the counter shards and incremental updates
+        # on the summary rows, only for this bounded delta and the swap
+        watermark = AggregateWatermark.lock()
+        final_mark = read_high_water_mark()
+        summaries = merge_summaries(
+            summaries, compute_summaries(chunk_size, after=mark, through=final_mark)
+        )
+        swap_in(summaries, [category.id for category in get_categories()])
+        watermark.submission_id = final_mark.submission_id
+        watermark.save()
+        if settings.AGGREGATE_BACKEND == 'redis':
+            # Re-seeded from the rebuilt rows (seeding waits for this commit);
+            # late adds for submissions those rows count are skipped
+            from . import accumulator
+            accumulator.reset(final_mark.submission_id)
+    return summaries
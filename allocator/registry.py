@@ -0,0 +1,120 @@
+"""
+Process-local registry of budget categories.
+
+Categories almost never change, so every process keeps an immutable tuple of
+slotted records and reuses it across requests. A version number in the shared
+cache is bumped by post_save/post_delete signals; a process reloads from the
+database only when it sees a new version. The version is checked at most once
+every CATEGORY_REGISTRY_CHECK_INTERVAL seconds.
+"""
+from asgiref.sync import sync_to_async
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import time
+
+VERSION_KEY = 'category_registry_version'
+
+CategoryRecord = namedtuple('CategoryRecord', ['id', 'name', 'color', 'display_order'])
+
+_lock = threading.Lock()
+_state = {
+    'version': None,
+    'checked_at': 0.0,
+    'categories': (),
+    'by_id': {},
+}
+
+
+def _current_version():
+    """Read the shared version, creating one if the cache was flushed"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A fresh, unique starting point so no process mistakes it for its old version
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _load(version):
+    from allocator.models import BudgetCategory
+    
+    categories = tuple(
+        CategoryRecord(c.id, c.name, c.color, c.display_order)
+        for c in BudgetCategory.objects.order_by('display_order', 'name')
+    )
+    _state.update(
+        version=version,
+        checked_at=time.monotonic(),
+        categories=categories,
+        by_id={c.id: c for c in categories},
+    )
+
+
+def _is_fresh(now):
+    return _state['version'] is not None and now - _state['checked_at'] < settings.CATEGORY_REGISTRY_CHECK_INTERVAL
+
+
+def _ensure_fresh():
+    now = time.monotonic()
+    if _is_fresh(now):
+        return
+    with _lock:
+        version = _current_version()
+        if version == _state['version']:
+            _state['checked_at'] = now
+        else:
+            _load(version)
+
+
+def get_categories():
+    """All categories as an ordered tuple of CategoryRecord (display_order, name)"""
+    _ensure_fresh()
+    return _state['categories']
+
+
+def get_category_map():
+    """Dict mapping category id -> CategoryRecord"""
+    _ensure_fresh()
+    return _state['by_id']
+
+
+def get_version():
+    """Current registry version (changes whenever categories change)"""
+    _ensure_fresh()
+    return _state['version']
+
+
+async def aensure_fresh():
+    """
+    Async views: refresh the registry off the event loop when a check is due,
+    so the sync getters that follow are pure in-memory lookups.
+    """
+    if not _is_fresh(time.monotonic()):
+        await sync_to_async(_ensure_fresh)()
+
+
+async def aget_version():
+    """Async counterpart of get_version()"""
+    await aensure_fresh()
+    return _state['version']
+
+
+async def aget_category_map():
+    """
+    Async counterpart of get_category_map(). Pass the map on to the code that
+    decodes with it: a later sync getter could find the check due again.
+    """
+    await aensure_fresh()
+    return _state['by_id']
+
+
+def invalidate():
+    """Bump the shared version so every process reloads its registry"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    with _lock:
+        _state['version'] = None
@@ -0,0 +1,185 @@
+"""
+Submission write path for Tax Budget Allocator.
+Shared by allocate_view, API endpoints and load-generation scripts.
+
+Also owns the results cache: a submission never changes once written, so its
+packed allocation vector is cached by session_key when it is recorded.
+
+Allocations travel as integer basis points (0-10000) from the form through
+storage, the aggregate payload and the accumulators; they become Decimal
+percentages only at the UserAllocation column and for display.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from decimal import Decimal
+from .aggregates import increment_total_submissions, invalidate_aggregate_data
+from .models import (
+    AggregateOutboxEvent,
+    AllocationSubmission,
+    SubmissionCounter,
+    UserAllocation,
+    pack_allocations,
+    pack_basis_points,
+)
+import uuid
+
+
+def record_submission(basis_points, user_id=None, ip_address=None, session_key=None, submitted_at=None):
+    """
+    Persist one complete allocation and hand it to the aggregate pipeline.
+    
+    Args:
+        basis_points: Dict mapping category_id -> integer basis points (must sum to 10000)
+        user_id: Cookie-based user id, if the user consented
+        ip_address: Client IP address
+        session_key: Submission key; a new UUID is generated when omitted
+        submitted_at: Submission time; defaults to now
+    
+    All rows are written in one transaction (one sharded counter UPDATE, then
+    a single bulk INSERT for the per-category rows), so a failure never
+    leaves a half-written or miscounted submission.
+    In 'outbox' ingest mode the aggregate update is written to the outbox in
+    that same transaction; otherwise it is queued after the commit.
+    
+    Returns:
+        The created AllocationSubmission
+    """
+    session_key = session_key or str(uuid.uuid4())
+    submitted_at = submitted_at or timezone.now()
+    packed = settings.SUBMISSION_STORAGE == 'packed'
+    
+    with transaction.atomic():
+        # Counted first: the shard lock is what lets a rebuild wait out
+        # in-flight submissions (see SubmissionCounter.lock_all)
+        SubmissionCounter.increment()
+        if not packed:
+            UserAllocation.objects.bulk_create([
+                UserAllocation(
+                    session_key=session_key,
+                    user_id=user_id,
+                    category_id=category_id,
+                    percentage=Decimal(points).scaleb(-2),
+                    created_at=submitted_at,
+                    ip_address=ip_address
+                )
+                for category_id, points in basis_points.items()
+            ])
+        
+        # Packed mode stores the whole vector on the submission row
+        vector = pack_basis_points(basis_points)
+        submission = AllocationSubmission.objects.create(
+            session_key=session_key,
+            user_id=user_id,
+            submitted_at=submitted_at,
+            ip_address=ip_address,
+            allocation_vector=vector if packed else None
+        )
+        
+        if settings.AGGREGATE_BACKEND == 'redis':
+            # All-time sums go straight to the Redis hash, before any broker I/O;
+            # a Redis error is logged and repaired by the next rebuild rather
+            # than failing the request. The id lets the hash skip a submission
+            # a rebuild has already counted
+            from . import accumulator
+            transaction.on_commit(lambda: accumulator.add(basis_points, submission.id), robust=True)
+        
+        allocations_data = aggregate_payload(basis_points, submitted_at, submission.id)
+        if settings.AGGREGATE_INGEST_MODE == 'outbox':
+            # Committed with the submission; relay_aggregate_outbox applies it
+            AggregateOutboxEvent.objects.create(payload=allocations_data)
+        else:
+            transaction.on_commit(lambda: _queue_aggregate_update(allocations_data))
+        
+        # Warming the results cache is best effort: a cache error must not turn
+        # a saved submission into a 500 or skip the hooks after it
+        transaction.on_commit(lambda: cache_results_vector(session_key, vector), robust=True)
+        # The displayed total mirrors the counter incremented above (one source)
+        transaction.on_commit(increment_total_submissions, robust=True)
+    
+    return submission
+
+
+def aggregate_payload(basis_points, submitted_at, submission_id):
+    """The allocations_data list the aggregate pipeline consumes for one submission"""
+    timestamp = submitted_at.timestamp()
+    return [
+        {'category_id': cat_id, 'basis_points': points, 'submitted_at': timestamp,
+         'submission_id': submission_id}
+        for cat_id, points in basis_points.items()
+    ]
+
+
+def _queue_aggregate_update(allocations_data):
+    """Queue background aggregate update ('immediate' and 'batch' ingest modes)"""
+    try:
+        from allocator.tasks import queue_aggregate_update
+        queue_aggregate_update(allocations_data)
+    except Exception:
+        # Fallback: invalidate old cache if Celery/Redis not available.
+        # The total is left alone: increment_total_submissions keeps it current
+        invalidate_aggregate_data()
+
+
+def _results_key(session_key):
+    return f'results_vector:{session_key}'
+
+
+def cache_results_vector(session_key, vector):
+    """Cache a submission's packed allocation vector (contents are immutable)"""
+    cache.set(_results_key(session_key), vector, timeout=settings.RESULTS_VECTOR_CACHE_TIMEOUT)
+
+
+def get_results_vector(session_key):
+    """
+    Return the packed allocation vector for a submission, or None if unknown.
+    
+    Served from the cache when warm; otherwise loaded from whichever storage
+    the submission uses and cached for next time.
+    """
+    vector = cache.get(_results_key(session_key))
+    if vector is not None:
+        return vector
+    
+    submission = AllocationSubmission.objects.filter(
+        session_key=session_key, allocation_vector__isnull=False
+    ).only('allocation_vector').first()
+    if submission is not None:
+        vector = bytes(submission.allocation_vector)
+    else:
+        # Row-stored submission
+        rows = UserAllocation.objects.filter(
+            session_key=session_key
+        ).values_list('category_id', 'percentage')
+        if not rows:
+            return None
+        vector = pack_allocations(dict(rows))
+    
+    cache_results_vector(session_key, vector)
+    return vector
+
+
+async def aget_results_vector(session_key):
+    """Async counterpart of get_results_vector() using the async cache and ORM"""
+    vector = await cache.aget(_results_key(session_key))
+    if vector is not None:
+        return vector
+    
+    submission = await AllocationSubmission.objects.filter(
+        session_key=session_key, allocation_vector__isnull=False
+    ).only('allocation_vector').afirst()
+    if submission is not None:
+        vector = bytes(submission.allocation_vector)
+    else:
+        rows = [
+            row async for row in UserAllocation.objects.filter(
+                session_key=session_key
+            ).values_list('category_id', 'percentage')
+        ]
+        if not rows:
+            return None
+        vector = pack_allocations(dict(rows))
+    
+    await cache.aset(_results_key(session_key), vector, timeout=settings.RESULTS_VECTOR_CACHE_TIMEOUT)
+    return vector
@@ -0,0 +1,17 @@
+"""
+Signal handlers for Tax Budget Allocator.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import BudgetCategory
+from . import registry
+
+
+@receiver(post_save, sender=BudgetCategory)
+@receiver(post_delete, sender=BudgetCategory)
+def invalidate_category_registry(sender, **kwargs):
+    """Categories changed: make every process reload its registry"""
+    registry.invalidate()
+    # Again after commit, in case another process reloaded the old rows meanwhile
+    transaction.on_commit(registry.invalidate)
@@ -3,11 +3,209 @@ Celery tasks for Tax Budget Allocator.
 Handles background aggregate calculations for scalability.
 """
 from celery import shared_task
+from django.conf import settings
 from django.core.cache import cache
 from django.db import transaction
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal
+from allocator.aggregates import (
+    RECOMPUTE_LOCK_KEY, RECOMPUTE_LOCK_TIMEOUT, get_total_submissions, store_aggregate_data,
+)
 import json
 
+FLUSH_SCHEDULED_KEY = 'aggregate_flush_scheduled'
+TOTAL_SUBMISSIONS_KEY = 'aggregate_total_submissions'
+CACHE_DIRTY_KEY = 'aggregate_cache_dirty'
+REFRESH_SCHEDULED_KEY = 'aggregate_refresh_scheduled'
+# Shared with aggregate_view's recomputation so only one rebuild of the payload runs at a time
+REFRESH_LOCK_KEY = RECOMPUTE_LOCK_KEY
+
+
+def allocation_basis_points(alloc):
+    """Integer basis points of one payload item ('percentage' in payloads queued before them)"""
+    from allocator.models import basis_points
+    
+    if 'basis_points' in alloc:
+        return alloc['basis_points']
+    return basis_points(alloc['percentage'])
+
+
+def fold_allocations(payloads):
+    """
+    Fold many submission payloads into per-category (sum, count, sum of squares) deltas.
+    
+    Args:
+        payloads: Iterable of allocations_data lists (see update_category_aggregates)
+    
+    Sums are accumulated as exact integers (basis points and basis points
+    squared) and converted to Decimal percentages once per category.
+    """
+    sums = {}
+    for allocations_data in payloads:
+        for alloc in allocations_data:
+            points = allocation_basis_points(alloc)
+            entry = sums.setdefault(alloc['category_id'], [0, 0, 0])
+            entry[0] += points
+            entry[1] += 1
+            entry[2] += points * points
+    return {
+        category_id: (Decimal(total).scaleb(-2), count, Decimal(squares).scaleb(-4))
+        for category_id, (total, count, squares) in sums.items()
+    }
+
+
+def fold_bucket_deltas(payloads):
+    """
+    Fold submission payloads into hourly/daily bucket deltas for
+    CategoryAggregateBucket.apply_deltas: (sum, sum of squares, count).
+    
+    Each allocation may carry 'submitted_at' (epoch seconds); payloads queued
+    before that field existed are bucketed at the current time.
+    """
+    from allocator.models import CategoryAggregateBucket
+    
+    now = datetime.now(dt_timezone.utc)
+    sums = {}
+    for allocations_data in payloads:
+        for alloc in allocations_data:
+            submitted_at = alloc.get('submitted_at')
+            moment = datetime.fromtimestamp(submitted_at, dt_timezone.utc) if submitted_at else now
+            points = allocation_basis_points(alloc)
+            for granularity in CategoryAggregateBucket.GRANULARITIES:
+                key = (granularity, CategoryAggregateBucket.truncate(moment, granularity), alloc['category_id'])
+                entry = sums.setdefault(key, [0, 0, 0])
+                entry[0] += points
+                entry[1] += points * points
+                entry[2] += 1
+    return {
+        key: (Decimal(total).scaleb(-2), Decimal(squares).scaleb(-4), count)
+        for key, (total, squares, count) in sums.items()
+    }
+
+
+def fold_histograms(payloads):
+    """
+    Fold submission payloads into histogram deltas.
+    
+    Returns:
+        (all_time, buckets): {category_id: bin counts} and
+        {(granularity, bucket_start, category_id): bin counts}
+    """
+    from allocator import histograms
+    from allocator.models import CategoryAggregateBucket
+    
+    now = datetime.now(dt_timezone.utc)
+    all_time = {}
+    buckets = {}
+    for allocations_data in payloads:
+        for alloc in allocations_data:
+            submitted_at = alloc.get('submitted_at')
+            moment = datetime.fromtimestamp(submitted_at, dt_timezone.utc) if submitted_at else now
+            index = histograms.basis_points_bin(allocation_basis_points(alloc))
+            category_id = alloc['category_id']
+            all_time.setdefault(category_id, histograms.empty())[index] += 1
+            for granularity in CategoryAggregateBucket.GRANULARITIES:
+                key = (granularity, CategoryAggregateBucket.truncate(moment, granularity), category_id)
+                buckets.setdefault(key, histograms.empty())[index] += 1
+    return all_time, buckets
+
+
+def payload_submission_id(allocations_data):
+    """AllocationSubmission.id carried by a payload (None for payloads queued before it was)"""
+    return allocations_data[0].get('submission_id') if allocations_data else None
+
+
+def apply_payloads(payloads):
+    """
+    Apply submission payloads to every summary in one transaction: the
+    all-time CategoryAggregate sums, the hourly/daily buckets and their
+    histograms.
+    
+    Application is idempotent per submission: payloads whose submission is
+    already in the AppliedSubmission ledger (redeliveries, retries, duplicates
+    within the batch) are dropped. Claims are unique inserts, so concurrent
+    workers take no global lock. Submissions a rebuild has already counted
+    (at or below AggregateWatermark.submission_id) only reach the buckets,
+    which rebuilds do not touch; the mark is read after the all-time rows are
+    locked, so it cannot move between the check and the increment. With
+    AGGREGATE_BACKEND='redis' the all-time sums are left to allocator.accumulator.
+    
+    Returns:
+        Number of payloads applied
+    """
+    from allocator.models import (
+        AggregateWatermark, AppliedSubmission, CategoryAggregate, CategoryAggregateBucket,
+    )
+    
+    with transaction.atomic():
+        claimed = AppliedSubmission.claim(
+            {payload_submission_id(allocations_data) for allocations_data in payloads} - {None}
+        )
+        fresh = []
+        for allocations_data in payloads:
+            submission_id = payload_submission_id(allocations_data)
+            if submission_id is not None:
+                if submission_id not in claimed:
+                    continue
+                claimed.discard(submission_id)
+            fresh.append(allocations_data)
+        if not fresh:
+            return 0
+        
+        all_time_histograms, bucket_histograms = fold_histograms(fresh)
+        CategoryAggregateBucket.apply_deltas(fold_bucket_deltas(fresh))
+        CategoryAggregateBucket.apply_histograms(bucket_histograms)
+        
+        CategoryAggregate.lock_rows({alloc['category_id'] for allocations_data in fresh for alloc in allocations_data})
+        rebuilt_through = AggregateWatermark.current().submission_id
+        all_time = [
+            allocations_data for allocations_data in fresh
+            if payload_submission_id(allocations_data) is None
+            or payload_submission_id(allocations_data) > rebuilt_through
+        ]
+        if settings.AGGREGATE_BACKEND != 'redis':
+            # The Redis accumulator owns the all-time sums otherwise
+            CategoryAggregate.apply_deltas(fold_allocations(all_time))
+        if len(all_time) < len(fresh):
+            all_time_histograms = fold_histograms(all_time)[0]
+        CategoryAggregate.apply_histograms(all_time_histograms)
+    return len(fresh)
+
+
+def queue_aggregate_update(allocations_data):
+    """
+    Hand one submission to the aggregate pipeline.
+    
+    In 'immediate' mode each submission gets its own Celery task. In 'batch'
+    mode the submission is buffered and a flush is triggered once the buffer
+    reaches AGGREGATE_BATCH_SIZE (Celery beat flushes partial batches).
+    ('outbox' mode never calls this: see record_submission.)
+    """
+    if settings.AGGREGATE_INGEST_MODE != 'batch':
+        update_category_aggregates.delay(allocations_data)
+        return
+    
+    from allocator import buffer
+    
+    pending = buffer.push(allocations_data)
+    if pending >= settings.AGGREGATE_BATCH_SIZE:
+        # Only one size-triggered flush in flight at a time
+        if cache.add(FLUSH_SCHEDULED_KEY, True, timeout=settings.AGGREGATE_FLUSH_INTERVAL * 5):
+            flush_submission_buffer.delay()
+
+
+def request_cache_refresh():
+    """
+    Mark the aggregate cache dirty and schedule a coalesced refresh.
+    
+    However many submissions arrive, at most one refresh is scheduled per
+    AGGREGATE_REFRESH_WINDOW seconds; later callers only set the dirty flag.
+    """
+    cache.set(CACHE_DIRTY_KEY, True, timeout=None)
+    window = settings.AGGREGATE_REFRESH_WINDOW
+    if cache.add(REFRESH_SCHEDULED_KEY, True, timeout=window * 10):
+        refresh_redis_cache.apply_async(kwargs={'coalesced': True}, countdown=window)
+
 
 @shared_task(name='allocator.update_category_aggregates')
 def update_category_aggregates(allocations_data):
@@ -15,125 +213,197 @@ def update_category_aggregates(allocations_data):
     Update CategoryAggregate summary table and Redis cache.
     
     Args:
-        allocations_data: List of dicts with 'category_id' and 'percentage'
+        allocations_data: List of dicts with 'category_id', 'basis_points'
+                          (integer, 0-10000; older payloads carry 'percentage')
+                          and optionally 'submitted_at' (epoch seconds) and
+                          'submission_id' (AllocationSubmission.id)
     
-    This runs asynchronously after each submission to update aggregates.
+    This runs asynchronously after each submission to update aggregates
+    and the hourly/daily CategoryAggregateBucket rollups.
+    Averages are derived from total/count at read time, so sums and counts
+    are only ever incremented; histogram bins are incremented in place.
     """
-    from allocator.models import CategoryAggregate, BudgetCategory
+    if not apply_payloads([allocations_data]):
+        return {'status': 'skipped', 'reason': 'already applied'}
     
-    with transaction.atomic():
-        for alloc in allocations_data:
-            category_id = alloc['category_id']
-            percentage = Decimal(str(alloc['percentage']))
-            
-            # Get or create aggregate record
-            aggregate, created = CategoryAggregate.objects.get_or_create(
-                category_id=category_id,
-                defaults={
-                    'total_percentage': 0,
-                    'submission_count': 0,
-                    'avg_percentage': 0
-                }
+    # After updating DB, schedule a (coalesced) Redis cache refresh
+    request_cache_refresh()
+    
+    return {'status': 'success', 'categories_updated': len(allocations_data)}
+
+
+@shared_task(name='allocator.flush_submission_buffer')
+def flush_submission_buffer(batch_size=None):
+    """
+    Drain buffered submissions in batches and apply them to the summary table.
+    
+    Each batch is folded into per-category sums and histograms in memory and
+    written with a few set-based statements; the Redis cache is refreshed
+    once per flush.
+    Scheduled by Celery beat and triggered early when the buffer fills up.
+    """
+    from allocator import buffer
+    
+    batch_size = batch_size or settings.AGGREGATE_BATCH_SIZE
+    cache.delete(FLUSH_SCHEDULED_KEY)
+    
+    batches = 0
+    submissions = 0
+    while True:
+        payloads = buffer.drain(batch_size)
+        if not payloads:
+            break
+        try:
+            applied = apply_payloads(payloads)
+        except Exception:
+            # Keep the submissions for the next flush instead of dropping them
+            buffer.requeue(payloads)
+            raise
+        batches += 1
+        submissions += applied
+        if len(payloads) < batch_size:
+            break
+    
+    if submissions:
+        refresh_redis_cache()
+    
+    return {'status': 'success', 'batches': batches, 'submissions': submissions}
+
+
+@shared_task(name='allocator.relay_aggregate_outbox')
+def relay_aggregate_outbox(batch_size=None):
+    """
+    Drain the aggregate outbox in batches into the summary tables.
+    
+    Each batch is applied and deleted in one transaction, so an event is
+    never lost and, with the applied-submissions ledger, never counted twice.
+    Concurrent relays skip each other's locked rows.
+    Scheduled by Celery beat every AGGREGATE_FLUSH_INTERVAL seconds.
+    """
+    from allocator.models import AggregateOutboxEvent
+    
+    batch_size = batch_size or settings.AGGREGATE_BATCH_SIZE
+    batches = 0
+    submissions = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                AggregateOutboxEvent.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
             )
-            
-            # Incrementally update
-            aggregate.add_submission(percentage)
+            if not events:
+                break
+            applied = apply_payloads([event.payload for event in events])
+            AggregateOutboxEvent.objects.filter(id__in=[event.id for event in events]).delete()
+        batches += 1
+        submissions += applied
+        if len(events) < batch_size:
+            break
     
-    # After updating DB, refresh Redis cache
-    refresh_redis_cache.delay()
+    if submissions:
+        refresh_redis_cache()
     
-    return {'status': 'success', 'categories_updated': len(allocations_data)}
+    return {'status': 'success', 'batches': batches, 'submissions': submissions}
+
+
+@shared_task(name='allocator.compact_applied_submissions')
+def compact_applied_submissions():
+    """
+    Keep the applied-submissions ledger small.
+    
+    Scheduled by Celery beat every AGGREGATE_LEDGER_COMPACT_INTERVAL seconds;
+    see AppliedSubmission.compact().
+    """
+    from allocator.models import AppliedSubmission
+    
+    return {'status': 'success', 'applied_through': AppliedSubmission.compact()}
+
+
+@shared_task(name='allocator.checkpoint_aggregate_accumulator')
+def checkpoint_aggregate_accumulator():
+    """
+    Copy the Redis accumulator into CategoryAggregate (AGGREGATE_BACKEND='redis').
+    Scheduled by Celery beat every AGGREGATE_CHECKPOINT_INTERVAL seconds.
+    """
+    if settings.AGGREGATE_BACKEND != 'redis':
+        return {'status': 'skipped', 'reason': 'database backend'}
+    
+    from allocator import accumulator
+    
+    written = accumulator.checkpoint()
+    if written is None:
+        return {'status': 'skipped', 'reason': 'seeding'}
+    return {'status': 'success', 'categories_checkpointed': written}
 
 
 @shared_task(name='allocator.refresh_redis_cache')
-def refresh_redis_cache():
+def refresh_redis_cache(coalesced=False):
     """
     Refresh Redis cache with latest aggregate data from summary table.
     Falls back to live calculation if summary table is empty.
+    
+    Args:
+        coalesced: True when scheduled by request_cache_refresh(); the refresh
+                   is skipped if nothing has been marked dirty since the last one.
+    
+    A single-flight lock ensures only one refresh computes at a time.
     """
-    from allocator.models import CategoryAggregate, BudgetCategory, UserAllocation, AllocationSubmission
-    from django.db.models import Avg
-    
-    # Try to get from summary table first
-    aggregates = CategoryAggregate.objects.select_related('category').all()
-    
-    if aggregates.exists():
-        # Use pre-calculated summary table
-        aggregate_data = []
-        for agg in aggregates:
-            aggregate_data.append({
-                'category': agg.category.name,
-                'avg_percentage': float(agg.avg_percentage),
-                'color': agg.category.color,
-            })
-    else:
-        # Fallback: Calculate from raw data (slower)
-        categories = BudgetCategory.objects.all().order_by('display_order', 'name')
-        aggregate_data = []
+    if coalesced:
+        # Writes from here on must schedule a new refresh
+        cache.delete(REFRESH_SCHEDULED_KEY)
+        if not cache.get(CACHE_DIRTY_KEY):
+            return {'status': 'skipped', 'reason': 'clean'}
+    
+    if not cache.add(REFRESH_LOCK_KEY, True, timeout=RECOMPUTE_LOCK_TIMEOUT):
+        # A refresh is already running and may miss our writes; retry later
+        request_cache_refresh()
+        return {'status': 'skipped', 'reason': 'locked'}
+    
+    try:
+        cache.delete(CACHE_DIRTY_KEY)
+        aggregate_data = _build_aggregate_data()
+        
+        # Total is maintained incrementally; only seed it when missing
+        total_submissions = get_total_submissions()
         
-        for category in categories:
-            avg_percentage = UserAllocation.objects.filter(
-                category=category
-            ).aggregate(avg=Avg('percentage'))['avg'] or 0
-            
-            aggregate_data.append({
-                'category': category.name,
-                'avg_percentage': round(float(avg_percentage), 2),
-                'color': category.color,
-            })
-    
-    # Store in Redis
-    cache_key = 'aggregate_allocations_v2'
-    cache.set(cache_key, aggregate_data, timeout=None)  # Never expire
-    
-    # Also store metadata
-    total_submissions = AllocationSubmission.objects.count()
-    cache.set('aggregate_total_submissions', total_submissions, timeout=None)
+        # Store in Redis (never expires)
+        store_aggregate_data(aggregate_data, total_submissions)
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
     
     return {'status': 'success', 'cached_categories': len(aggregate_data)}
 
 
+def _build_aggregate_data():
+    """Build the cached aggregate payload from the summary table or raw data"""
+    from allocator.aggregates import build_summary_data, build_live_data
+    
+    # Try the summary table first, fall back to raw data (slower)
+    aggregate_data = build_summary_data()
+    if aggregate_data is None:
+        aggregate_data = build_live_data()
+    return aggregate_data
+
+
 @shared_task(name='allocator.rebuild_aggregates_from_scratch')
-def rebuild_aggregates_from_scratch():
+def rebuild_aggregates_from_scratch(chunk_size=20000):
     """
     Completely rebuild CategoryAggregate summary table from raw data.
     Use this for initial setup or when data needs to be recalculated.
-    """
-    from allocator.models import CategoryAggregate, BudgetCategory, UserAllocation
-    from django.db.models import Sum, Count, Avg
     
-    categories = BudgetCategory.objects.all()
+    Online snapshot-plus-delta rebuild (see allocator.rebuild): the long scan
+    holds no locks and the results are swapped in with a short transaction,
+    so incremental updates keep flowing and are never double counted.
+    """
+    from allocator.rebuild import rebuild_aggregates
     
-    with transaction.atomic():
-        # Clear existing aggregates
-        CategoryAggregate.objects.all().delete()
-        
-        # Rebuild from raw data
-        for category in categories:
-            stats = UserAllocation.objects.filter(
-                category=category
-            ).aggregate(
-                total=Sum('percentage'),
-                count=Count('id'),
-                avg=Avg('percentage')
-            )
-            
-            total_percentage = stats['total'] or 0
-            submission_count = stats['count'] or 0
-            avg_percentage = stats['avg'] or 0
-            
-            CategoryAggregate.objects.create(
-                category=category,
-                total_percentage=total_percentage,
-                submission_count=submission_count,
-                avg_percentage=avg_percentage
-            )
+    summaries = rebuild_aggregates(chunk_size)
     
-    # Refresh Redis cache
+    # Refresh Redis cache (and re-seed the total from the submission counter)
+    cache.delete(TOTAL_SUBMISSIONS_KEY)
     refresh_redis_cache.delay()
     
     return {
         'status': 'success',
-        'categories_rebuilt': categories.count(),
+        'categories_rebuilt': len(summaries),
         'message': 'Summary table rebuilt from scratch'
     }
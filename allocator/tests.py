@@ -1,10 +1,12 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.cache import cache
 from decimal import Decimal
+import asyncio
 import uuid
 
-from .models import BudgetCategory, UserAllocation, AllocationSubmission, CategoryAggregate
+from .models import BudgetCategory, UserAllocation, AllocationSubmission, CategoryAggregate, SubmissionCounter
+from .models import pack_allocations, unpack_allocations
 from .forms import TaxAllocationForm
 
 
@@ -104,6 +106,42 @@ class AllocationSubmissionModelTest(TestCase):
         self.assertEqual(submissions[0], submission2)  # Most recent first
         self.assertEqual(submissions[1], submission1)
 
+    def test_packed_allocation_vector(self):
+        """Test allocations round-trip through the packed vector"""
+        healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=2)
+        education = BudgetCategory.objects.create(name="Education", display_order=1)
+        vector = pack_allocations({healthcare.id: Decimal('25.50'), education.id: Decimal('74.50')})
+        
+        self.assertEqual(len(vector), 12)  # 6 bytes per category
+        self.assertEqual(
+            unpack_allocations(vector),
+            [(healthcare.id, Decimal('25.50')), (education.id, Decimal('74.50'))]
+        )
+        
+        submission = AllocationSubmission.objects.create(
+            session_key=self.session_key, allocation_vector=vector
+        )
+        submission.refresh_from_db()
+        allocations = submission.get_allocations()
+        self.assertEqual([a.category.name for a in allocations], ["Education", "Healthcare"])
+        self.assertEqual(allocations[1].percentage, Decimal('25.50'))
+
+    def test_pack_submissions_command(self):
+        """Test existing row-stored submissions are migrated to packed storage"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        category = BudgetCategory.objects.create(name="Healthcare")
+        UserAllocation.objects.create(session_key=self.session_key, category=category, percentage=100)
+        submission = AllocationSubmission.objects.create(session_key=self.session_key)
+        
+        call_command('pack_submissions', stdout=StringIO())
+        
+        submission.refresh_from_db()
+        self.assertTrue(submission.is_packed)
+        self.assertEqual(UserAllocation.objects.count(), 0)
+        self.assertEqual(submission.get_allocations()[0].percentage, Decimal('100'))
+
 
 class CategoryAggregateModelTest(TestCase):
     """Test CategoryAggregate model"""
@@ -122,10 +160,13 @@ class CategoryAggregateModelTest(TestCase):
         self.assertEqual(self.aggregate.total_percentage, Decimal('250.00'))
         self.assertEqual(self.aggregate.submission_count, 10)
 
-    def test_update_average(self):
-        """Test average calculation"""
-        self.aggregate.update_average()
+    def test_avg_percentage_tracks_totals(self):
+        """Test the average is derived from total/count, never stored"""
         self.assertEqual(self.aggregate.avg_percentage, Decimal('25.00'))
+        CategoryAggregate.apply_deltas({self.category.id: (Decimal('80'), 2)})
+        self.aggregate.refresh_from_db()
+        self.assertEqual(self.aggregate.avg_percentage, Decimal('27.5'))
+        self.assertEqual(str(self.aggregate), 'Healthcare: 27.50% (n=12)')
 
     def test_add_submission(self):
         """Test incrementally adding submissions"""
@@ -149,6 +190,28 @@ class CategoryAggregateModelTest(TestCase):
         self.assertEqual(new_aggregate.submission_count, 1)
         self.assertEqual(new_aggregate.avg_percentage, Decimal('25'))
 
+    def test_apply_deltas(self):
+        """Test set-based update increments existing and missing rows"""
+        education = BudgetCategory.objects.create(name="Education")
+        
+        CategoryAggregate.apply_deltas({
+            self.category.id: (Decimal('30'), 1),
+            education.id: (Decimal('70'), 1),
+        })
+        
+        self.aggregate.refresh_from_db()
+        self.assertEqual(self.aggregate.total_percentage, Decimal('280.00'))
+        self.assertEqual(self.aggregate.submission_count, 11)
+        
+        new_aggregate = CategoryAggregate.objects.get(category=education)
+        self.assertEqual(new_aggregate.total_percentage, Decimal('70'))
+        self.assertEqual(new_aggregate.submission_count, 1)
+        self.assertEqual(new_aggregate.average_percentage, Decimal('70'))
+
+    def test_average_percentage_computed_at_read_time(self):
+        """Test average is derived from total and count"""
+        self.assertEqual(self.aggregate.average_percentage, Decimal('25'))
+
 
 class TaxAllocationFormTest(TestCase):
     """Test TaxAllocationForm"""
@@ -225,6 +288,38 @@ class TaxAllocationFormTest(TestCase):
         for cat_id, percentage in allocations.items():
             self.assertEqual(percentage, Decimal('10'))
 
+    def test_get_basis_points(self):
+        """Test values are parsed straight into integer basis points"""
+        categories = list(BudgetCategory.objects.all())
+        form_data = {f'category_{cat.id}': '10' for cat in categories}
+        form_data[f'category_{categories[0].id}'] = '9.5'
+        form_data[f'category_{categories[1].id}'] = '10.50'
+        
+        form = TaxAllocationForm(data=form_data)
+        self.assertTrue(form.is_valid())
+        basis_points = form.get_basis_points()
+        self.assertEqual(basis_points[categories[0].id], 950)
+        self.assertEqual(basis_points[categories[1].id], 1050)
+        self.assertEqual(form.get_allocations()[categories[0].id], Decimal('9.50'))
+
+    def test_form_rejects_more_than_two_decimal_places(self):
+        """Test sub-basis-point precision is rejected"""
+        categories = list(BudgetCategory.objects.all())
+        form_data = {f'category_{cat.id}': '10' for cat in categories}
+        form_data[f'category_{categories[0].id}'] = '10.001'
+        
+        form = TaxAllocationForm(data=form_data)
+        self.assertFalse(form.is_valid())
+        self.assertIn(f'category_{categories[0].id}', form.errors)
+
+    def test_field_definitions_are_shared(self):
+        """Test fields are built once per registry version, not per form"""
+        form1 = TaxAllocationForm()
+        form2 = TaxAllocationForm()
+        self.assertEqual(list(form1.fields), list(form2.fields))
+        for name in form1.fields:
+            self.assertIs(form1.fields[name], form2.fields[name])
+
 
 class AllocateViewTest(TestCase):
     """Test allocate_view"""
@@ -248,6 +343,23 @@ class AllocateViewTest(TestCase):
         self.assertIn('form', response.context)
         self.assertIn('categories', response.context)
 
+    def test_get_allocate_view_uses_category_registry(self):
+        """Test the form page makes no queries once the registry is warm"""
+        self.client.get(reverse('allocate'))  # Warm the registry
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('allocate'))
+        self.assertEqual(len(response.context['form'].fields), 10)
+
+    def test_category_change_invalidates_registry(self):
+        """Test saving a category reloads the registry"""
+        from .registry import get_categories
+        
+        self.assertEqual(len(get_categories()), 10)
+        BudgetCategory.objects.create(name="Category 10", display_order=10)
+        self.assertEqual(len(get_categories()), 11)
+        self.assertEqual(get_categories()[-1].name, "Category 10")
+
     def test_post_valid_allocation(self):
         """Test POST with valid allocation"""
         categories = BudgetCategory.objects.all()
@@ -269,6 +381,21 @@ class AllocateViewTest(TestCase):
         # Should set cookie
         self.assertIn('tax_allocator_user_id', response.cookies)
 
+    @override_settings(SUBMISSION_STORAGE='packed')
+    def test_post_valid_allocation_packed(self):
+        """Test packed storage writes a single row per submission"""
+        categories = BudgetCategory.objects.all()
+        post_data = {f'category_{cat.id}': '10' for cat in categories}
+        
+        response = self.client.post(reverse('allocate'), post_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserAllocation.objects.count(), 0)
+        self.assertTrue(AllocationSubmission.objects.get().is_packed)
+        
+        response = self.client.get(response.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['allocations']), 10)
+
     def test_post_invalid_allocation(self):
         """Test POST with invalid allocation"""
         categories = BudgetCategory.objects.all()
@@ -307,14 +434,186 @@ class AllocateViewTest(TestCase):
         self.assertEqual(submissions[0].user_id, submissions[1].user_id)
 
 
+class RecordSubmissionTest(TestCase):
+    """Test the record_submission() service"""
+
+    def setUp(self):
+        for i in range(10):
+            BudgetCategory.objects.create(name=f"Category {i}", display_order=i)
+        self.allocations = {cat.id: 1000 for cat in BudgetCategory.objects.all()}
+
+    @override_settings(AGGREGATE_INGEST_MODE='outbox')
+    def test_results_cache_error_does_not_fail_submission(self):
+        """Test a failing results-cache warm-up is logged and later hooks still run"""
+        from unittest import mock
+        from . import services
+        
+        cache.clear()
+        with mock.patch.object(services, 'cache_results_vector', side_effect=RuntimeError('cache down')), \
+                self.assertLogs('django.test', level='ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                submission = services.record_submission(self.allocations)
+        
+        self.assertTrue(AllocationSubmission.objects.filter(pk=submission.pk).exists())
+        self.assertEqual(cache.get('aggregate_total_submissions'), 1)
+
+    @override_settings(AGGREGATE_INGEST_MODE='outbox')
+    def test_record_submission_bulk_inserts(self):
+        """Test rows are written with one bulk INSERT plus the submission"""
+        from .services import record_submission
+        
+        SubmissionCounter.objects.bulk_create(
+            [SubmissionCounter(shard=i) for i in range(16)], ignore_conflicts=True
+        )
+        
+        # SAVEPOINT, counter UPDATE, bulk INSERT, submission INSERT, outbox INSERT, RELEASE
+        with self.assertNumQueries(6):
+            submission = record_submission(self.allocations, user_id='user-1', ip_address='127.0.0.1')
+        
+        self.assertEqual(UserAllocation.objects.filter(session_key=submission.session_key).count(), 10)
+        self.assertEqual(submission.user_id, 'user-1')
+        self.assertEqual(SubmissionCounter.total(), 1)
+
+    def test_record_submission_is_atomic(self):
+        """Test a failure leaves no half-written submission"""
+        from unittest import mock
+        from .services import record_submission
+        
+        with mock.patch.object(AllocationSubmission.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                record_submission(self.allocations)
+        
+        self.assertEqual(UserAllocation.objects.count(), 0)
+
+    @override_settings(AGGREGATE_INGEST_MODE='outbox')
+    def test_basis_points_end_to_end(self):
+        """Test integer basis points reach storage and the payload, and fold exactly"""
+        from .models import AggregateOutboxEvent
+        from .services import record_submission
+        from .tasks import fold_allocations
+        
+        category_ids = list(self.allocations)
+        thirds = {category_ids[0]: 3333, category_ids[1]: 3333, category_ids[2]: 3334}
+        submission = record_submission(thirds)
+        
+        payload = AggregateOutboxEvent.objects.get().payload
+        self.assertEqual([alloc['basis_points'] for alloc in payload], [3333, 3333, 3334])
+        self.assertEqual(
+            UserAllocation.objects.get(session_key=submission.session_key, category_id=category_ids[2]).percentage,
+            Decimal('33.34')
+        )
+        
+        total, count, squares = fold_allocations([payload] * 3000)[category_ids[0]]
+        self.assertEqual((total, count), (Decimal('99990'), 3000))
+        self.assertEqual(squares, Decimal('3332666.7'))
+
+
+class SubmissionCounterTest(TestCase):
+    """Test the sharded submission counter"""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    @override_settings(SUBMISSION_COUNTER_SHARDS=4)
+    def test_increments_spread_across_shards(self):
+        """Test shards are created on demand and summed for the total"""
+        SubmissionCounter.objects.all().delete()
+        for i in range(50):
+            SubmissionCounter.increment()
+        SubmissionCounter.increment(5)
+        
+        self.assertEqual(SubmissionCounter.total(), 55)
+        self.assertLessEqual(SubmissionCounter.objects.count(), 4)
+        self.assertGreater(SubmissionCounter.objects.count(), 1)
+
+    def test_total_submissions_seeded_from_counter(self):
+        """Test the cache mirror is seeded without counting submissions"""
+        from .aggregates import get_total_submissions
+        
+        SubmissionCounter.objects.all().delete()
+        SubmissionCounter.objects.create(shard=0, count=7)
+        SubmissionCounter.objects.create(shard=1, count=5)
+        
+        self.assertEqual(get_total_submissions(), 12)
+        self.assertEqual(cache.get('aggregate_total_submissions'), 12)
+
+    def test_reconcile_command(self):
+        """Test drift is reported, then corrected with --fix"""
+        from django.conf import settings
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        
+        SubmissionCounter.objects.all().delete()
+        for i in range(3):
+            AllocationSubmission.objects.create(session_key=f'session-{i}')
+        SubmissionCounter.objects.create(shard=5, count=1)
+        
+        with self.assertRaises(CommandError):
+            call_command('reconcile_submission_counter', stdout=StringIO())
+        
+        call_command('reconcile_submission_counter', '--fix', stdout=StringIO())
+        self.assertEqual(SubmissionCounter.total(), 3)
+        # Every shard existed (and was locked) during the correction
+        self.assertEqual(SubmissionCounter.objects.count(), settings.SUBMISSION_COUNTER_SHARDS)
+        self.assertEqual(cache.get('aggregate_total_submissions'), 3)
+        call_command('reconcile_submission_counter', stdout=StringIO())  # No drift left
+
+    def test_reconcile_fails_on_mirror_drift(self):
+        """Test a cache mirror that disagrees with the counter is reported"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        
+        SubmissionCounter.objects.all().delete()
+        AllocationSubmission.objects.create(session_key='session-0')
+        SubmissionCounter.objects.create(shard=0, count=1)
+        cache.set('aggregate_total_submissions', 2)
+        
+        with self.assertRaisesMessage(CommandError, 'Cache mirror is off by +1'):
+            call_command('reconcile_submission_counter', stdout=StringIO())
+        call_command('reconcile_submission_counter', '--fix', stdout=StringIO())
+        self.assertEqual(cache.get('aggregate_total_submissions'), 1)
+
+    @override_settings(AGGREGATE_INGEST_MODE='outbox')
+    def test_total_counts_each_submission_once(self):
+        """Test the mirrored total equals the submissions after they are relayed"""
+        from django.core.management import call_command
+        from io import StringIO
+        from .aggregates import get_total_submissions
+        from .services import record_submission
+        from .tasks import relay_aggregate_outbox
+        
+        category = BudgetCategory.objects.create(name="Healthcare")
+        SubmissionCounter.objects.all().delete()
+        get_total_submissions()  # Seed the mirror before the first submission
+        for i in range(5):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_submission({category.id: 10000})
+            if i == 2:
+                cache.delete('aggregate_total_submissions')  # Evicted: re-seeded from the counter
+        relay_aggregate_outbox()
+        
+        self.assertEqual(get_total_submissions(), 5)
+        self.assertEqual(cache.get('aggregate_allocations_v2')[0]['avg_percentage'], 100.0)
+        call_command('reconcile_submission_counter', stdout=StringIO())
+
+
 class ResultsViewTest(TestCase):
     """Test results_view"""
 
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.category = BudgetCategory.objects.create(name="Healthcare")
         self.session_key = str(uuid.uuid4())
 
+    def tearDown(self):
+        cache.clear()
+
     def test_results_view_with_valid_session(self):
         """Test results view with valid session key"""
         UserAllocation.objects.create(
@@ -335,6 +634,88 @@ class ResultsViewTest(TestCase):
         self.assertEqual(response.status_code, 302)  # Redirect
         self.assertEqual(response.url, reverse('allocate'))
 
+    @override_settings(AGGREGATE_INGEST_MODE='batch')
+    def test_results_served_from_cache_after_submission(self):
+        """Test the results page needs no queries once the submission is recorded"""
+        from .services import record_submission
+        from . import buffer
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            record_submission({self.category.id: 10000}, session_key=self.session_key)
+        buffer.drain(100)
+        self.client.get(reverse('allocate'))  # Warm the category registry
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('results', args=[self.session_key]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Healthcare')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+    @override_settings(RESULTS_CACHE_TIMEOUT=31536000, RESULTS_VECTOR_CACHE_TIMEOUT=3600)
+    def test_vector_cache_ttl_is_separate_from_max_age(self):
+        """Test the server-side vector TTL does not follow the browser max-age"""
+        from unittest import mock
+        from .services import cache_results_vector
+
+        with mock.patch('allocator.services.cache.set') as cache_set:
+            cache_results_vector(self.session_key, b'')
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], 3600)
+
+        UserAllocation.objects.create(
+            session_key=self.session_key,
+            category=self.category,
+            percentage=Decimal('100')
+        )
+        response = self.client.get(reverse('results', args=[self.session_key]))
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    async def test_async_results_view(self):
+        """Test the ASGI variant reads through the async cache and ORM"""
+        from django.test import AsyncRequestFactory
+        from .views import aresults_view
+        
+        await UserAllocation.objects.acreate(
+            session_key=self.session_key,
+            category=self.category,
+            percentage=Decimal('100')
+        )
+        
+        request = AsyncRequestFactory().get(reverse('results', args=[self.session_key]))
+        response = await aresults_view(request, self.session_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Healthcare')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    async def test_async_results_view_decodes_without_sync_registry_check(self):
+        """Test the category map is fetched async even when a registry check falls due mid-request"""
+        from unittest import mock
+        from django.test import AsyncRequestFactory
+        from . import registry
+        from .views import aresults_view
+        
+        await AllocationSubmission.objects.acreate(
+            session_key=self.session_key,
+            allocation_vector=pack_allocations({self.category.id: 100}),
+        )
+        request = AsyncRequestFactory().get(reverse('results', args=[self.session_key]))
+        with mock.patch.object(registry, 'get_category_map',
+                               side_effect=AssertionError('sync registry read on the event loop')):
+            response = await aresults_view(request, self.session_key)
+        self.assertContains(response, 'Healthcare')
+
+    def test_conditional_get_returns_304(self):
+        """Test If-None-Match with the results ETag short-circuits"""
+        UserAllocation.objects.create(
+            session_key=self.session_key,
+            category=self.category,
+            percentage=Decimal('100')
+        )
+        etag = self.client.get(reverse('results', args=[self.session_key]))['ETag']
+        
+        response = self.client.get(reverse('results', args=[self.session_key]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
 
 class AggregateViewTest(TestCase):
     """Test aggregate_view with 3-tier caching"""
@@ -370,16 +751,12 @@ class AggregateViewTest(TestCase):
             total_percentage=Decimal('300'),
             submission_count=10
         )
-        agg1.update_average()
-        agg1.save()
         
         agg2 = CategoryAggregate.objects.create(
             category=self.education,
             total_percentage=Decimal('700'),
             submission_count=10
         )
-        agg2.update_average()
-        agg2.save()
         
         response = self.client.get(reverse('aggregate'))
         self.assertEqual(response.status_code, 200)
@@ -406,6 +783,1003 @@ class AggregateViewTest(TestCase):
         self.assertEqual(aggregate_data, cached_data)
         self.assertEqual(response.context['total_submissions'], 100)
 
+    async def test_async_aggregate_view(self):
+        """Test the ASGI variant renders once, then serves the cached page"""
+        from django.test import AsyncRequestFactory
+        from .views import aaggregate_view
+        
+        await CategoryAggregate.objects.acreate(
+            category=self.healthcare, total_percentage=Decimal('300'), submission_count=10
+        )
+        factory = AsyncRequestFactory()
+        await aaggregate_view(factory.get(reverse('aggregate')))  # Populates the snapshot and version
+        first = await aaggregate_view(factory.get(reverse('aggregate')))
+        self.assertEqual(first.status_code, 200)
+        self.assertContains(first, 'Healthcare')
+        
+        second = await aaggregate_view(factory.get(reverse('aggregate')))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        
+        not_modified = await aaggregate_view(factory.get(reverse('aggregate'), headers={'If-None-Match': first['ETag']}))
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_cached_page_expires_with_tier3_data(self):
+        """Test a page rendered from live data is not served once that data expires"""
+        import time
+        from unittest import mock
+        from . import aggregates
+        from .services import record_submission
+        
+        record_submission({self.healthcare.id: 4000, self.education.id: 6000})
+        for _ in range(3):
+            response = self.client.get(reverse('aggregate'))
+        self.assertContains(response, '40.0%')
+        
+        record_submission({self.healthcare.id: 10000, self.education.id: 0})
+        self.assertContains(self.client.get(reverse('aggregate')), '40.0%')
+        
+        aggregates.clear_local_cache()  # As after AGGREGATE_L1_MAX_STALENESS
+        later = time.time() + 301
+        with mock.patch('time.time', return_value=later):
+            self.assertContains(self.client.get(reverse('aggregate')), '70.0%')
+
+    def test_cached_page_dropped_when_queueing_fails(self):
+        """Test the broker-down fallback invalidates the cached page, not just the data"""
+        from unittest import mock
+        from .services import record_submission
+        
+        with mock.patch('allocator.tasks.queue_aggregate_update', side_effect=RuntimeError('broker down')):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_submission({self.healthcare.id: 4000, self.education.id: 6000})
+            for _ in range(3):
+                response = self.client.get(reverse('aggregate'))
+            self.assertContains(response, '40.0%')
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                record_submission({self.healthcare.id: 10000, self.education.id: 0})
+            response = self.client.get(reverse('aggregate'))
+        
+        self.assertContains(response, '70.0%')
+        self.assertContains(response, '<strong>2</strong> submissions')
+
+
+class AggregateStampedeTest(TestCase):
+    """Test single-flight recomputation for aggregate_view"""
+
+    def setUp(self):
+        cache.clear()
+        self.payload = [{'category': 'Healthcare', 'avg_percentage': 100.0, 'color': '#ff0000'}]
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_cold_cache_recomputes_once(self):
+        """Test concurrent misses trigger exactly one recomputation"""
+        import threading
+        import time
+        from unittest import mock
+        from . import aggregates
+        
+        calls = []
+        
+        def slow_live_data():
+            calls.append(1)
+            time.sleep(0.2)
+            return self.payload
+        
+        cache.set('aggregate_total_submissions', 1)
+        results = []
+        with mock.patch.object(aggregates, 'build_summary_data', return_value=None), \
+                mock.patch.object(aggregates, 'build_live_data', side_effect=slow_live_data):
+            threads = [
+                threading.Thread(target=lambda: results.append(aggregates.get_aggregate_snapshot()))
+                for _ in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [(self.payload, 1)] * 20)
+
+    def test_stale_value_served_while_locked(self):
+        """Test requests get the last known value while another recomputes"""
+        from . import aggregates
+        
+        aggregates.store_aggregate_data(self.payload, 7)
+        cache.delete('aggregate_allocations_v2')
+        cache.add('aggregate_recompute_lock', True)
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('aggregate'))
+        self.assertEqual(response.context['aggregate_data'], self.payload)
+        self.assertEqual(response.context['total_submissions'], 7)
+
+    def test_tier3_entry_expires_early(self):
+        """Test a Tier 3 entry past its expiry is recomputed before the cache drops it"""
+        import time
+        from . import aggregates
+        
+        BudgetCategory.objects.create(name="Education")
+        aggregates.store_aggregate_data(self.payload, 0, timeout=300)
+        cache.set('aggregate_allocations_meta', {'expires_at': time.time() - 1, 'compute_time': 0.1})
+        
+        aggregate_data, _ = aggregates.get_aggregate_snapshot()
+        self.assertEqual(aggregate_data[0]['category'], 'Education')
+
+    @override_settings(AGGREGATE_LOCK_WAIT=0.1)
+    def test_cold_cache_never_recomputes_unlocked(self):
+        """Test waiters give up with a 503 instead of hitting the database themselves"""
+        from unittest import mock
+        from . import aggregates
+        
+        aggregates.clear_local_cache()  # No page left in this process's L1 by earlier tests
+        cache.add('aggregate_recompute_lock', True)
+        with mock.patch.object(aggregates, '_recompute') as recompute:
+            with self.assertRaises(aggregates.AggregateUnavailable):
+                aggregates.get_aggregate_snapshot()
+            response = self.client.get(reverse('aggregate'))
+            api_response = self.client.get(reverse('aggregate_api'))
+        
+        recompute.assert_not_called()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(api_response.status_code, 503)
+
+    @override_settings(AGGREGATE_LOCK_WAIT=0.1)
+    def test_expired_lock_is_taken_over(self):
+        """Test a waiter whose lock holder vanished recomputes under the lock"""
+        import time
+        from unittest import mock
+        from . import aggregates
+        
+        cache.add('aggregate_recompute_lock', True)
+        cache.set('aggregate_total_submissions', 1)
+        real_sleep = time.sleep
+        
+        def holder_gone(seconds):
+            cache.delete('aggregate_recompute_lock')
+            real_sleep(seconds)
+        
+        with mock.patch.object(aggregates, 'build_summary_data', return_value=self.payload), \
+                mock.patch('time.sleep', side_effect=holder_gone):
+            self.assertEqual(aggregates.get_aggregate_snapshot(), (self.payload, 1))
+        self.assertIsNone(cache.get('aggregate_recompute_lock'))
+
+
+@override_settings(AGGREGATE_INGEST_MODE='batch', AGGREGATE_BATCH_SIZE=1000)
+class AggregateBatchingTest(TestCase):
+    """Test micro-batched aggregate ingestion"""
+
+    def setUp(self):
+        from . import buffer
+        cache.clear()
+        buffer.drain(10000)  # Start with an empty buffer
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_submissions_are_buffered_then_flushed_once(self):
+        """Test submissions accumulate and are folded into one bulk update"""
+        from . import buffer
+        from .tasks import queue_aggregate_update, flush_submission_buffer
+        
+        for healthcare_pct in (20, 40, 60):
+            queue_aggregate_update([
+                {'category_id': self.healthcare.id, 'percentage': healthcare_pct},
+                {'category_id': self.education.id, 'percentage': 100 - healthcare_pct},
+            ])
+        
+        self.assertEqual(buffer.length(), 3)
+        self.assertFalse(CategoryAggregate.objects.exists())
+        
+        result = flush_submission_buffer()
+        self.assertEqual(result['batches'], 1)
+        self.assertEqual(result['submissions'], 3)
+        self.assertEqual(buffer.length(), 0)
+        
+        healthcare = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(healthcare.total_percentage, Decimal('120'))
+        self.assertEqual(healthcare.submission_count, 3)
+        self.assertEqual(cache.get('aggregate_allocations_v2')[0]['avg_percentage'], 40.0)
+
+    def test_redis_errors_are_not_swallowed(self):
+        """Test only a non-Redis cache falls back to the in-process buffer"""
+        import redis
+        from . import buffer
+        
+        self.assertIsNone(buffer.get_redis())
+        unreachable = {'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': 'redis://127.0.0.1:1/0',
+            'OPTIONS': {'SOCKET_CONNECT_TIMEOUT': 0.5},
+        }}
+        with self.settings(CACHES=unreachable):
+            self.assertIsNotNone(buffer.get_redis())
+            with self.assertRaises(redis.exceptions.ConnectionError):
+                buffer.push([])
+
+    def test_check_requires_redis_cache(self):
+        """Test batch mode and the redis backend are rejected on a local-memory cache"""
+        from .checks import check_redis_cache
+        
+        self.assertEqual([issue.id for issue in check_redis_cache(None)], ['allocator.E002'])
+        with self.settings(AGGREGATE_BACKEND='redis'):
+            self.assertEqual(len(check_redis_cache(None)), 2)
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1',
+        }}):
+            self.assertEqual(check_redis_cache(None), [])
+
+
+class CategoryAggregateBucketTest(TestCase):
+    """Test hourly/daily rollup buckets"""
+
+    def setUp(self):
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+
+    def test_ingestion_maintains_buckets(self):
+        """Test folded payloads land in the right hour and day buckets"""
+        from datetime import datetime, timezone as dt_timezone
+        from .tasks import fold_bucket_deltas
+        from .models import CategoryAggregateBucket
+        
+        ten_am = datetime(2026, 3, 1, 10, 15, tzinfo=dt_timezone.utc).timestamp()
+        eleven_am = datetime(2026, 3, 1, 11, 5, tzinfo=dt_timezone.utc).timestamp()
+        payloads = [
+            [{'category_id': self.healthcare.id, 'percentage': 20, 'submitted_at': ten_am}],
+            [{'category_id': self.healthcare.id, 'percentage': 40, 'submitted_at': eleven_am}],
+        ]
+        CategoryAggregateBucket.apply_deltas(fold_bucket_deltas(payloads[:1]))
+        CategoryAggregateBucket.apply_deltas(fold_bucket_deltas(payloads[1:]))
+        
+        hours = CategoryAggregateBucket.objects.filter(granularity='hour')
+        self.assertEqual([b.submission_count for b in hours], [1, 1])
+        day = CategoryAggregateBucket.objects.get(granularity='day')
+        self.assertEqual(day.bucket_start, datetime(2026, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(day.total_percentage, Decimal('60'))
+        self.assertEqual(day.sum_squares, Decimal('2000'))
+        
+        total, sum_squares, count = CategoryAggregateBucket.window_totals(
+            datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        )[self.healthcare.id]
+        mean, stddev = CategoryAggregateBucket.summarize(total, sum_squares, count)
+        self.assertEqual(mean, Decimal('30'))
+        self.assertEqual(stddev, Decimal('10'))
+
+    def test_backfill_command(self):
+        """Test backfill rebuilds buckets from row-stored and packed submissions"""
+        from datetime import datetime, timezone as dt_timezone
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import CategoryAggregateBucket
+        
+        moment = datetime(2026, 3, 1, 10, 30, tzinfo=dt_timezone.utc)
+        UserAllocation.objects.create(session_key='rows', category=self.healthcare,
+                                      percentage=Decimal('25'), created_at=moment)
+        AllocationSubmission.objects.create(session_key='packed', submitted_at=moment,
+                                            allocation_vector=pack_allocations({self.healthcare.id: 75}))
+        
+        call_command('backfill_aggregate_buckets', '--until', '2026-03-02', stdout=StringIO())
+        
+        for granularity in ('hour', 'day'):
+            bucket = CategoryAggregateBucket.objects.get(granularity=granularity, category=self.healthcare)
+            self.assertEqual(bucket.total_percentage, Decimal('100'))
+            self.assertEqual(bucket.submission_count, 2)
+            self.assertEqual(bucket.sum_squares, Decimal('6250'))
+
+
+class HistogramTest(TestCase):
+    """Test per-category 0.25% histograms"""
+
+    def setUp(self):
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+
+    def test_binning_and_percentiles(self):
+        """Test values land in 0.25% bins and percentiles read back in O(bins)"""
+        from . import histograms
+        
+        self.assertEqual(histograms.BINS, 401)
+        self.assertEqual(histograms.bin_index('12.25'), 49)
+        self.assertEqual(histograms.bin_index(100), 400)
+        
+        counts = histograms.empty()
+        for value in ('10', '20', '30', '40', '50.25'):
+            counts[histograms.bin_index(value)] += 1
+        self.assertEqual(histograms.percentile(counts, 50), Decimal('30'))
+        self.assertEqual(histograms.percentile(counts, 100), Decimal('50.25'))
+        self.assertIsNone(histograms.percentile(histograms.empty(), 50))
+        
+        merged = histograms.from_bins([(index, 2 * count) for index, count in enumerate(counts)])
+        self.assertEqual(int(merged.sum()), 10)
+
+    def test_ingestion_updates_histograms(self):
+        """Test the aggregate tasks maintain all-time and bucket histograms"""
+        from . import histograms
+        from .models import CategoryAggregateBucket
+        from .tasks import apply_payloads
+        
+        apply_payloads([
+            [{'category_id': self.healthcare.id, 'percentage': pct}] for pct in (10, 20, 90)
+        ])
+        
+        aggregate = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(aggregate.submission_count, 3)
+        self.assertEqual(aggregate.percentile(50), Decimal('20'))
+        day = CategoryAggregateBucket.objects.get(granularity='day', category=self.healthcare)
+        self.assertEqual(sum(day.bins.values_list('count', flat=True)), 3)
+        window = CategoryAggregateBucket.window_histograms(day.bucket_start)
+        self.assertEqual(histograms.percentile(window[self.healthcare.id], 100), Decimal('90'))
+
+    def test_histograms_incremented_in_place(self):
+        """Test bins are rows added to with set-based UPDATEs, never rewritten"""
+        from . import histograms
+        from .models import CategoryAggregateBin
+        
+        CategoryAggregate.objects.create(category=self.healthcare)
+        deltas = histograms.empty()
+        deltas[histograms.bin_index(10)] = 2
+        deltas[histograms.bin_index(20)] = 1
+        CategoryAggregate.apply_histograms({self.healthcare.id: deltas})
+        
+        # Existing bins: no SELECT ... FOR UPDATE, one UPDATE per distinct increment
+        with self.assertNumQueries(4):
+            CategoryAggregate.apply_histograms({self.healthcare.id: deltas})
+        self.assertEqual(
+            dict(CategoryAggregateBin.objects.values_list('bin', 'count')),
+            {histograms.bin_index(10): 4, histograms.bin_index(20): 2},
+        )
+        self.assertEqual(CategoryAggregate.histograms()[self.healthcare.id].sum(), 6)
+
+
+
+class VectorizedRebuildTest(TestCase):
+    """Test the streamed NumPy rebuild engine"""
+
+    def setUp(self):
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+        for i, pct in enumerate(('12.5', '12.5', '60')):
+            UserAllocation.objects.create(session_key=f'rows-{i}', category=self.healthcare,
+                                          percentage=Decimal(pct))
+        AllocationSubmission.objects.create(
+            session_key='packed',
+            allocation_vector=pack_allocations({self.healthcare.id: 75, self.education.id: 25})
+        )
+
+    def test_single_pass_summaries(self):
+        """Test chunked bincount results cover row-stored and packed submissions"""
+        from . import histograms
+        from .rebuild import compute_summaries
+        
+        summary = compute_summaries(chunk_size=2)[self.healthcare.id]
+        self.assertEqual(summary.total, Decimal('160'))
+        self.assertEqual(summary.count, 4)
+        self.assertEqual(summary.sum_squares, Decimal('9537.5'))
+        self.assertEqual(summary.histogram[histograms.bin_index('12.5')], 2)
+        self.assertEqual(int(summary.histogram.sum()), 4)
+
+    def test_percentages_round_to_exact_basis_points(self):
+        """Test values that are not exact in binary (0.29, 1.13) are not truncated"""
+        from .rebuild import compute_summaries
+        
+        for i, pct in enumerate(('0.29', '0.57', '1.13')):
+            UserAllocation.objects.create(session_key=f'inexact-{i}', category=self.education,
+                                          percentage=Decimal(pct))
+        
+        summary = compute_summaries()[self.education.id]
+        live_total, _ = CategoryAggregate.compute_live_totals()[self.education.id]
+        self.assertEqual(summary.total, Decimal('26.99'))
+        self.assertEqual(summary.total, live_total)
+
+    def test_swap_updates_in_place(self):
+        """Test the swap updates existing rows, adds missing ones and zeroes empty ones"""
+        from .rebuild import rebuild_aggregates
+        
+        unused = BudgetCategory.objects.create(name="Unused", display_order=3)
+        CategoryAggregate.objects.create(category=self.healthcare, total_percentage=1, submission_count=1)
+        CategoryAggregate.objects.create(category=unused, total_percentage=1, submission_count=1)
+        
+        rebuild_aggregates(chunk_size=2)
+        
+        healthcare = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(healthcare.total_percentage, Decimal('160'))
+        self.assertEqual(healthcare.submission_count, 4)
+        self.assertEqual(healthcare.percentile(50), Decimal('12.5'))
+        self.assertEqual(CategoryAggregate.objects.get(category=self.education).submission_count, 1)
+        self.assertEqual(CategoryAggregate.objects.get(category=unused).submission_count, 0)
+
+
+class OnlineRebuildTest(TestCase):
+    """Test the snapshot-plus-delta rebuild and the watermark it leaves behind"""
+
+    def setUp(self):
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+        self.allocations = {self.healthcare.id: 4000, self.education.id: 6000}
+
+    @override_settings(AGGREGATE_INGEST_MODE='batch')
+    def test_submissions_during_scan_are_replayed(self):
+        """Test a submission committed mid-scan is added as a delta and its update skipped"""
+        from unittest import mock
+        from .models import AggregateWatermark
+        from .services import record_submission
+        from . import rebuild
+        from .tasks import apply_payloads
+        
+        record_submission(self.allocations)
+        late = []
+        scan = rebuild.compute_summaries
+        
+        def scan_while_submitting(*args, **kwargs):
+            if not late:
+                late.append(record_submission(self.allocations))
+            return scan(*args, **kwargs)
+        
+        with mock.patch.object(rebuild, 'compute_summaries', side_effect=scan_while_submitting):
+            rebuild.rebuild_aggregates(chunk_size=2)
+        
+        aggregate = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(aggregate.submission_count, 2)
+        self.assertEqual(AggregateWatermark.objects.get().submission_id, late[0].id)
+        
+        # The queued incremental update for the late submission arrives afterwards
+        apply_payloads([[
+            {'category_id': self.healthcare.id, 'percentage': 40, 'submission_id': late[0].id}
+        ]])
+        aggregate.refresh_from_db()
+        self.assertEqual(aggregate.submission_count, 2)
+        self.assertEqual(int(aggregate.total_percentage), 80)
+
+    @override_settings(AGGREGATE_INGEST_MODE='batch')
+    def test_catch_up_runs_unlocked(self):
+        """Test large deltas are scanned before locking; the locked pass stays within a chunk"""
+        from unittest import mock
+        from .models import AggregateWatermark
+        from .services import record_submission
+        from . import rebuild
+        
+        record_submission(self.allocations)
+        scans = []
+        locked = []
+        scan = rebuild.compute_summaries
+        lock = AggregateWatermark.lock
+        
+        def scan_while_submitting(chunk_size, after=None, through=None):
+            if after is None:
+                for i in range(3):
+                    record_submission(self.allocations)
+            scans.append((bool(locked), after and rebuild.delta_size(after, through)))
+            return scan(chunk_size, after, through)
+        
+        def record_lock():
+            locked.append(True)
+            return lock()
+        
+        with mock.patch.object(rebuild, 'compute_summaries', side_effect=scan_while_submitting), \
+                mock.patch.object(AggregateWatermark, 'lock', side_effect=record_lock):
+            rebuild.rebuild_aggregates(chunk_size=2)
+        
+        # Snapshot and the 9-row catch-up unlocked, then an empty locked final pass
+        self.assertEqual(scans, [(False, None), (False, 9), (True, 0)])
+        self.assertEqual(CategoryAggregate.objects.get(category=self.healthcare).submission_count, 4)
+
+    def test_updates_above_watermark_apply(self):
+        """Test only all-time sums skip counted submissions; buckets get every update"""
+        from .models import AggregateWatermark, CategoryAggregateBucket
+        from .tasks import apply_payloads
+        
+        AggregateWatermark.objects.update(submission_id=10)
+        apply_payloads([
+            [{'category_id': self.healthcare.id, 'percentage': pct, 'submission_id': submission_id}]
+            for pct, submission_id in ((10, 9), (20, 11))
+        ] + [[{'category_id': self.healthcare.id, 'percentage': 30}]])
+        
+        aggregate = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(aggregate.submission_count, 2)
+        self.assertEqual(aggregate.total_percentage, Decimal('50'))
+        self.assertEqual(aggregate.percentile(0), Decimal('20'))
+        day = CategoryAggregateBucket.objects.get(granularity='day', category=self.healthcare)
+        self.assertEqual(day.submission_count, 3)
+
+
+class IdempotentApplicationTest(TestCase):
+    """Test exactly-once aggregate application keyed by submission id"""
+
+    def setUp(self):
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+
+    def payload(self, submission, percentage=25):
+        return [{'category_id': self.healthcare.id, 'percentage': percentage,
+                 'submission_id': submission.id}]
+
+    def test_redelivery_is_noop(self):
+        """Test a retried task and a duplicate within a batch are applied once"""
+        from unittest import mock
+        from .models import CategoryAggregateBucket
+        from .tasks import apply_payloads, refresh_redis_cache, update_category_aggregates
+        
+        submission = AllocationSubmission.objects.create(session_key='once')
+        with mock.patch.object(refresh_redis_cache, 'apply_async'):
+            self.assertEqual(update_category_aggregates(self.payload(submission))['status'], 'success')
+            self.assertEqual(update_category_aggregates(self.payload(submission))['status'], 'skipped')
+        other = AllocationSubmission.objects.create(session_key='twice')
+        self.assertEqual(apply_payloads([self.payload(other), self.payload(other)]), 1)
+        
+        aggregate = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(aggregate.submission_count, 2)
+        self.assertEqual(aggregate.total_percentage, Decimal('50'))
+        day = CategoryAggregateBucket.objects.get(granularity='day', category=self.healthcare)
+        self.assertEqual(day.submission_count, 2)
+
+    def test_claims_take_no_global_lock(self):
+        """Test claims are unique inserts: the watermark is never locked"""
+        from unittest import mock
+        from .models import AggregateWatermark, AppliedSubmission
+        from .tasks import apply_payloads
+        
+        first, second = [AllocationSubmission.objects.create(session_key=f'sub-{i}') for i in range(2)]
+        with mock.patch.object(AggregateWatermark, 'lock', side_effect=AssertionError('locked')):
+            self.assertEqual(AppliedSubmission.claim({first.id}), {first.id})
+            self.assertEqual(AppliedSubmission.claim({first.id, second.id}), {second.id})
+            self.assertEqual(apply_payloads([self.payload(first), self.payload(second)]), 0)
+        
+        # A row compaction just deleted is still covered by the mark
+        AggregateWatermark.objects.update(applied_through=second.id)
+        AppliedSubmission.objects.all().delete()
+        self.assertEqual(AppliedSubmission.claim({first.id}), set())
+
+    @override_settings(AGGREGATE_LEDGER_RETENTION=3600)
+    def test_compact_by_age(self):
+        """Test compaction folds old claims into the mark even past an unapplied submission"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import AggregateWatermark, AppliedSubmission
+        from .tasks import apply_payloads
+        
+        first, lost, last, recent = [
+            AllocationSubmission.objects.create(session_key=f'sub-{i}') for i in range(4)
+        ]
+        apply_payloads([self.payload(first), self.payload(last)])
+        AppliedSubmission.objects.update(applied_at=timezone.now() - timedelta(hours=2))
+        apply_payloads([self.payload(recent)])
+        
+        self.assertEqual(AppliedSubmission.compact(), last.id)
+        self.assertEqual(list(AppliedSubmission.objects.values_list('submission_id', flat=True)), [recent.id])
+        
+        # Below the mark, a late redelivery is still recognised
+        self.assertEqual(apply_payloads([self.payload(first)]), 0)
+        self.assertEqual(apply_payloads([self.payload(recent)]), 0)
+        self.assertEqual(AggregateWatermark.objects.get().applied_through, last.id)
+        self.assertEqual(CategoryAggregate.objects.get(category=self.healthcare).submission_count, 3)
+
+    @override_settings(AGGREGATE_LEDGER_RETENTION=3600)
+    def test_compact_waits_for_pending_outbox_events(self):
+        """Test the cutoff never passes the oldest event the relay has not applied"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import AggregateOutboxEvent, AppliedSubmission
+        from .tasks import apply_payloads
+        
+        old = AllocationSubmission.objects.create(session_key='old')
+        apply_payloads([self.payload(old)])
+        AppliedSubmission.objects.update(applied_at=timezone.now() - timedelta(hours=3))
+        event = AggregateOutboxEvent.objects.create(payload=self.payload(old))
+        AggregateOutboxEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - timedelta(hours=4))
+        
+        self.assertEqual(AppliedSubmission.compact(), 0)
+        self.assertTrue(AppliedSubmission.objects.exists())
+
+
+@override_settings(AGGREGATE_INGEST_MODE='outbox')
+class AggregateOutboxTest(TestCase):
+    """Test the transactional outbox and its relay"""
+
+    def setUp(self):
+        cache.clear()
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+        self.allocations = {self.healthcare.id: 3000, self.education.id: 7000}
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_submission_writes_outbox_without_broker(self):
+        """Test the event commits with the submission and nothing is queued"""
+        from unittest import mock
+        from .models import AggregateOutboxEvent
+        from .services import record_submission
+        from .tasks import update_category_aggregates, flush_submission_buffer
+        
+        with mock.patch.object(update_category_aggregates, 'delay') as delay, \
+                mock.patch.object(flush_submission_buffer, 'delay') as flush:
+            with self.captureOnCommitCallbacks(execute=True):
+                submission = record_submission(self.allocations)
+        
+        delay.assert_not_called()
+        flush.assert_not_called()
+        event = AggregateOutboxEvent.objects.get()
+        self.assertEqual({alloc['submission_id'] for alloc in event.payload}, {submission.id})
+
+    def test_relay_applies_and_deletes_in_batches(self):
+        """Test the relay drains every event once"""
+        from .models import AggregateOutboxEvent
+        from .services import record_submission
+        from .tasks import relay_aggregate_outbox
+        
+        for _ in range(3):
+            record_submission(self.allocations)
+        
+        result = relay_aggregate_outbox(batch_size=2)
+        self.assertEqual((result['batches'], result['submissions']), (2, 3))
+        self.assertFalse(AggregateOutboxEvent.objects.exists())
+        healthcare = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(healthcare.total_percentage, Decimal('90'))
+        self.assertEqual(cache.get('aggregate_allocations_v2')[0]['avg_percentage'], 30.0)
+        self.assertEqual(relay_aggregate_outbox()['batches'], 0)
+
+    def test_failed_batch_stays_in_outbox(self):
+        """Test events survive a failure while applying them"""
+        from unittest import mock
+        from .models import AggregateOutboxEvent
+        from .services import record_submission
+        from . import tasks
+        
+        record_submission(self.allocations)
+        with mock.patch.object(tasks, 'apply_payloads', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                tasks.relay_aggregate_outbox()
+        
+        self.assertEqual(AggregateOutboxEvent.objects.count(), 1)
+        self.assertFalse(CategoryAggregate.objects.exists())
+
+    def test_check_warns_without_relay_schedule(self):
+        """Test outbox mode without relay_aggregate_outbox on the beat schedule is flagged"""
+        from .checks import check_ingest_mode
+        
+        self.assertEqual(check_ingest_mode(None), [])
+        with self.settings(CELERY_BEAT_SCHEDULE={}):
+            self.assertEqual([issue.id for issue in check_ingest_mode(None)], ['allocator.W001'])
+        with self.settings(AGGREGATE_INGEST_MODE='bogus'):
+            self.assertEqual([issue.id for issue in check_ingest_mode(None)], ['allocator.E001'])
+
+    def test_check_warns_on_stale_outbox(self):
+        """Test events nobody relays are reported by the database check"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .checks import check_outbox_relay_running
+        from .models import AggregateOutboxEvent
+        from .services import record_submission
+        
+        record_submission(self.allocations)
+        self.assertEqual(check_outbox_relay_running(None, databases=['default']), [])
+        
+        AggregateOutboxEvent.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(check_outbox_relay_running(None), [])
+        self.assertEqual(
+            [issue.id for issue in check_outbox_relay_running(None, databases=['default'])],
+            ['allocator.W002']
+        )
+
+
+@override_settings(AGGREGATE_BACKEND='redis', AGGREGATE_INGEST_MODE='outbox')
+class RedisAccumulatorTest(TestCase):
+    """Test the HINCRBY accumulator (in-process stand-in for the Redis hash)"""
+
+    def setUp(self):
+        from . import accumulator
+        cache.clear()
+        accumulator.reset()
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        self.education = BudgetCategory.objects.create(name="Education", display_order=2)
+        self.allocations = {self.healthcare.id: 3333, self.education.id: 6667}
+
+    def tearDown(self):
+        from . import accumulator
+        cache.clear()
+        accumulator.reset()
+
+    def test_submission_applied_on_commit_and_read_from_hash(self):
+        """Test sums are exact integers and Tier 2 reads them without the table"""
+        from . import accumulator
+        from .aggregates import build_summary_data
+        from .services import record_submission
+        
+        CategoryAggregate.objects.create(category=self.healthcare, total_percentage=Decimal('10'),
+                                         submission_count=1, sum_squares=Decimal('100'))
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_submission(self.allocations)
+        
+        self.assertIsNone(accumulator.totals())  # Not seeded yet
+        data = build_summary_data()
+        self.assertEqual(accumulator.totals()[self.healthcare.id],
+                         (Decimal('109.99'), 4, Decimal('100') + 3 * Decimal('33.33') ** 2))
+        self.assertEqual(data[0]['avg_percentage'], 27.5)
+        
+        with self.assertNumQueries(0):
+            build_summary_data()
+
+    def test_checkpoint_writes_hash_and_pipeline_skips_sums(self):
+        """Test the relay leaves sums to the hash and the checkpoint persists them"""
+        from . import accumulator
+        from .services import record_submission
+        from .tasks import checkpoint_aggregate_accumulator, relay_aggregate_outbox
+        
+        accumulator.seed()
+        with self.captureOnCommitCallbacks(execute=True):
+            record_submission(self.allocations)
+        relay_aggregate_outbox()
+        
+        healthcare = CategoryAggregate.objects.get(category=self.healthcare)
+        self.assertEqual(healthcare.submission_count, 0)
+        self.assertEqual(healthcare.percentile(50), Decimal('33.25'))
+        
+        self.assertEqual(checkpoint_aggregate_accumulator()['categories_checkpointed'], 2)
+        healthcare.refresh_from_db()
+        self.assertEqual(healthcare.total_percentage, Decimal('33.33'))
+        self.assertEqual(healthcare.submission_count, 1)
+
+    def test_late_add_after_rebuild_is_not_counted_twice(self):
+        """Test an add landing after the rebuild's reset skips a submission the rebuild counted"""
+        from . import accumulator
+        from .rebuild import rebuild_aggregates
+        from .services import record_submission
+        
+        accumulator.seed()
+        with self.captureOnCommitCallbacks() as late_hooks:
+            record_submission(self.allocations)
+        rebuild_aggregates()
+        for hook in late_hooks:
+            hook()  # The first submission's add() arrives after the reset
+        with self.captureOnCommitCallbacks(execute=True):
+            record_submission(self.allocations)
+        
+        accumulator.seed()
+        self.assertEqual(accumulator.totals()[self.healthcare.id][:2], (Decimal('66.66'), 2))
+
+
+class CoalescedRefreshTest(TestCase):
+    """Test debounced refresh_redis_cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.healthcare = BudgetCategory.objects.create(name="Healthcare", display_order=1)
+        CategoryAggregate.objects.create(
+            category=self.healthcare,
+            total_percentage=Decimal('100'),
+            submission_count=2
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_many_requests_schedule_one_refresh(self):
+        """Test refresh requests within the window are coalesced"""
+        from unittest import mock
+        from .tasks import request_cache_refresh, refresh_redis_cache
+        
+        with mock.patch.object(refresh_redis_cache, 'apply_async') as apply_async:
+            for _ in range(50):
+                request_cache_refresh()
+        
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertTrue(cache.get('aggregate_cache_dirty'))
+
+    def test_coalesced_refresh_skips_when_clean(self):
+        """Test a coalesced refresh does nothing unless marked dirty"""
+        from .tasks import refresh_redis_cache
+        
+        result = refresh_redis_cache(coalesced=True)
+        self.assertEqual(result['status'], 'skipped')
+        self.assertIsNone(cache.get('aggregate_allocations_v2'))
+        
+        cache.set('aggregate_cache_dirty', True)
+        result = refresh_redis_cache(coalesced=True)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(cache.get('aggregate_allocations_v2')[0]['avg_percentage'], 50.0)
+        self.assertIsNone(cache.get('aggregate_cache_dirty'))
+
+    def test_total_submissions_maintained_incrementally(self):
+        """Test the total counter is seeded once and then incremented"""
+        from .aggregates import increment_total_submissions
+        
+        SubmissionCounter.increment()
+        increment_total_submissions(1)  # Seeds from the sharded counter
+        self.assertEqual(cache.get('aggregate_total_submissions'), 1)
+        
+        with self.assertNumQueries(0):
+            increment_total_submissions(3)
+        self.assertEqual(cache.get('aggregate_total_submissions'), 4)
+
+
+class AggregatePageCacheTest(TestCase):
+    """Test the full-page cache and conditional GET for aggregate_view"""
+
+    def setUp(self):
+        from . import aggregates
+        cache.clear()
+        aggregates.clear_local_cache()
+        self.payload = [{'category': 'Healthcare', 'avg_percentage': 100.0, 'color': '#ff0000'}]
+        aggregates.store_aggregate_data(self.payload, 3)
+        cache.set('aggregate_total_submissions', 3)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_rendered_page_is_reused(self):
+        """Test a repeat hit serves the cached bytes without rendering"""
+        first = self.client.get(reverse('aggregate'))
+        self.assertTemplateUsed(first, 'allocator/aggregate.html')
+        
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('aggregate'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('s-maxage=', second['Cache-Control'])
+        self.assertIsNone(second.context)  # No template rendering
+
+    def test_conditional_get_returns_304(self):
+        """Test If-None-Match with the current ETag short-circuits"""
+        etag = self.client.get(reverse('aggregate'))['ETag']
+        
+        response = self.client.get(reverse('aggregate'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_local_copy_skips_shared_cache(self):
+        """Test repeat hits within the staleness window make no cache round trips"""
+        from unittest import mock
+        
+        first = self.client.get(reverse('aggregate'))
+        with mock.patch.object(cache, 'get_many') as get_many, mock.patch.object(cache, 'get') as get:
+            second = self.client.get(reverse('aggregate'))
+        get_many.assert_not_called()
+        get.assert_not_called()
+        self.assertEqual(second.content, first.content)
+
+    @override_settings(AGGREGATE_L1_MAX_STALENESS=0)
+    def test_local_copy_revalidates_version(self):
+        """Test a version bumped by another process is noticed once the window passes"""
+        first = self.client.get(reverse('aggregate'))
+        cache.incr('aggregate_version')  # Another process stored new aggregates
+        
+        second = self.client.get(reverse('aggregate'))
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertIsNotNone(second.context)  # Re-rendered for the new version
+
+    def test_new_aggregate_version_invalidates_page(self):
+        """Test writing aggregates changes the ETag and content"""
+        from . import aggregates
+        
+        first = self.client.get(reverse('aggregate'))
+        aggregates.store_aggregate_data(
+            [{'category': 'Education', 'avg_percentage': 100.0, 'color': '#00ff00'}], 4
+        )
+        cache.set('aggregate_total_submissions', 4)
+        
+        second = self.client.get(reverse('aggregate'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertContains(second, 'Education')
+
+
+class AggregateApiTest(TestCase):
+    """Test the JSON aggregate endpoint"""
+
+    def setUp(self):
+        from . import aggregates
+        cache.clear()
+        aggregates.clear_local_cache()
+        self.payload = [{'category': 'Healthcare', 'avg_percentage': 100.0, 'color': '#ff0000'}]
+        aggregates.store_aggregate_data(self.payload, 3)
+        cache.set('aggregate_total_submissions', 3)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_returns_cached_json(self):
+        """Test the body carries the vector, total and version, serialized once"""
+        first = self.client.get(reverse('aggregate_api'))
+        self.assertEqual(first['Content-Type'], 'application/json')
+        data = first.json()
+        self.assertEqual(data['categories'], self.payload)
+        self.assertEqual(data['total_submissions'], 3)
+        self.assertEqual(first['ETag'], f'"aggregate-api-{data["version"]}"')
+        
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('aggregate_api'))
+        self.assertEqual(second.content, first.content)
+
+    def test_conditional_get_returns_304(self):
+        """Test If-None-Match with the current ETag short-circuits"""
+        etag = self.client.get(reverse('aggregate_api'))['ETag']
+        
+        response = self.client.get(reverse('aggregate_api'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_since_version(self):
+        """Test ?since_version= returns 204 until the aggregates change"""
+        from . import aggregates
+        
+        version = self.client.get(reverse('aggregate_api')).json()['version']
+        response = self.client.get(reverse('aggregate_api'), {'since_version': version})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.content, b'')
+        
+        aggregates.store_aggregate_data(self.payload, 4)
+        cache.set('aggregate_total_submissions', 4)
+        response = self.client.get(reverse('aggregate_api'), {'since_version': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_submissions'], 4)
+        self.assertNotEqual(response.json()['version'], version)
+
+
+class AggregateStreamTest(TestCase):
+    """Test the Server-Sent Events aggregate stream"""
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    async def test_stream_pushes_new_versions(self):
+        """Test the stream sends current data, then each published version"""
+        from . import aggregates, broadcast
+        
+        aggregates.store_aggregate_data(
+            [{'category': 'Healthcare', 'avg_percentage': 100.0, 'color': '#ff0000'}], 3
+        )
+        response = await self.async_client.get(reverse('aggregate_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content
+        
+        self.assertEqual(await anext(events), b'retry: 5000\n\n')
+        self.assertIn(b'"total_submissions":3', await anext(events))
+        self.assertEqual(broadcast.hub.subscriber_count, 1)
+        
+        aggregates.store_aggregate_data(
+            [{'category': 'Education', 'avg_percentage': 100.0, 'color': '#00ff00'}], 4
+        )
+        frame = await asyncio.wait_for(anext(events), timeout=1)
+        self.assertTrue(frame.startswith(b'id: '))
+        self.assertIn(b'event: aggregate', frame)
+        self.assertIn(b'"total_submissions":4', frame)
+        
+        # Client disconnect: the ASGI handler cancels the pending read
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(broadcast.hub.subscriber_count, 0)
+
+    def test_stream_not_implemented_under_wsgi(self):
+        """Test a WSGI request gets a 501 instead of a stream that never ends"""
+        from . import broadcast
+        
+        response = Client().get(reverse('aggregate_stream'))
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+        self.assertEqual(broadcast.hub.subscriber_count, 0)
+
+    async def test_slow_client_gets_latest_version_only(self):
+        """Test undelivered versions are replaced rather than queued"""
+        from .broadcast import Hub
+        
+        hub = Hub()
+        queue = hub.subscribe()
+        hub.publish_local(b'one')
+        hub.publish_local(b'two')
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(await queue.get(), b'two')
+
 
 class HistoryViewTest(TestCase):
     """Test history_view"""
@@ -431,6 +1805,77 @@ class HistoryViewTest(TestCase):
         self.assertTemplateUsed(response, 'allocator/history.html')
         self.assertEqual(len(response.context['submission_data']), 3)
 
+    def test_history_view_query_count_is_constant(self):
+        """Test history loads with a fixed number of queries (no N+1)"""
+        category = BudgetCategory.objects.create(name="Healthcare")
+        for i in range(25):
+            session_key = str(uuid.uuid4())
+            AllocationSubmission.objects.create(session_key=session_key, user_id=self.user_id)
+            UserAllocation.objects.create(session_key=session_key, category=category, percentage=100)
+        
+        self.client.cookies['tax_allocator_user_id'] = self.user_id
+        
+        # One query for submissions, one for all their allocations
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('history'))
+        self.assertEqual(len(response.context['submission_data']), 20)
+        self.assertEqual(len(response.context['submission_data'][0]['allocations']), 1)
+
+    def test_history_view_keyset_pagination(self):
+        """Test ?before= cursor pages through history without overlap"""
+        from django.utils import timezone
+        from datetime import timedelta
+        
+        now = timezone.now()
+        for i in range(7):
+            AllocationSubmission.objects.create(
+                session_key=f'session-{i}',
+                user_id=self.user_id,
+                submitted_at=now - timedelta(minutes=i)
+            )
+        self.client.cookies['tax_allocator_user_id'] = self.user_id
+        
+        seen = []
+        url = reverse('history')
+        with self.settings(HISTORY_PAGE_SIZE=3):
+            for expected in (3, 3, 1):
+                response = self.client.get(url)
+                page = [item['submission'].session_key for item in response.context['submission_data']]
+                self.assertEqual(len(page), expected)
+                seen.extend(page)
+                if response.context['next_cursor']:
+                    url = reverse('history') + '?before=' + response.context['next_cursor']
+        
+        self.assertEqual(seen, [f'session-{i}' for i in range(7)])
+        self.assertIsNone(response.context['next_cursor'])
+
+    async def test_async_history_view(self):
+        """Test the ASGI variant pages and prefetches through the async ORM"""
+        from asgiref.sync import sync_to_async
+        from unittest import mock
+        from django.test import AsyncRequestFactory
+        from . import registry
+        from .views import ahistory_view
+        
+        category = await BudgetCategory.objects.acreate(name="Healthcare")
+        await AllocationSubmission.objects.acreate(session_key='packed', user_id=self.user_id,
+                                                   allocation_vector=pack_allocations({category.id: 100}))
+        await AllocationSubmission.objects.acreate(session_key='rows', user_id=self.user_id)
+        await UserAllocation.objects.acreate(session_key='rows', category=category, percentage=100)
+        
+        request = AsyncRequestFactory().get(reverse('history'))
+        request.COOKIES['tax_allocator_user_id'] = self.user_id
+        with mock.patch.object(registry, 'get_category_map',
+                               side_effect=AssertionError('sync registry read on the event loop')):
+            response = await ahistory_view(request)
+        self.assertEqual(response.status_code, 200)
+        
+        self.client.cookies['tax_allocator_user_id'] = self.user_id
+        sync_response = await sync_to_async(self.client.get)(reverse('history'))
+        self.assertEqual(len(sync_response.context['submission_data']), 2)
+        self.assertEqual(response.content.decode().count('Healthcare'),
+                         sync_response.content.decode().count('Healthcare'))
+
     def test_history_view_without_cookie(self):
         """Test history view without user_id cookie redirects"""
         response = self.client.get(reverse('history'))
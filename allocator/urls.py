@@ -1,9 +1,19 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# The async read views only pay off under an ASGI server (ASYNC_VIEWS=True);
+# under WSGI each would run through async_to_sync, so the sync ones are routed
+if settings.ASYNC_VIEWS:
+    results_view, aggregate_view, history_view = views.aresults_view, views.aaggregate_view, views.ahistory_view
+else:
+    results_view, aggregate_view, history_view = views.results_view, views.aggregate_view, views.history_view
+
 urlpatterns = [
     path('', views.allocate_view, name='allocate'),
-    path('results/<str:session_key>/', views.results_view, name='results'),
-    path('aggregate/', views.aggregate_view, name='aggregate'),
-    path('history/', views.history_view, name='history'),
+    path('results/<str:session_key>/', results_view, name='results'),
+    path('aggregate/', aggregate_view, name='aggregate'),
+    path('history/', history_view, name='history'),
+    path('api/aggregate/', views.aggregate_api_view, name='aggregate_api'),
+    path('api/aggregate/stream/', views.aggregate_stream_view, name='aggregate_stream'),
 ]
@@ -1,14 +1,33 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
-from django.db.models import Avg
-from django.core.cache import cache
-from django.utils import timezone
+from django.contrib.messages.storage.cookie import CookieStorage
 from django_ratelimit.decorators import ratelimit
-from .models import BudgetCategory, UserAllocation, AllocationSubmission
+from .models import AllocationSubmission, decode_allocations
+from . import broadcast
+from .aggregates import (
+    API_KEY, AggregateUnavailable, get_aggregate_snapshot, get_cached_page, aget_cached_page, store_page, astore_page,
+    serialize_api_body,
+)
+from .registry import (
+    get_categories, get_version as get_category_version, aget_version as aget_category_version,
+    aget_category_map,
+)
 from .forms import TaxAllocationForm
+from .pagination import keyset_page, akeyset_page
+from .services import record_submission, get_results_vector, aget_results_vector
+from functools import wraps
+import asyncio
+import math
 import uuid
 import json
+import time
 
 
 def get_client_ip(request):
@@ -40,6 +59,14 @@ def get_or_create_user_id(request):
     return user_id
 
 
+def _has_messages(request):
+    """
+    Whether flash messages are pending. MESSAGE_STORAGE is CookieStorage, so
+    this is a cookie check: no storage (or session) read, safe in async views.
+    """
+    return CookieStorage.cookie_name in request.COOKIES
+
+
 @require_http_methods(["GET", "POST"])
 @ratelimit(key=ratelimit_key, rate='10/h', method='POST', block=False)
 def allocate_view(request):
@@ -48,7 +75,7 @@ def allocate_view(request):
     if request.method == 'POST' and getattr(request, 'limited', False):
         messages.error(request, 'Rate limit exceeded. You can submit up to 10 allocations per hour. Please try again later.')
         form = TaxAllocationForm(request.POST)
-        categories = BudgetCategory.objects.all().order_by('display_order', 'name')
+        categories = get_categories()
         return render(request, 'allocator/allocate.html', {
             'form': form,
             'categories': categories,
@@ -61,43 +88,12 @@ def allocate_view(request):
             # Get or create user_id from cookie
             user_id = get_or_create_user_id(request)
             
-            # Generate unique session key for this submission
-            session_key = str(uuid.uuid4())
-            ip_address = get_client_ip(request)
-            submission_time = timezone.now()
-            
-            # Save all allocations
-            allocations = form.get_allocations()
-            for category_id, percentage in allocations.items():
-                UserAllocation.objects.create(
-                    session_key=session_key,
-                    user_id=user_id,
-                    category_id=category_id,
-                    percentage=percentage,
-                    created_at=submission_time,
-                    ip_address=ip_address
-                )
-            
-            # Track submission
-            AllocationSubmission.objects.create(
-                session_key=session_key,
+            submission = record_submission(
+                form.get_basis_points(),
                 user_id=user_id,
-                submitted_at=submission_time,
-                ip_address=ip_address
+                ip_address=get_client_ip(request),
             )
-            
-            # Queue background task to update aggregates (scalable approach)
-            try:
-                from allocator.tasks import update_category_aggregates
-                allocations_data = [
-                    {'category_id': cat_id, 'percentage': float(pct)}
-                    for cat_id, pct in allocations.items()
-                ]
-                update_category_aggregates.delay(allocations_data)
-            except Exception as e:
-                # Fallback: invalidate old cache if Celery/Redis not available
-                cache.delete('aggregate_allocations')
-                cache.delete('aggregate_allocations_v2')
+            session_key = submission.session_key
             
             messages.success(request, 'Your allocation has been submitted successfully!')
             response = redirect('results', session_key=session_key)
@@ -116,15 +112,16 @@ def allocate_view(request):
     else:
         form = TaxAllocationForm()
     
-    categories = BudgetCategory.objects.all().order_by('display_order', 'name')
+    categories = get_categories()
     
     # Check if user has previous submissions
     user_id = request.COOKIES.get('tax_allocator_user_id')
     previous_submissions = None
     if user_id:
-        previous_submissions = AllocationSubmission.objects.filter(
-            user_id=user_id
-        ).order_by('-submitted_at')[:5]  # Last 5 submissions
+        previous_submissions, _ = keyset_page(
+            AllocationSubmission.objects.filter(user_id=user_id),
+            page_size=5  # Last 5 submissions
+        )
     
     return render(request, 'allocator/allocate.html', {
         'form': form,
@@ -134,14 +131,49 @@ def allocate_view(request):
 
 
 def results_view(request, session_key):
-    """Display user's submission results with pie chart"""
-    allocations = UserAllocation.objects.filter(
-        session_key=session_key
-    ).select_related('category').order_by('category__display_order', 'category__name')
+    """
+    Display user's submission results with pie chart
+    
+    A submission never changes, so the page is served from the cached packed
+    vector (warmed at submission time) with a strong ETag and an immutable
+    Cache-Control header.
+    """
+    # Content depends only on the submission and the category list
+    etag = f'"results-{session_key}-{get_category_version()}"'
+    has_messages = _has_messages(request)
+    if not has_messages:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
     
-    if not allocations.exists():
+    vector = get_results_vector(session_key)
+    return _results_response(request, session_key, vector, etag, has_messages)
+
+
+async def aresults_view(request, session_key):
+    """Async results_view for the ASGI profile: cache and database reads are awaited"""
+    etag = f'"results-{session_key}-{await aget_category_version()}"'
+    has_messages = _has_messages(request)
+    if not has_messages:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+    
+    vector = await aget_results_vector(session_key)
+    # Fetched after the slow part, and passed on so decoding needs no registry check
+    categories = await aget_category_map()
+    return _results_response(request, session_key, vector, etag, has_messages, categories)
+
+
+def _results_response(request, session_key, vector, etag, has_messages, categories=None):
+    """
+    Render the results page for a packed vector (no I/O when given the
+    category map, so safe in async views)
+    """
+    if vector is None:
         messages.error(request, 'Allocation not found.')
         return redirect('allocate')
+    allocations = decode_allocations(session_key, vector, categories)
     
     # Prepare data for Chart.js
     chart_data = {
@@ -150,61 +182,117 @@ def results_view(request, session_key):
         'colors': [alloc.category.color for alloc in allocations],
     }
     
-    return render(request, 'allocator/results.html', {
+    response = render(request, 'allocator/results.html', {
         'allocations': allocations,
         'chart_data': json.dumps(chart_data),
         'session_key': session_key,
     })
+    
+    if has_messages:
+        # The flash message after a POST makes this response user-specific
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.RESULTS_CACHE_TIMEOUT, immutable=True)
+    return response
+
 
+def _aggregate_unavailable():
+    """503 while a cold aggregate is still being computed by another request"""
+    response = HttpResponse(
+        'Aggregate results are being computed, please retry shortly.',
+        status=503, content_type='text/plain',
+    )
+    response['Retry-After'] = str(math.ceil(settings.AGGREGATE_LOCK_WAIT) or 1)
+    patch_cache_control(response, no_store=True)
+    return response
 
+
+def retry_while_computing(view):
+    """Answer AggregateUnavailable from get_aggregate_snapshot() with a 503 (sync or async views)"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            try:
+                return await view(request, *args, **kwargs)
+            except AggregateUnavailable:
+                return _aggregate_unavailable()
+        return async_wrapper
+    
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except AggregateUnavailable:
+            return _aggregate_unavailable()
+    return wrapper
+
+
+@retry_while_computing
 def aggregate_view(request):
-    """Display aggregate statistics - optimized for millions of users"""
-    from allocator.models import CategoryAggregate
+    """
+    Display aggregate statistics - optimized for millions of users
     
-    # TIER 1: Try Redis cache (fastest - instant for millions of users)
-    cache_key = 'aggregate_allocations_v2'
-    aggregate_data = cache.get(cache_key)
-    total_submissions = cache.get('aggregate_total_submissions')
+    The rendered page is cached per aggregate version, so a hit costs one
+    cache round trip. ETag/Last-Modified let browsers revalidate with a 304,
+    and s-maxage lets nginx micro-cache the page.
+    """
+    if _has_messages(request):
+        # Flash messages make the page user-specific: never share it
+        response = _render_aggregate(request, *get_aggregate_snapshot())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
-    if aggregate_data is None:
-        # TIER 2: Try summary table (fast - pre-calculated)
-        aggregates = CategoryAggregate.objects.select_related('category').all()
-        
-        if aggregates.exists():
-            aggregate_data = []
-            for agg in aggregates:
-                aggregate_data.append({
-                    'category': agg.category.name,
-                    'avg_percentage': float(agg.avg_percentage),
-                    'color': agg.category.color,
-                })
-            
-            # Store in Redis for next time
-            cache.set(cache_key, aggregate_data, timeout=None)
-        else:
-            # TIER 3: Fallback to live calculation (slower - for initial setup)
-            categories = BudgetCategory.objects.all().order_by('display_order', 'name')
-            aggregate_data = []
-            
-            for category in categories:
-                avg_percentage = UserAllocation.objects.filter(
-                    category=category
-                ).aggregate(avg=Avg('percentage'))['avg'] or 0
-                
-                aggregate_data.append({
-                    'category': category.name,
-                    'avg_percentage': round(float(avg_percentage), 2),
-                    'color': category.color,
-                })
-            
-            # Cache for 5 minutes (old behavior)
-            cache.set(cache_key, aggregate_data, 300)
+    version, page = get_cached_page()
+    if page is None:
+        response = _render_aggregate(request, *get_aggregate_snapshot())
+        if version is None:
+            return response
+        last_modified = time.time()
+        store_page(version, response.content, response['Content-Type'], last_modified)
+        return _aggregate_response(request, version, last_modified, response=response)
+    return _aggregate_response(request, version, page['last_modified'], page=page)
+
+
+@retry_while_computing
+async def aaggregate_view(request):
+    """Async aggregate_view for the ASGI profile: a page hit is one awaited cache read"""
+    if _has_messages(request):
+        response = _render_aggregate(request, *await sync_to_async(get_aggregate_snapshot)())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
-    # Get total submissions
-    if total_submissions is None:
-        total_submissions = AllocationSubmission.objects.count()
-        cache.set('aggregate_total_submissions', total_submissions, timeout=None)
+    version, page = await aget_cached_page()
+    if page is None:
+        # Rare miss: the tiered snapshot (stampede lock, recompute) stays sync
+        response = _render_aggregate(request, *await sync_to_async(get_aggregate_snapshot)())
+        if version is None:
+            return response
+        last_modified = time.time()
+        await astore_page(version, response.content, response['Content-Type'], last_modified)
+        return _aggregate_response(request, version, last_modified, response=response)
+    return _aggregate_response(request, version, page['last_modified'], page=page)
+
+
+def _aggregate_response(request, version, last_modified, response=None, page=None):
+    """Add validators and shared-cache headers (304 when the client is current)"""
+    etag = f'"aggregate-{version}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        response = not_modified
+    elif response is None:
+        response = HttpResponse(page['content'], content_type=page['content_type'])
     
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    s_maxage = settings.AGGREGATE_PAGE_S_MAXAGE
+    patch_cache_control(response, public=True, max_age=0, s_maxage=s_maxage)
+    response['X-Accel-Expires'] = str(s_maxage)  # nginx micro-cache (stripped before the client)
+    return response
+
+
+def _render_aggregate(request, aggregate_data, total_submissions):
+    """Render aggregate.html from a get_aggregate_snapshot() result"""
     # Prepare chart data
     chart_data = {
         'labels': [item['category'] for item in aggregate_data],
@@ -219,36 +307,143 @@ def aggregate_view(request):
     })
 
 
+@require_http_methods(["GET", "HEAD"])
+@retry_while_computing
+def aggregate_api_view(request):
+    """
+    JSON aggregate data for dashboards, embeds and pollers
+    
+    The body is serialized once per aggregate version and served as cached
+    bytes. Pollers can revalidate with If-None-Match, or pass
+    ?since_version=<version> to get an empty 204 while nothing has changed.
+    """
+    version, body = get_cached_page(key=API_KEY)
+    
+    since_version = request.GET.get('since_version')
+    if version is not None and since_version == str(version):
+        response = HttpResponse(status=204)
+    else:
+        if body is None:
+            aggregate_data, total_submissions = get_aggregate_snapshot()
+            if version is None:
+                # The snapshot just populated the cache and bumped the version
+                version, _ = get_cached_page(key=API_KEY)
+            content = serialize_api_body(version, aggregate_data, total_submissions)
+            last_modified = time.time()
+            if version is not None:
+                store_page(version, content, 'application/json', last_modified, key=API_KEY)
+        else:
+            content = body['content']
+            last_modified = body['last_modified']
+        
+        etag = f'"aggregate-api-{version}"'
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+        if response is None:
+            response = HttpResponse(content, content_type='application/json')
+        response['Last-Modified'] = http_date(last_modified)
+    
+    response['ETag'] = f'"aggregate-api-{version}"'
+    response['Access-Control-Allow-Origin'] = '*'
+    response['Access-Control-Expose-Headers'] = 'ETag'
+    s_maxage = settings.AGGREGATE_PAGE_S_MAXAGE
+    patch_cache_control(response, public=True, max_age=0, s_maxage=s_maxage)
+    response['X-Accel-Expires'] = str(s_maxage)  # nginx micro-cache (stripped before the client)
+    return response
+
+
+async def aggregate_stream_view(request):
+    """
+    Server-Sent Events stream of aggregate updates (requires an ASGI server)
+    
+    Sends the current aggregate data, then one event per new aggregate
+    version, plus a comment heartbeat to keep proxies from closing idle
+    connections. All clients in a process share one upstream subscription.
+    Under WSGI the open stream would pin a worker forever, so it answers 501.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            'The aggregate stream requires an ASGI server; poll /api/aggregate/ instead.',
+            status=501, content_type='text/plain',
+        )
+    
+    last_event_id = request.headers.get('Last-Event-ID')
+    heartbeat = settings.AGGREGATE_STREAM_HEARTBEAT
+    
+    async def events():
+        queue = broadcast.hub.subscribe()
+        try:
+            yield b'retry: 5000\n\n'
+            version, body = await aget_cached_page(key=API_KEY)
+            if body is not None and last_event_id != str(version):
+                yield broadcast.format_event(version, body['content'])
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+        finally:
+            broadcast.hub.unsubscribe(queue)
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    patch_cache_control(response, no_cache=True)
+    response['X-Accel-Buffering'] = 'no'  # nginx: deliver events immediately
+    return response
+
+
 def history_view(request):
-    """Display user's submission history"""
+    """Display user's submission history (one page query + one allocation query)"""
     user_id = request.COOKIES.get('tax_allocator_user_id')
     
     if not user_id:
         messages.info(request, 'No submission history found. Submit an allocation to start tracking your history.')
         return redirect('allocate')
     
-    # Get all submissions for this user
-    submissions = AllocationSubmission.objects.filter(
-        user_id=user_id
-    ).order_by('-submitted_at')
+    # One page of submissions for this user (keyset pagination, one query)
+    before = request.GET.get('before')
+    submissions, next_cursor = keyset_page(
+        AllocationSubmission.objects.filter(user_id=user_id),
+        before=before,
+        page_size=settings.HISTORY_PAGE_SIZE
+    )
+    
+    # Load every submission's allocations at once instead of one query each
+    AllocationSubmission.prefetch_allocations(submissions)
+    return _history_response(request, submissions, next_cursor, before)
+
+
+async def ahistory_view(request):
+    """Async history_view for the ASGI profile (async ORM for both queries)"""
+    user_id = request.COOKIES.get('tax_allocator_user_id')
     
-    if not submissions.exists():
+    if not user_id:
+        messages.info(request, 'No submission history found. Submit an allocation to start tracking your history.')
+        return redirect('allocate')
+    
+    before = request.GET.get('before')
+    submissions, next_cursor = await akeyset_page(
+        AllocationSubmission.objects.filter(user_id=user_id),
+        before=before,
+        page_size=settings.HISTORY_PAGE_SIZE
+    )
+    
+    await AllocationSubmission.aprefetch_allocations(submissions)
+    return _history_response(request, submissions, next_cursor, before)
+
+
+def _history_response(request, submissions, next_cursor, before):
+    """Render one loaded history page (no I/O, safe in async views)"""
+    if not submissions and not before:
         messages.info(request, 'No submission history found.')
         return redirect('allocate')
     
-    # Get allocations for each submission
-    submission_data = []
-    for submission in submissions:
-        allocations = UserAllocation.objects.filter(
-            session_key=submission.session_key
-        ).select_related('category').order_by('category__display_order')
-        
-        submission_data.append({
-            'submission': submission,
-            'allocations': allocations,
-        })
+    submission_data = [
+        {'submission': submission, 'allocations': submission.get_allocations()}
+        for submission in submissions
+    ]
     
     return render(request, 'allocator/history.html', {
         'submission_data': submission_data,
-        'total_submissions': submissions.count(),
+        'page_submissions': len(submissions),
+        'next_cursor': next_cursor,
+        'is_first_page': not before,
     })
@@ -90,7 +90,8 @@ if os.environ.get('DATABASE_URL'):
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600,
+            # Use 0 under ASGI: persistent connections are per thread there
+            conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', '600')),
             conn_health_checks=True,
         )
     }
@@ -145,6 +146,10 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Flash messages live in a signed cookie only, so rendering them never reads the
+# session (the async views render without sync_to_async)
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
 # Cache configuration
 # Use Redis in production, LocMemCache for development
 CACHES = {
@@ -157,10 +162,11 @@ CACHES = {
     }
 }
 
-# For production with Redis:
+# For production with Redis (required by AGGREGATE_INGEST_MODE='batch' and
+# AGGREGATE_BACKEND='redis'; see allocator.checks):
 # CACHES = {
 #     'default': {
-#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'BACKEND': 'django_redis.cache.RedisCache',
 #         'LOCATION': 'redis://127.0.0.1:6379/1',
 #         'OPTIONS': {
 #             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
@@ -198,3 +204,93 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+
+# Submission storage
+# 'rows': one UserAllocation row per category (legacy)
+# 'packed': the whole allocation vector is packed onto AllocationSubmission.allocation_vector
+#           (convert existing data with: python manage.py pack_submissions)
+SUBMISSION_STORAGE = os.environ.get('SUBMISSION_STORAGE', 'rows')
+
+# How often (seconds) each process checks the shared category registry version
+CATEGORY_REGISTRY_CHECK_INTERVAL = float(os.environ.get('CATEGORY_REGISTRY_CHECK_INTERVAL', '5.0'))
+
+# Submissions per page on the history page (keyset pagination)
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '20'))
+
+# Route the async read views (results, aggregate, history); only set this when
+# serving taxbudget.asgi (docker-compose.asgi.yml). WSGI deployments keep the sync views.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Results pages are immutable: Cache-Control max-age (seconds) sent to browsers and CDNs
+RESULTS_CACHE_TIMEOUT = int(os.environ.get('RESULTS_CACHE_TIMEOUT', str(365 * 24 * 60 * 60)))
+
+# Server-side lifetime (seconds) of each cached results vector; kept short so the
+# cache holds recently viewed submissions only (a miss rebuilds it from the database)
+RESULTS_VECTOR_CACHE_TIMEOUT = int(os.environ.get('RESULTS_VECTOR_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# Rows the durable submission counter is spread across (more = less lock contention)
+SUBMISSION_COUNTER_SHARDS = int(os.environ.get('SUBMISSION_COUNTER_SHARDS', '16'))
+
+# Aggregate ingestion mode
+# 'immediate': one Celery task per submission, queued after commit
+# 'outbox': each submission writes an outbox row in its own transaction (no broker I/O
+#           in the request); Celery beat relays the outbox into CategoryAggregate in
+#           batches of AGGREGATE_BATCH_SIZE every AGGREGATE_FLUSH_INTERVAL seconds.
+#           Opt-in: only use it where the celery-beat service runs (see allocator.checks)
+# 'batch': submissions are buffered in Redis and folded into CategoryAggregate
+#          in batches of AGGREGATE_BATCH_SIZE, at least every AGGREGATE_FLUSH_INTERVAL seconds
+AGGREGATE_INGEST_MODE = os.environ.get('AGGREGATE_INGEST_MODE', 'immediate')
+AGGREGATE_BATCH_SIZE = int(os.environ.get('AGGREGATE_BATCH_SIZE', '500'))
+AGGREGATE_FLUSH_INTERVAL = float(os.environ.get('AGGREGATE_FLUSH_INTERVAL', '2.0'))
+
+# Where the all-time per-category sums are accumulated
+# 'database': CategoryAggregate rows, updated by the ingest pipeline
+# 'redis': one Redis hash of integer basis points, incremented when each submission
+#          commits (allocator.accumulator) and checkpointed into CategoryAggregate
+#          every AGGREGATE_CHECKPOINT_INTERVAL seconds
+AGGREGATE_BACKEND = os.environ.get('AGGREGATE_BACKEND', 'database')
+AGGREGATE_CHECKPOINT_INTERVAL = float(os.environ.get('AGGREGATE_CHECKPOINT_INTERVAL', '30'))
+
+# Seconds between compactions of the applied-submissions ledger (exactly-once aggregate updates)
+AGGREGATE_LEDGER_COMPACT_INTERVAL = float(os.environ.get('AGGREGATE_LEDGER_COMPACT_INTERVAL', '60'))
+# Seconds a ledger row is kept; must exceed the longest redelivery delay (task retries, broker visibility timeout)
+AGGREGATE_LEDGER_RETENTION = int(os.environ.get('AGGREGATE_LEDGER_RETENTION', str(24 * 60 * 60)))
+
+# At most one aggregate cache refresh per window (seconds), however many submissions arrive
+AGGREGATE_REFRESH_WINDOW = float(os.environ.get('AGGREGATE_REFRESH_WINDOW', '1.0'))
+
+# aggregate_view stampede protection
+# XFetch beta (>1 favours earlier recomputation of the 5-minute Tier 3 entry)
+AGGREGATE_XFETCH_BETA = float(os.environ.get('AGGREGATE_XFETCH_BETA', '1.0'))
+# Max seconds a request waits for another request's recomputation on a cold cache,
+# then answers 503 with Retry-After (it never recomputes without the lock)
+AGGREGATE_LOCK_WAIT = float(os.environ.get('AGGREGATE_LOCK_WAIT', '5.0'))
+
+# Seconds shared caches (nginx micro-cache, CDNs) may serve the aggregate page
+AGGREGATE_PAGE_S_MAXAGE = int(os.environ.get('AGGREGATE_PAGE_S_MAXAGE', '5'))
+
+# Seconds a process may serve its in-memory copy of the aggregate page/API body
+# before re-checking the aggregate version in the shared cache (0 = every request)
+AGGREGATE_L1_MAX_STALENESS = float(os.environ.get('AGGREGATE_L1_MAX_STALENESS', '1.0'))
+
+# Seconds between keepalive comments on the aggregate event stream
+AGGREGATE_STREAM_HEARTBEAT = float(os.environ.get('AGGREGATE_STREAM_HEARTBEAT', '15'))
+
+CELERY_BEAT_SCHEDULE = {
+    'relay-aggregate-outbox': {
+        'task': 'allocator.relay_aggregate_outbox',
+        'schedule': AGGREGATE_FLUSH_INTERVAL,
+    },
+    'flush-submission-buffer': {
+        'task': 'allocator.flush_submission_buffer',
+        'schedule': AGGREGATE_FLUSH_INTERVAL,
+    },
+    'compact-applied-submissions': {
+        'task': 'allocator.compact_applied_submissions',
+        'schedule': AGGREGATE_LEDGER_COMPACT_INTERVAL,
+    },
+    'checkpoint-aggregate-accumulator': {
+        'task': 'allocator.checkpoint_aggregate_accumulator',
+        'schedule': AGGREGATE_CHECKPOINT_INTERVAL,
+    },
+}